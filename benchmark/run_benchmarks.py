@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmark.synthetic import generate_dataset
+from instrumentation import metrics
+from parser.raw_reader import read_raw_transactions
+
+STAGES = ('parse_event_log', 'compute_transitions', 'compute_dependency_confidence', 'orchestrate')
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    """
+    :param who: resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN
+    :return: the peak resident set size in MB
+    """
+    peak_rss = resource.getrusage(who).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak_rss / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def load_parsed_events(dataset: dict, lookups) -> list:
+    """
+    :param dataset: the data set as returned by 'generate_dataset'
+    :param lookups: the lookups as returned by 'load_lookups'
+    :return: the parsed events of every raw transaction file
+    """
+    from parser import event_log_parser as parser
+    transaction_lookup, addresses_lookup, block_times, actor_attributes = lookups
+    return [parser.parse_event_log(next(read_raw_transactions(raw_file)), transaction_lookup, addresses_lookup, block_times,
+                                   actor_attributes=actor_attributes)[0] for raw_file in dataset['raw_files']]
+
+
+def get_day_groups(events_list) -> list:
+    """
+    :param events_list: parsed events
+    :return: the events of every day of every file, as mined by the orchestrator
+    """
+    from parser.block_index import get_day_ordinals
+    return [group for events in events_list
+            for day, group in events.groupby(get_day_ordinals(events['timestamp'].values))]
+
+
+def run_stage(stage, dataset: dict, work_directory) -> dict:
+    """
+    Runs and times one stage on a data set. Inputs of a stage are prepared before the timing starts, the peak RSS is
+    reset after preparing them (Linux only, otherwise it includes the preparation). The orchestrator runs as a
+    subprocess of its own, its peak RSS is the one of the subprocess.
+    :param stage: one of STAGES
+    :param dataset: the data set as returned by 'generate_dataset'
+    :param work_directory: a directory the stage may write to
+    :return: a dict with the 'rows' processed by the stage (raw transactions, events or aggregated transitions), the
+    'seconds', the 'peak_rss_mb' and the 'peak_rss_delta_mb' over the RSS after preparing the inputs
+    """
+    os.chdir(work_directory)
+    if stage == 'orchestrate':
+        bulk_directory = os.path.join(work_directory, 'bulk')
+        shutil.copytree(os.path.dirname(dataset['raw_files'][0]), bulk_directory)
+        environment = dict(os.environ, PYTHONPATH=REPOSITORY_ROOT)
+        start = time.time()
+        subprocess.check_call([sys.executable, '-m', 'orchestration.orchestrate', bulk_directory,
+                               dataset['transaction_lookup'], dataset['address_lookup'], dataset['block_times']],
+                              cwd=work_directory, env=environment, stdout=subprocess.DEVNULL)
+        seconds = time.time() - start
+        return {'rows': dataset['events'], 'seconds': seconds,
+                'peak_rss_mb': get_peak_rss_mb(resource.RUSAGE_CHILDREN), 'peak_rss_delta_mb': None}
+
+    from orchestration.orchestrate import load_lookups
+    from parser import event_log_parser as parser
+    from miner import heuristic_miner as miner
+    lookups = load_lookups(dataset['transaction_lookup'], dataset['address_lookup'], dataset['block_times'])
+
+    if stage == 'parse_event_log':
+        transaction_lookup, addresses_lookup, block_times, actor_attributes = lookups
+        raw_transactions_list = [next(read_raw_transactions(raw_file)) for raw_file in dataset['raw_files']]
+        stage_peak = metrics.start_rss_tracking()
+        start = time.time()
+        for raw_transactions in raw_transactions_list:
+            parser.parse_event_log(raw_transactions, transaction_lookup, addresses_lookup, block_times,
+                                   actor_attributes=actor_attributes)
+        seconds = time.time() - start
+        rows = sum(len(raw_transactions) for raw_transactions in raw_transactions_list)
+    elif stage == 'compute_transitions':
+        groups = get_day_groups(load_parsed_events(dataset, lookups))
+        stage_peak = metrics.start_rss_tracking()
+        start = time.time()
+        for group in groups:
+            miner.compute_transitions(group)
+        seconds = time.time() - start
+        rows = sum(len(group) for group in groups)
+    elif stage == 'compute_dependency_confidence':
+        groups = get_day_groups(load_parsed_events(dataset, lookups))
+        aggregated_transitions = [miner.compute_transitions(group)[1] for group in groups]
+        stage_peak = metrics.start_rss_tracking()
+        start = time.time()
+        for transitions_agg in aggregated_transitions:
+            miner.compute_dependency_confidence(transitions_agg)
+        seconds = time.time() - start
+        rows = sum(len(transitions_agg) for transitions_agg in aggregated_transitions)
+    else:
+        raise ValueError('Unknown stage {}, expected one of {}'.format(stage, STAGES))
+    start_rss, peak_rss = metrics.stop_rss_tracking(stage_peak)
+    if peak_rss is None:
+        return {'rows': rows, 'seconds': seconds, 'peak_rss_mb': get_peak_rss_mb(), 'peak_rss_delta_mb': None}
+    return {'rows': rows, 'seconds': seconds, 'peak_rss_mb': peak_rss, 'peak_rss_delta_mb': peak_rss - start_rss}
+
+
+def run_stage_isolated(stage, dataset: dict) -> dict:
+    """
+    Runs a stage in a fresh process and a temporary work directory.
+    :param stage: one of STAGES
+    :param dataset: the data set as returned by 'generate_dataset'
+    :return: the measurements as returned by 'run_stage'
+    """
+    work_directory = tempfile.mkdtemp(prefix='benchmark_{}_'.format(stage))
+    try:
+        pool = multiprocessing.get_context('spawn').Pool(1)
+        try:
+            return pool.apply(run_stage, (stage, dataset, work_directory))
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def get_git_revision() -> str:
+    """
+    :return: the current git revision of the repository, None if unknown
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, stages=STAGES, repeat=1, data_directory=None, **dataset_arguments) -> dict:
+    """
+    Runs the stages on synthetic data sets of several sizes.
+    :param sizes: the amounts of blocks of the data sets
+    :param stages: the stages to run
+    :param repeat: the amount of runs per stage and size, the fastest one is reported
+    :param data_directory: the directory to generate the data sets in, a temporary one if None
+    :param dataset_arguments: further arguments of 'generate_dataset'
+    :return: the results with one entry per stage and size
+    """
+    temporary = data_directory is None
+    data_directory = tempfile.mkdtemp(prefix='benchmark_data_') if temporary else data_directory
+    results = []
+    try:
+        for blocks in sizes:
+            dataset = generate_dataset(os.path.join(data_directory, 'blocks{}'.format(blocks)), blocks,
+                                       **dataset_arguments)
+            dataset = dict(dataset, raw_files=[os.path.abspath(path) for path in dataset['raw_files']])
+            for key in ['address_lookup', 'transaction_lookup', 'block_times', 'contracts']:
+                dataset[key] = os.path.abspath(dataset[key])
+            for stage in stages:
+                runs = [run_stage_isolated(stage, dataset) for i in range(repeat)]
+                best = min(runs, key=lambda run: run['seconds'])
+                deltas = [run['peak_rss_delta_mb'] for run in runs if run['peak_rss_delta_mb'] is not None]
+                result = {'stage': stage, 'blocks': blocks, 'transactions': dataset['transactions'],
+                          'events': dataset['events'], 'rows': best['rows'], 'seconds': best['seconds'],
+                          'rows_per_second': best['rows'] / best['seconds'] if best['seconds'] > 0 else None,
+                          'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+                          'peak_rss_delta_mb': max(deltas) if deltas else None, 'repeat': repeat}
+                results.append(result)
+                print('{} - {} on {} blocks: {:.0f} rows/s, peak RSS {:.1f} MB'.format(
+                    datetime.datetime.now(), stage, blocks, result['rows_per_second'] or 0, result['peak_rss_mb']))
+    finally:
+        if temporary:
+            shutil.rmtree(data_directory, ignore_errors=True)
+    return {'created': datetime.datetime.now().isoformat(),
+            'git_revision': get_git_revision(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'dataset': dataset_arguments,
+            'results': results}
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmarks parser, miner and orchestrator on synthetic '
+                                                          'data sets.')
+    argument_parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                                 help='amounts of blocks of the data sets')
+    argument_parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    argument_parser.add_argument('--repeat', type=int, default=1, help='runs per stage and size, the fastest counts')
+    argument_parser.add_argument('--output', default='benchmark_results.json', help='json file to write results to')
+    argument_parser.add_argument('--data-directory', default=None,
+                                 help='directory to keep the generated data sets in, a temporary one if not given')
+    argument_parser.add_argument('--transactions-per-block', type=float, default=10)
+    argument_parser.add_argument('--calls-per-transaction', type=float, default=4)
+    argument_parser.add_argument('--contract-ratio', type=float, default=0.3)
+    argument_parser.add_argument('--blocks-per-file', type=int, default=500)
+    argument_parser.add_argument('--seed', type=int, default=0)
+    args = argument_parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.stages, args.repeat, args.data_directory,
+                             transactions_per_block=args.transactions_per_block,
+                             calls_per_transaction=args.calls_per_transaction, contract_ratio=args.contract_ratio,
+                             blocks_per_file=args.blocks_per_file, seed=args.seed)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=1)
+    print('Wrote results to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
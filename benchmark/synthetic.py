@@ -0,0 +1,187 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from parser.lookup_builder import build_lookups
+
+RAW_TRANSACTION_COLUMNS = ['action.from', 'action.input', 'action.to', 'blockNumber', 'error', 'result', 'subtraces',
+                           'traceAddress', 'transactionHash', 'transactionPosition', 'type']
+RAW_DIRECTORY = 'raw'
+ADDRESS_LOOKUP_FILENAME = 'address_lookup.csv'
+TRANSACTION_LOOKUP_FILENAME = 'transaction_lookup.csv'
+BLOCK_TIMES_FILENAME = 'block_times.csv'
+CONTRACTS_FILENAME = 'contracts.csv'
+
+
+def random_hex(rng: np.random.RandomState, amount, width) -> np.ndarray:
+    """
+    :param rng: the random state
+    :param amount: the amount of hex strings
+    :param width: the amount of bytes of every hex string, e.g. 20 for addresses
+    :return: an object array of '0x' prefixed random hex strings
+    """
+    if amount == 0:
+        return np.array([], dtype=object)
+    hex_strings = np.frombuffer(rng.bytes(amount * width).hex().encode('ascii'), dtype='S{}'.format(2 * width))
+    return np.char.add(b'0x', hex_strings).astype(str).astype(object)
+
+
+def generate_raw_transactions(rng: np.random.RandomState, blocks, first_block=5000000, transactions_per_block=10,
+                              calls_per_transaction=4, addresses=10000, contract_ratio=0.3, create_ratio=0.02,
+                              functions=100) -> (pd.DataFrame, np.ndarray, np.ndarray):
+    """
+    Generates raw Parity traces. Every transaction is started by a user, its subsequent calls are made by contracts.
+    :param rng: the random state
+    :param blocks: the amount of blocks
+    :param first_block: the number of the first block
+    :param transactions_per_block: the mean amount of transactions per block (poisson distributed)
+    :param calls_per_transaction: the mean amount of calls per transaction, at least 1
+    :param addresses: the amount of distinct addresses
+    :param contract_ratio: the share of contracts in the addresses
+    :param create_ratio: the share of contract creations in the calls
+    :param functions: the amount of distinct function selectors in the call inputs
+    :return: the raw transactions with the columns RAW_TRANSACTION_COLUMNS, the addresses, the boolean contract flags
+    of the addresses
+    """
+    address_hex = random_hex(rng, addresses, 20)
+    contracts = max(1, min(addresses - 1, int(round(addresses * contract_ratio))))
+    is_contract = np.arange(addresses) < contracts
+
+    transactions = rng.poisson(transactions_per_block, blocks)
+    block_numbers = np.repeat(np.arange(first_block, first_block + blocks, dtype=np.int64), transactions)
+    transaction_starts = np.repeat(np.cumsum(transactions) - transactions, transactions)
+    transaction_positions = np.arange(len(block_numbers)) - transaction_starts
+
+    calls = 1 + rng.poisson(max(calls_per_transaction - 1, 0), len(block_numbers))
+    events = calls.sum()
+    transaction_index = np.repeat(np.arange(len(block_numbers)), calls)
+    call_positions = np.arange(events) - np.repeat(np.cumsum(calls) - calls, calls)
+    is_root = call_positions == 0
+
+    senders = np.where(is_root, rng.randint(contracts, addresses, events), rng.randint(0, contracts, events))
+    receivers = rng.randint(0, addresses, events)
+    types = np.where(rng.rand(events) < create_ratio, 'create', 'call').astype(object)
+    selectors = np.array(['0x{:08x}'.format(selector) for selector in rng.randint(0, 2 ** 32, functions)], dtype=object)
+    arguments = np.array(['', '0' * 64, '0' * 128], dtype=object)
+
+    raw_transactions = pd.DataFrame({
+        'action.from': address_hex[senders],
+        'action.input': selectors[rng.randint(0, functions, events)] + arguments[rng.randint(0, 3, events)],
+        'action.to': np.where(types == 'call', address_hex[receivers], np.nan),
+        'blockNumber': block_numbers[transaction_index],
+        'error': np.nan,
+        'result': np.nan,
+        'subtraces': np.where(is_root, calls[transaction_index] - 1, 0),
+        'traceAddress': np.where(is_root, '[]', np.char.add(np.char.add('[', (call_positions - 1).astype(str)), ']')),
+        'transactionHash': random_hex(rng, len(block_numbers), 32)[transaction_index],
+        'transactionPosition': transaction_positions[transaction_index],
+        'type': types}, columns=RAW_TRANSACTION_COLUMNS)
+    return raw_transactions, address_hex, is_contract
+
+
+def generate_dataset(directory, blocks=1000, first_block=5000000, transactions_per_block=10, calls_per_transaction=4,
+                     addresses=10000, contract_ratio=0.3, erc20_ratio=0.2, create_ratio=0.02, functions=100,
+                     blocks_per_file=500, block_interval=15, first_timestamp=1523059200, missing_block_ratio=0.0,
+                     seed=0) -> dict:
+    """
+    Generates a synthetic data set: raw transaction csv files and the matching contracts, address, transaction and
+    block times lookups, as written by the address and transaction shortener.
+    :param directory: the directory to write to. The raw transaction files are written to its subdirectory 'raw'.
+    :param blocks: the amount of blocks
+    :param first_block: the number of the first block
+    :param transactions_per_block: the mean amount of transactions per block
+    :param calls_per_transaction: the mean amount of calls per transaction
+    :param addresses: the amount of distinct addresses
+    :param contract_ratio: the share of contracts in the addresses
+    :param erc20_ratio: the share of ERC20 tokens in the contracts
+    :param create_ratio: the share of contract creations in the calls
+    :param functions: the amount of distinct function selectors in the call inputs
+    :param blocks_per_file: the amount of blocks per raw transaction file
+    :param block_interval: the seconds between two blocks
+    :param first_timestamp: the timestamp of the first block
+    :param missing_block_ratio: the share of blocks missing in the block times
+    :param seed: the random seed
+    :return: a dict with the paths 'raw_files', 'address_lookup', 'transaction_lookup', 'block_times', 'contracts' and
+    the amounts of 'blocks', 'transactions' and 'events'
+    """
+    rng = np.random.RandomState(seed)
+    raw_directory = os.path.join(directory, RAW_DIRECTORY)
+    if not os.path.isdir(raw_directory):
+        os.makedirs(raw_directory)
+
+    raw_transactions, address_hex, is_contract = generate_raw_transactions(
+        rng, blocks, first_block, transactions_per_block, calls_per_transaction, addresses, contract_ratio,
+        create_ratio, functions)
+
+    raw_files = []
+    for file_first_block in range(first_block, first_block + blocks, blocks_per_file):
+        file_last_block = min(file_first_block + blocks_per_file, first_block + blocks)
+        in_file = (raw_transactions['blockNumber'] >= file_first_block) & \
+                  (raw_transactions['blockNumber'] < file_last_block)
+        raw_file = os.path.join(raw_directory, 'transactions{}-{}.csv'.format(file_first_block, file_last_block))
+        raw_transactions[in_file].to_csv(raw_file, index=False)
+        raw_files.append(raw_file)
+
+    numbers = np.arange(first_block, first_block + blocks, dtype=np.int64)
+    numbers = numbers[rng.rand(blocks) >= missing_block_ratio]
+    block_times = pd.DataFrame({'number': numbers, 'timestamp': first_timestamp + (numbers - first_block) * block_interval},
+                               columns=['number', 'timestamp'])
+
+    contract_hex = address_hex[is_contract]
+    contracts_lookup = pd.DataFrame({'blockNumber': first_block,
+                                     'result.address': contract_hex,
+                                     'isERC20': rng.rand(len(contract_hex)) < erc20_ratio,
+                                     'timestamp': first_timestamp},
+                                    columns=['blockNumber', 'result.address', 'isERC20', 'timestamp'])
+
+    address_set = set(raw_transactions['action.from'].dropna()) | set(raw_transactions['action.to'].dropna())
+    addresses_lookup, transaction_lookup = build_lookups(address_set, set(raw_transactions['transactionHash']),
+                                                         contracts_lookup)
+    erc20 = contracts_lookup[['result.address', 'isERC20']].rename(columns={'result.address': 'address_hex'})
+    addresses_lookup = addresses_lookup.merge(erc20, on='address_hex', how='left')
+
+    paths = {'raw_files': raw_files,
+             'address_lookup': os.path.join(directory, ADDRESS_LOOKUP_FILENAME),
+             'transaction_lookup': os.path.join(directory, TRANSACTION_LOOKUP_FILENAME),
+             'block_times': os.path.join(directory, BLOCK_TIMES_FILENAME),
+             'contracts': os.path.join(directory, CONTRACTS_FILENAME)}
+    addresses_lookup.to_csv(paths['address_lookup'], index=False)
+    transaction_lookup.to_csv(paths['transaction_lookup'], index=False)
+    block_times.to_csv(paths['block_times'], index=False)
+    contracts_lookup.to_csv(paths['contracts'], index=False)
+
+    paths.update({'blocks': blocks, 'transactions': len(transaction_lookup), 'events': len(raw_transactions)})
+    return paths
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Generates a synthetic raw transaction data set with '
+                                                          'matching lookups.')
+    argument_parser.add_argument('directory', help='directory to write the data set to')
+    argument_parser.add_argument('--blocks', type=int, default=1000)
+    argument_parser.add_argument('--first-block', type=int, default=5000000)
+    argument_parser.add_argument('--transactions-per-block', type=float, default=10)
+    argument_parser.add_argument('--calls-per-transaction', type=float, default=4)
+    argument_parser.add_argument('--addresses', type=int, default=10000)
+    argument_parser.add_argument('--contract-ratio', type=float, default=0.3)
+    argument_parser.add_argument('--erc20-ratio', type=float, default=0.2)
+    argument_parser.add_argument('--create-ratio', type=float, default=0.02)
+    argument_parser.add_argument('--functions', type=int, default=100)
+    argument_parser.add_argument('--blocks-per-file', type=int, default=500)
+    argument_parser.add_argument('--block-interval', type=int, default=15, help='seconds between two blocks')
+    argument_parser.add_argument('--missing-block-ratio', type=float, default=0.0)
+    argument_parser.add_argument('--seed', type=int, default=0)
+    args = argument_parser.parse_args()
+
+    dataset = generate_dataset(args.directory, args.blocks, args.first_block, args.transactions_per_block,
+                               args.calls_per_transaction, args.addresses, args.contract_ratio, args.erc20_ratio,
+                               args.create_ratio, args.functions, args.blocks_per_file, args.block_interval,
+                               missing_block_ratio=args.missing_block_ratio, seed=args.seed)
+    print('Generated {} events of {} transactions in {} files'.format(dataset['events'], dataset['transactions'],
+                                                                     len(dataset['raw_files'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,12 @@ RAW_TRANSACTION_COLUMN_NAMES = {'action.from', 'action.to', 'blockNumber', 'erro
 CONTRACT_LOOKUP_COLUMN_NAMES = {'result.address'}
 BLOCK_TIMES_COLUMN_NAMES = {'number', 'timestamp'}
 TRANSACTION_LOOKUP_COLUMN_NAMES = {'transaction_hash', 'id'}
-ADDRESSES_LOOKUP_COLUMN_NAMES = {'address_hex', 'isContract', 'id'}
\ No newline at end of file
+ADDRESSES_LOOKUP_COLUMN_NAMES = {'address_hex', 'isContract', 'id'}
+ACTIVITY_ALPHABET = ('sta', 'CtC', 'CtU', 'UtC', 'UtU', 'end')
+TRANSITION_COLUMN_NAMES = ['CtC->CtC', 'CtC->CtU', 'CtC->UtU', 'CtC->end', 'CtU->CtC', 'CtU->CtU', 'CtU->UtC',
+                           'CtU->UtU', 'CtU->end', 'UtC->CtC', 'UtC->CtU', 'UtC->UtC', 'UtC->UtU', 'UtC->end',
+                           'UtU->CtC', 'UtU->CtU', 'UtU->UtC', 'UtU->UtU', 'UtU->end', 'sta->CtC', 'sta->UtC',
+                           'sta->UtU']
+# Columns of the raw transactions read for parsing and their dtypes
+RAW_TRANSACTION_DTYPES = {'action.from': 'category', 'action.input': 'object', 'action.to': 'category',
+                          'blockNumber': 'int64', 'transactionHash': 'category', 'type': 'category'}
@@ -0,0 +1,297 @@
+import contextlib
+import cProfile
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_MODES = ('cpu', 'memory', 'both')
+TRACEMALLOC_TOP_STATS = 50
+
+# Settings of the current process, set by 'configure'
+metrics_path = None
+profile_mode = None
+profile_stages = None
+profile_directory = None
+
+# Tags and profiling state of the current thread, so that stages of background threads, e.g. of prefetching, do not
+# mix with the ones of the main thread
+thread_state = threading.local()
+profile_counter = itertools.count(1)
+
+# Peak resident set sizes of the stages open in any thread, see 'start_rss_tracking'
+open_stage_peaks = []
+rss_lock = threading.Lock()
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def configure(metrics_file=None, profile=None, stages=None, profile_output=None):
+    """
+    Configures the instrumentation of the current process. Process pools call it in their initializer with the
+    settings returned by 'get_settings'.
+    :param metrics_file: the json lines file to append a record per stage to, None to not record
+    :param profile: None, or one of PROFILE_MODES to profile stages with cProfile, tracemalloc or both
+    :param stages: the names of the stages to profile, None for all
+    :param profile_output: the directory to write the profiles to, the directory of the metrics file if None
+    """
+    global metrics_path, profile_mode, profile_stages, profile_directory
+    if profile is not None and profile not in PROFILE_MODES:
+        raise ValueError('Unknown profile mode {}, expected one of {}'.format(profile, PROFILE_MODES))
+    metrics_path = os.path.abspath(metrics_file) if metrics_file is not None else None
+    profile_mode = profile
+    profile_stages = set(stages) if stages is not None else None
+    if profile_output is None:
+        profile_output = os.path.dirname(metrics_path) if metrics_path is not None else os.getcwd()
+    profile_directory = os.path.abspath(profile_output)
+
+
+def get_settings() -> dict:
+    """
+    :return: the settings of the current process as keyword arguments of 'configure'
+    """
+    return {'metrics_file': metrics_path, 'profile': profile_mode,
+            'stages': sorted(profile_stages) if profile_stages is not None else None,
+            'profile_output': profile_directory}
+
+
+def setup_logging(filename):
+    """
+    Sets up the log file of a script. The path is resolved once, hence changing the working directory later on does
+    not move the log file.
+    :param filename: the log file
+    """
+    logging.basicConfig(filename=os.path.abspath(filename),
+                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m-%d %H:%M',
+                        level=logging.DEBUG)
+
+
+def get_peak_rss_mb() -> float:
+    """
+    :return: the peak resident set size of the current process in MB, over its lifetime unless reset by
+    'reset_peak_rss'
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak_rss / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def get_rss_mb() -> (float, float):
+    """
+    :return: the current and the peak resident set size of the current process in MB since the last 'reset_peak_rss',
+    None and None if not available (Linux only)
+    """
+    try:
+        with open(PROC_STATUS) as status_file:
+            fields = dict(line.split(':', 1) for line in status_file if line.startswith(('VmRSS', 'VmHWM')))
+        return float(fields['VmRSS'].split()[0]) / 1024.0, float(fields['VmHWM'].split()[0]) / 1024.0
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident set size of the current process to the current one (Linux only).
+    :return: True if reset
+    """
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def start_rss_tracking() -> list:
+    """
+    Starts tracking the peak resident set size of a stage. The peak of the process is reset at the start of every
+    stage, hence it is folded into the peaks of all open stages before.
+    :return: the resident set size at the start and the peak so far in MB, updated by 'stop_rss_tracking'. None and
+    None if not available.
+    """
+    with rss_lock:
+        current, peak = get_rss_mb()
+        if current is None or not reset_peak_rss():
+            return [None, None]
+        for stage_peak in open_stage_peaks:
+            stage_peak[1] = max(stage_peak[1], peak)
+        stage_peak = [current, current]
+        open_stage_peaks.append(stage_peak)
+        return stage_peak
+
+
+def stop_rss_tracking(stage_peak: list) -> (float, float):
+    """
+    :param stage_peak: as returned by 'start_rss_tracking'
+    :return: the resident set size at the start and the peak of the stage in MB, None and None if not available
+    """
+    if stage_peak[0] is None:
+        return None, None
+    with rss_lock:
+        current, peak = get_rss_mb()
+        for open_stage_peak in open_stage_peaks:
+            open_stage_peak[1] = max(open_stage_peak[1], peak)
+        # Removed by identity, peaks of several stages may be equal
+        open_stage_peaks[:] = [other for other in open_stage_peaks if other is not stage_peak]
+    return stage_peak[0], stage_peak[1]
+
+
+def get_current_tags() -> dict:
+    """
+    :return: the tags of the current thread
+    """
+    return getattr(thread_state, 'tags', {})
+
+
+@contextlib.contextmanager
+def tagged(**tags):
+    """
+    Tags all stages recorded within the context in the current thread, e.g. with the file or day being processed.
+    :param tags: the tags
+    """
+    previous_tags = get_current_tags()
+    thread_state.tags = dict(previous_tags, **tags)
+    try:
+        yield
+    finally:
+        thread_state.tags = previous_tags
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None, **tags):
+    """
+    Records a stage: its wall and CPU time, rows in and out and the peak memory, tagged with the current tags. The
+    peak memory is the one of the process while the stage runs, 'peak_rss_delta_mb' its increase over the start of the
+    stage. Where the peak can not be reset (not Linux) it is the peak of the process so far. Profiles the stage if
+    enabled for it and no enclosing stage of the thread is profiled already.
+    :param name: the name of the stage, e.g. 'read_csv'
+    :param rows_in: the amount of input rows
+    :param tags: further tags of the stage
+    :return: the record of the stage. Set its 'rows_out' within the context. Timings are filled in on exit.
+    """
+    record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+    record.update(get_current_tags())
+    record.update(tags)
+    profiling = getattr(thread_state, 'profiling', False)
+    profile = profile_mode is not None and not profiling and (profile_stages is None or name in profile_stages)
+    if profile:
+        thread_state.profiling = True
+        profiler = start_profile()
+
+    stage_peak = start_rss_tracking()
+    start_wall = time.time()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.time() - start_wall
+        record['cpu_seconds'] = time.process_time() - start_cpu
+        start_rss, peak_rss = stop_rss_tracking(stage_peak)
+        if profile:
+            record.update(stop_profile(profiler, record))
+            thread_state.profiling = False
+        if peak_rss is not None:
+            record['peak_rss_mb'] = peak_rss
+            record['peak_rss_delta_mb'] = peak_rss - start_rss
+        else:
+            record['peak_rss_mb'] = get_peak_rss_mb()
+        record['pid'] = os.getpid()
+        record['timestamp'] = start_wall
+        write_record(record)
+
+
+def write_record(record: dict):
+    """
+    Appends a record to the metrics file. Every record is a single write of one line, hence records of concurrent
+    processes do not interleave.
+    :param record: the record
+    """
+    if metrics_path is None:
+        return
+    line = '{}\n'.format(json.dumps(record, default=str)).encode('utf-8')
+    descriptor = os.open(metrics_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+def start_profile():
+    """
+    :return: the cProfile.Profile of the stage, None if only memory is profiled, and if tracemalloc was started for it.
+    tracemalloc traces the whole process, hence it is not started again for stages of other threads.
+    """
+    profiler = None
+    if profile_mode in ('cpu', 'both'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    traced = profile_mode in ('memory', 'both') and not tracemalloc.is_tracing()
+    if traced:
+        tracemalloc.start()
+    return profiler, traced
+
+
+def stop_profile(profiler, record: dict) -> dict:
+    """
+    Stops profiling a stage and writes its profiles: '<name>.prof' for cProfile, readable with pstats, and
+    '<name>.tracemalloc.txt' with the lines allocating the most memory.
+    :param profiler: the profiler and tracing flag returned by 'start_profile'
+    :param record: the record of the stage
+    :return: the profile fields of the record
+    """
+    if not os.path.isdir(profile_directory):
+        os.makedirs(profile_directory)
+    tags = '_'.join(str(value) for key, value in sorted(get_current_tags().items()))
+    name = '{}_{}_{}_{}'.format(record['stage'], tags, os.getpid(), next(profile_counter))
+    name = ''.join(character if character.isalnum() or character in '-_.' else '_' for character in name)
+
+    profiler, traced = profiler
+    fields = {}
+    if profiler is not None:
+        profiler.disable()
+        fields['cprofile'] = os.path.join(profile_directory, '{}.prof'.format(name))
+        profiler.dump_stats(fields['cprofile'])
+    if traced:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        fields['tracemalloc_peak_mb'] = peak / 1024.0 / 1024.0
+        fields['tracemalloc'] = os.path.join(profile_directory, '{}.tracemalloc.txt'.format(name))
+        with open(fields['tracemalloc'], 'w') as profile_file:
+            profile_file.write('Peak traced memory: {} bytes\n'.format(peak))
+            for statistic in snapshot.statistics('lineno')[:TRACEMALLOC_TOP_STATS]:
+                profile_file.write('{}\n'.format(statistic))
+    return fields
+
+
+def add_arguments(argument_parser, log_file):
+    """
+    Adds the logging and instrumentation arguments to the argument parser of a script.
+    :param argument_parser: the argparse.ArgumentParser
+    :param log_file: the default log file
+    """
+    argument_parser.add_argument('--log-file', default=log_file, help='log file')
+    argument_parser.add_argument('--metrics-file', default=None,
+                                 help='json lines file to append the wall and cpu time, rows and peak memory of every '
+                                      'stage to')
+    argument_parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                                 help='profile stages with cProfile (cpu), tracemalloc (memory) or both')
+    argument_parser.add_argument('--profile-stages', nargs='+', default=None,
+                                 help='names of the stages to profile, all if not given')
+    argument_parser.add_argument('--profile-directory', default=None,
+                                 help='directory to write the profiles to, next to the metrics file if not given')
+
+
+def configure_from_arguments(args):
+    """
+    Sets up logging and instrumentation from the arguments added by 'add_arguments'.
+    :param args: the parsed arguments
+    """
+    setup_logging(args.log_file)
+    configure(args.metrics_file, args.profile, args.profile_stages, args.profile_directory)
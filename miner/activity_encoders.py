@@ -0,0 +1,90 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+# The selector of calls without input, e.g. plain ether transfers
+EMPTY_SELECTOR = '0x'
+SELECTOR_LENGTH = len('0x') + 8
+ACTIVITY_SEPARATOR = ':'
+
+
+def encode_transaction_types(event_log: pd.DataFrame) -> (np.ndarray, pd.Index):
+    """
+    The default activity encoder: the activity of an event is its transaction type, e.g. 'UtC'.
+    :param event_log: a pandas dataframe with at least the column 'transaction_type'
+    :return: the int64 activity code of every event, the observed activities of the codes
+    """
+    activities = event_log['transaction_type'].astype('category')
+    return activities.cat.codes.values.astype(np.int64), \
+        pd.Index([str(activity) for activity in activities.cat.categories])
+
+
+def encode_function_selectors(event_log: pd.DataFrame, with_receiver=False, with_erc20=False) -> (np.ndarray,
+                                                                                                   pd.Index):
+    """
+    An activity encoder for fine grained processes: the activity of an event is the 4 byte function selector of its
+    call input, e.g. '0xa9059cbb', optionally combined with the receiver id and whether the receiver is an ERC20 token,
+    e.g. '0xa9059cbb:1234:ERC20'.
+    :param event_log: a pandas dataframe with at least the column 'action.input', 'receiver_id' if with_receiver and
+    'receiverIsERC20' if with_erc20
+    :param with_receiver: combine the selector with the receiver id
+    :param with_erc20: combine the selector with the ERC20 flag of the receiver
+    :return: the int64 activity code of every event, the activities of the codes
+    """
+    # Selectors are derived per distinct input, the inputs of a contract repeat
+    input_codes, inputs = pd.factorize(event_log['action.input'].values)
+    selectors = pd.Series(inputs, dtype=object).astype(str).str.slice(0, SELECTOR_LENGTH).str.lower()
+    selector_codes, activities = pd.factorize(np.append(selectors.values, EMPTY_SELECTOR))
+    codes = selector_codes[input_codes]
+    activities = [str(activity) for activity in activities]
+
+    if with_receiver:
+        receiver_codes, receivers = pd.factorize(event_log['receiver_id'].values)
+        codes, activities = combine_activities(codes, activities, receiver_codes,
+                                               [str(receiver) for receiver in receivers])
+    if with_erc20:
+        codes, activities = combine_activities(codes, activities,
+                                               event_log['receiverIsERC20'].values.astype(np.int64),
+                                               ['nonERC20', 'ERC20'])
+    return codes, pd.Index(activities)
+
+
+def combine_activities(codes: np.ndarray, activities, other_codes: np.ndarray, other_activities) -> (np.ndarray, list):
+    """
+    Combines two encodings of the same events into one, only observed combinations become activities.
+    :param codes: the activity codes of the events
+    :param activities: the activities of the codes
+    :param other_codes: further activity codes of the events
+    :param other_activities: the activities of the further codes
+    :return: the combined activity codes, the combined activities, e.g. '0xa9059cbb:ERC20'
+    """
+    keys = codes.astype(np.int64) * len(other_activities) + other_codes
+    observed, combined_codes = np.unique(keys, return_inverse=True)
+    combined_activities = ['{}{}{}'.format(activities[key // len(other_activities)], ACTIVITY_SEPARATOR,
+                                           other_activities[key % len(other_activities)]) for key in observed]
+    return combined_codes.astype(np.int64), combined_activities
+
+
+ACTIVITY_ENCODERS = {
+    'transaction_type': encode_transaction_types,
+    'function_selector': encode_function_selectors,
+    'function_selector_receiver': functools.partial(encode_function_selectors, with_receiver=True),
+    'function_selector_erc20': functools.partial(encode_function_selectors, with_erc20=True),
+}
+
+
+def get_activity_encoder(activity_encoder):
+    """
+    :param activity_encoder: None for the transaction types, a name of ACTIVITY_ENCODERS or a function taking an event
+    log and returning the int64 activity code of every event and the activities of the codes
+    :return: the activity encoder function
+    """
+    if activity_encoder is None:
+        return encode_transaction_types
+    if callable(activity_encoder):
+        return activity_encoder
+    if activity_encoder not in ACTIVITY_ENCODERS:
+        raise ValueError('Unknown activity encoder {}, expected one of {}'.format(activity_encoder,
+                                                                                  sorted(ACTIVITY_ENCODERS)))
+    return ACTIVITY_ENCODERS[activity_encoder]
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+
+from config.constants import ACTIVITY_ALPHABET
+from miner import heuristic_miner as miner
+
+
+class DependencyGraphBuilder(object):
+    """
+    Builds dependency graphs, see 'compute_dependency_graph', for many days and cutoffs at once. The relative
+    frequencies and significances (dependency confidences) of all transitions are precomputed per day as
+    (days, activities, activities) arrays. Edges of a day range are derived by masking these arrays, hence sweeping
+    cutoffs only compares arrays. Aggregates of day ranges and edge sets are cached by day range and cutoffs. networkx
+    graphs are only built on request by 'get_graph'.
+
+    A day range is aggregated by summing the transition counts of its days, as if 'compute_dependency_graph' was
+    called with the aggregated transitions of the range and their confidences.
+    """
+
+    def __init__(self, days, transition_counts: np.ndarray, alphabet=ACTIVITY_ALPHABET):
+        """
+        :param days: the days of the transition counts in ascending order
+        :param transition_counts: a (days, len(alphabet), len(alphabet)) tensor, see 'compute_transition_tensor'
+        :param alphabet: the activities of the matrix rows and columns
+        """
+        self.days = pd.DatetimeIndex(days, name='day')
+        self.alphabet = tuple(alphabet)
+        self.transition_counts = np.asarray(transition_counts, dtype=np.int64)
+        if self.transition_counts.shape != (len(self.days), len(self.alphabet), len(self.alphabet)):
+            raise ValueError('Expected transition counts of shape {}, got {}'.format(
+                (len(self.days), len(self.alphabet), len(self.alphabet)), self.transition_counts.shape))
+        if not self.days.is_monotonic_increasing:
+            raise ValueError('Days must be in ascending order')
+
+        totals = self.transition_counts.sum(axis=(1, 2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.relative = self.transition_counts / totals[:, np.newaxis, np.newaxis]
+        self.significance = miner.compute_dependency_confidence_matrix(self.transition_counts)
+        # Cumulative counts, the counts of days [i, j) are cumulative_counts[j] - cumulative_counts[i]
+        self.cumulative_counts = np.concatenate([np.zeros((1,) + self.transition_counts.shape[1:], dtype=np.int64),
+                                                 np.cumsum(self.transition_counts, axis=0)])
+        self.range_cache = {}
+        self.edge_cache = {}
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, alphabet=ACTIVITY_ALPHABET):
+        """
+        :param frame: transition counts in the wide per day layout, e.g. the reduced global dependencies written by
+        the orchestrator, with a 'day' column or index and a column per transition like 'UtC->CtU'. Other columns,
+        e.g. 'total_events', are ignored.
+        :param alphabet: the activities of the transitions
+        :return: the DependencyGraphBuilder
+        """
+        days, transition_counts = miner.transition_frame_to_tensor(frame, alphabet)
+        return cls(days, transition_counts, alphabet)
+
+    @classmethod
+    def from_event_log(cls, event_log: pd.DataFrame, alphabet=ACTIVITY_ALPHABET):
+        """
+        :param event_log: a pandas dataframe with at least the columns 'day', 'transaction_id', 'transaction_type'
+        :param alphabet: the activities, starting with the start and ending with the end activity.
+        :return: the DependencyGraphBuilder
+        """
+        days, transition_counts = miner.compute_transition_tensor(event_log, alphabet)
+        return cls(days, transition_counts, alphabet)
+
+    def get_day_range(self, start_day=None, end_day=None) -> (int, int):
+        """
+        :param start_day: the first day of the range, None for the first day
+        :param end_day: the last day of the range (inclusive), None for the last day
+        :return: the positions [start, end) of the days of the range
+        """
+        start = 0 if start_day is None else self.days.searchsorted(pd.Timestamp(start_day), side='left')
+        end = len(self.days) if end_day is None else self.days.searchsorted(pd.Timestamp(end_day), side='right')
+        return int(start), int(max(start, end))
+
+    def get_range_arrays(self, start_day=None, end_day=None) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        :param start_day: the first day of the range, None for the first day
+        :param end_day: the last day of the range (inclusive), None for the last day
+        :return: the transition counts, relative frequencies and significances of the range as
+        (len(alphabet), len(alphabet)) matrices
+        """
+        day_range = self.get_day_range(start_day, end_day)
+        if day_range not in self.range_cache:
+            start, end = day_range
+            if end - start == 1:
+                arrays = (self.transition_counts[start], self.relative[start], self.significance[start])
+            else:
+                counts = self.cumulative_counts[end] - self.cumulative_counts[start]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    relative = counts / counts.sum()
+                arrays = (counts, relative, miner.compute_dependency_confidence_matrix(counts))
+            self.range_cache[day_range] = arrays
+        return self.range_cache[day_range]
+
+    def get_edge_masks(self, relative_cutoffs, significance_cutoffs, start_day=None, end_day=None) -> np.ndarray:
+        """
+        Evaluates a grid of cutoffs at once.
+        :param relative_cutoffs: the relative frequency cutoffs
+        :param significance_cutoffs: the significance cutoffs
+        :param start_day: the first day of the range, None for the first day
+        :param end_day: the last day of the range (inclusive), None for the last day
+        :return: a boolean (len(relative_cutoffs), len(significance_cutoffs), len(alphabet), len(alphabet)) array,
+        True where the transition is an edge for the cutoffs
+        """
+        counts, relative, significance = self.get_range_arrays(start_day, end_day)
+        relative_cutoffs = np.asarray(relative_cutoffs, dtype=np.float64).reshape(-1, 1, 1, 1)
+        significance_cutoffs = np.asarray(significance_cutoffs, dtype=np.float64).reshape(1, -1, 1, 1)
+        with np.errstate(invalid='ignore'):
+            return (relative > relative_cutoffs) & (significance > significance_cutoffs) & (counts > 0)
+
+    def get_daily_edge_masks(self, relative_cutoff: float, significance_cutoff: float) -> np.ndarray:
+        """
+        :param relative_cutoff: the relative frequency cutoff
+        :param significance_cutoff: the significance cutoff
+        :return: a boolean (days, len(alphabet), len(alphabet)) array, True where the transition is an edge of the
+        graph of the day
+        """
+        with np.errstate(invalid='ignore'):
+            return (self.relative > relative_cutoff) & (self.significance > significance_cutoff) & \
+                   (self.transition_counts > 0)
+
+    def get_edges(self, relative_cutoff: float, significance_cutoff: float, start_day=None, end_day=None) -> frozenset:
+        """
+        :param relative_cutoff: the relative frequency cutoff
+        :param significance_cutoff: the significance cutoff
+        :param start_day: the first day of the range, None for the first day
+        :param end_day: the last day of the range (inclusive), None for the last day
+        :return: the edges as (act_a, act_b) tuples
+        """
+        key = self.get_day_range(start_day, end_day) + (relative_cutoff, significance_cutoff)
+        if key not in self.edge_cache:
+            mask = self.get_edge_masks([relative_cutoff], [significance_cutoff], start_day, end_day)[0, 0]
+            self.edge_cache[key] = self.mask_to_edges(mask)
+        return self.edge_cache[key]
+
+    def sweep(self, relative_cutoffs, significance_cutoffs, start_day=None, end_day=None) -> dict:
+        """
+        :param relative_cutoffs: the relative frequency cutoffs
+        :param significance_cutoffs: the significance cutoffs
+        :param start_day: the first day of the range, None for the first day
+        :param end_day: the last day of the range (inclusive), None for the last day
+        :return: a dict with the edges of every pair of cutoffs, keyed by (relative_cutoff, significance_cutoff)
+        """
+        day_range = self.get_day_range(start_day, end_day)
+        masks = self.get_edge_masks(relative_cutoffs, significance_cutoffs, start_day, end_day)
+        edges = {}
+        for i, relative_cutoff in enumerate(relative_cutoffs):
+            for j, significance_cutoff in enumerate(significance_cutoffs):
+                key = day_range + (relative_cutoff, significance_cutoff)
+                if key not in self.edge_cache:
+                    self.edge_cache[key] = self.mask_to_edges(masks[i, j])
+                edges[(relative_cutoff, significance_cutoff)] = self.edge_cache[key]
+        return edges
+
+    def mask_to_edges(self, mask: np.ndarray) -> frozenset:
+        return frozenset((self.alphabet[a], self.alphabet[b]) for a, b in zip(*np.nonzero(mask)))
+
+    def get_graph(self, relative_cutoff: float, significance_cutoff: float, start_day=None, end_day=None):
+        """
+        Builds the networkx graph of a day range, equal to the one of 'compute_dependency_graph' for the aggregated
+        transitions of the range.
+        :param relative_cutoff: the relative frequency cutoff
+        :param significance_cutoff: the significance cutoff
+        :param start_day: the first day of the range, None for the first day
+        :param end_day: the last day of the range (inclusive), None for the last day
+        :return: a nx.DiGraph
+        """
+        counts, relative, significance = self.get_range_arrays(start_day, end_day)
+        codes = {activity: code for code, activity in enumerate(self.alphabet)}
+        observed = counts > 0
+        nodes = [activity for code, activity in enumerate(self.alphabet)
+                 if observed[code].any() or observed[:, code].any()]
+        edges = sorted(self.get_edges(relative_cutoff, significance_cutoff, start_day, end_day),
+                       key=lambda edge: (codes[edge[0]], codes[edge[1]]))
+        a_codes = [codes[act_a] for act_a, act_b in edges]
+        b_codes = [codes[act_b] for act_a, act_b in edges]
+        return miner.build_dependency_graph(nodes, edges, relative[a_codes, b_codes], significance[a_codes, b_codes])
+
+    def clear_cache(self):
+        self.range_cache = {}
+        self.edge_cache = {}
@@ -1,58 +1,289 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
+from config.constants import ACTIVITY_ALPHABET, TRANSITION_COLUMN_NAMES
+from miner.activity_encoders import get_activity_encoder
 
-def compute_transitions(event_log: pd.DataFrame) -> (pd.DataFrame, pd.Series):
+START_ACTIVITY = ACTIVITY_ALPHABET[0]
+END_ACTIVITY = ACTIVITY_ALPHABET[-1]
+# Up to this amount of possible transitions labels are prepared for all of them, above only for the observed ones
+DENSE_TRANSITION_LIMIT = 2 ** 16
+
+
+def compute_transitions(event_log: pd.DataFrame, activity_encoder=None) -> (pd.DataFrame, pd.Series):
     """
     Takes an event log and computes the transition matrix and its aggregation. The transition matrix shows in a
     ordered fashion the transition from on transaction type to another coded as a category string value.
     Example: 'UtC->CtU'
+    The transitions are derived with array operations on the integer coded transaction types and transaction ids, see
+    'get_transition_codes'. Every row is emitted under the label 2 * row_label, an end transition under
+    2 * row_label + 1, directly after the row closing the case.
     :param event_log: a pandas dataframe with the columns 'total_pos', 'action.input', 'blockNumber',
     'senderIsContract', 'senderIsERC20', 'sender_id', 'receiverIsContract', 'receiverIsERC20',
    'receiver_id', 'timestamp', 'transaction_id', 'sender_type', 'receiver_type', 'transaction_type'
-    :param save_intermediate: save intermediate values as csv. True by default
-    :param save_prefix: prefix for the saved file names.
-    :param save_name: the name of the file to save.
+    :param activity_encoder: derives the activities of the events, None for the transaction types. See
+    'get_activity_encoder', e.g. 'function_selector'.
     :returns pd.DataFrame: the transitions, pd.Series: the transition occurrence frequencies as a Series.
     """
-    event_log['transaction_type'] = event_log['transaction_type'].astype('category')
-    event_log['receiver_type'] = event_log['transaction_type'].astype('category')
-    event_log['sender_type'] = event_log['transaction_type'].astype('category')
-
-    # Perform matrix shifts in two directions
-    event_log['prev_transaction_type'] = event_log['transaction_type'].shift(1)
-    event_log['prev_transaction_id'] = event_log['transaction_id'].shift(1)
-    event_log['next_transaction_type'] = event_log['transaction_type'].shift(-1)
-    event_log['next_transaction_id'] = event_log['transaction_id'].shift(-1)
-    event_log['curr_transition'] = event_log.apply(
-        lambda x: get_curr_trans(x['prev_transaction_id'], x['prev_transaction_type'], x['transaction_id'],
-                                 x['transaction_type']), axis=1)
-    event_log['next_transition'] = event_log.apply(
-        lambda x: get_next_trans(x['transaction_id'], x['transaction_type'], x['next_transaction_id']), axis=1)
-
-    # Perform "cog" movement
-    event_log.index = event_log.index*2
-    empty_frame = pd.DataFrame(np.nan, index=range(0, len(event_log)), columns=event_log.columns)
-    empty_frame.index = empty_frame.index * 2 - 1
-    empty_frame = empty_frame.drop(empty_frame.index[0])
-    full_frame = pd.concat([event_log, empty_frame])
-    full_frame = full_frame.sort_index(kind='mergesort')
-    full_frame['next_shifted'] = full_frame['next_transition'].shift(1)
-    full_frame = full_frame.dropna(how='all')
-    full_frame['transition'] = full_frame.apply(lambda x: merge_transition(x['curr_transition'], x['next_shifted']),
-                                                axis=1)
-    full_frame = full_frame.fillna(method='ffill')
-    full_frame['total_pos'] = full_frame['total_pos'].astype(np.int64)
-    full_frame['timestamp'] = full_frame['timestamp'].astype(np.int64)
-    full_frame = full_frame[['total_pos', 'timestamp', 'transition']]
-
-    transition_agg = full_frame.groupby('transition')['transition'].count()
-    transition_agg = transition_agg.fillna(0)
-    transition_agg = transition_agg.astype(np.int64)
+    activity_codes, alphabet = encode_activities(event_log, activity_encoder)
+    transition_codes, source, is_end = get_transition_codes(activity_codes, event_log['transaction_id'].values,
+                                                            event_log.index.values, len(alphabet), ordered=True)
+    frame_index = event_log.index.values[source] * 2 + is_end
+    row_labels, observed_labels, transition_counts = _count_transitions(transition_codes, alphabet)
+
+    full_frame = pd.DataFrame({'total_pos': event_log['total_pos'].values[source].astype(np.int64),
+                               'timestamp': event_log['timestamp'].values[source].astype(np.int64),
+                               'transition': row_labels},
+                              index=pd.Index(frame_index), columns=['total_pos', 'timestamp', 'transition'])
+
+    transition_agg = pd.Series(transition_counts.astype(np.int64),
+                               index=pd.Index(observed_labels, name='transition'), name='transition')
+    transition_agg = transition_agg.sort_index()
 
     return full_frame, transition_agg
 
 
+def encode_activities(event_log: pd.DataFrame, activity_encoder=None) -> (np.ndarray, pd.Index):
+    """
+    Encodes the activities of an event log within an alphabet starting with the start and ending with the end activity.
+    :param event_log: a pandas dataframe with the columns of the encoder
+    :param activity_encoder: derives the activities of the events, None for the transaction types. See
+    'get_activity_encoder'.
+    :return: the int64 activity code of every event within the alphabet, the alphabet
+    """
+    activity_codes, activities = get_activity_encoder(activity_encoder)(event_log)
+    if np.any(activity_codes < 0):
+        raise ValueError('Events without activity in {}'.format(event_log.index[activity_codes < 0][:10].tolist()))
+    return activity_codes + 1, pd.Index([START_ACTIVITY] + list(activities) + [END_ACTIVITY])
+
+
+def _count_transitions(transition_codes: np.ndarray, alphabet) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    :param transition_codes: the transition codes from_code * len(alphabet) + to_code
+    :param alphabet: the activities of the codes
+    :return: the label of every transition code, the labels of the observed transitions and their counts
+    """
+    if len(alphabet) ** 2 <= DENSE_TRANSITION_LIMIT:
+        transition_labels = get_transition_labels(alphabet)
+        transition_counts = np.bincount(transition_codes, minlength=len(transition_labels))
+        observed = np.flatnonzero(transition_counts)
+        return transition_labels[transition_codes], transition_labels[observed], transition_counts[observed]
+    observed, inverse, transition_counts = np.unique(transition_codes, return_inverse=True, return_counts=True)
+    transition_labels = get_transition_labels(alphabet, observed)
+    return transition_labels[inverse], transition_labels, transition_counts
+
+
+def get_case_boundaries(case_ids: np.ndarray, row_labels: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Evaluates for every row of an event log if it starts a case and if an end transition is emitted after it.
+    :param case_ids: the transaction ids of the event log in row order
+    :param row_labels: the index labels of the event log in row order
+    :return: a boolean array marking the rows starting a case, a boolean array marking the rows closing a case for
+    which an end transition is emitted.
+    """
+    is_start = np.ones(len(case_ids), dtype=bool)
+    is_start[1:] = case_ids[1:] != case_ids[:-1]
+    emits_end = np.ones(len(case_ids), dtype=bool)
+    emits_end[:-1] = is_start[1:]
+    emits_end &= (row_labels >= 0) & (row_labels <= len(case_ids) - 2)
+    return is_start, emits_end
+
+
+def get_transition_codes(activity_codes: np.ndarray, case_ids: np.ndarray, row_labels: np.ndarray, width: int,
+                         ordered=False) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Computes the transitions of an event log as codes from_code * width + to_code of an alphabet of width activities
+    starting with the start and ending with the end activity, like ACTIVITY_ALPHABET. A case starts whenever the
+    transaction id differs from the one of the previous row and ends whenever it differs from the one of the next row.
+    Every row emits the transition from the previous activity of its case, or the start activity, to its own one. As in
+    the former row wise implementation an end transition is only emitted for rows closing a case whose label lies
+    within [0, len(event_log) - 2].
+    :param activity_codes: the int64 activity code of every row within the alphabet, i.e. within [1, width - 2]
+    :param case_ids: the transaction ids of the event log in row order
+    :param row_labels: the index labels of the event log in row order
+    :param width: the amount of activities of the alphabet
+    :param ordered: order the transitions as the frame of 'compute_transitions', by the label 2 * row_label of a row and
+    2 * row_label + 1 of its end transition. Otherwise the end transitions follow the ones of all rows.
+    :return: the transition codes, the positions of the rows emitting them, a boolean array marking the end transitions
+    """
+    events = len(activity_codes)
+    is_start, emits_end = get_case_boundaries(case_ids, row_labels)
+    from_codes = np.roll(activity_codes, 1)
+    from_codes[is_start] = 0
+    transition_codes = np.concatenate([from_codes * width + activity_codes,
+                                       activity_codes[emits_end] * width + width - 1])
+    rows = np.concatenate([np.arange(events), np.flatnonzero(emits_end)])
+    is_end = np.arange(len(transition_codes)) >= events
+    if not ordered:
+        return transition_codes, rows, is_end
+
+    # Interleave the end transitions behind the rows closing a case
+    rows_per_event = emits_end.astype(np.int64) + 1
+    positions = np.cumsum(rows_per_event) - rows_per_event
+    order = np.empty(len(transition_codes), dtype=np.int64)
+    order[positions] = np.arange(events)
+    order[positions[emits_end] + 1] = np.arange(events, len(transition_codes))
+    frame_index = row_labels[rows[order]] * 2 + is_end[order]
+    if np.any(frame_index[1:] < frame_index[:-1]):
+        order = order[np.argsort(frame_index, kind='mergesort')]
+    return transition_codes[order], rows[order], is_end[order]
+
+
+def compute_transition_matrix(event_log: pd.DataFrame, alphabet=ACTIVITY_ALPHABET) -> np.ndarray:
+    """
+    Computes the transition counts of an event log as a dense matrix. Row and column i belong to the activity
+    alphabet[i], hence matrix[i, j] holds the occurrences of 'alphabet[i]->alphabet[j]'. The counts are the same as the
+    ones of 'compute_transitions', but derived with a single bincount and without building the transition frame.
+    :param event_log: a pandas dataframe with at least the columns 'transaction_id', 'transaction_type'
+    :param alphabet: the activities, starting with the start and ending with the end activity.
+    :return: a (len(alphabet), len(alphabet)) int64 matrix.
+    """
+    width = len(alphabet)
+    transition_codes, _, _ = compute_transition_codes(event_log, alphabet)
+    return np.bincount(transition_codes, minlength=width * width).reshape(width, width).astype(np.int64)
+
+
+def compute_transition_codes(event_log: pd.DataFrame, alphabet=ACTIVITY_ALPHABET, ordered=False) -> (np.ndarray,
+                                                                                                    np.ndarray,
+                                                                                                    np.ndarray):
+    """
+    Computes the transitions of an event log as codes from_code * len(alphabet) + to_code, see 'get_transition_codes'.
+    :param event_log: a pandas dataframe with at least the columns 'transaction_id', 'transaction_type'
+    :param alphabet: the activities, starting with the start and ending with the end activity.
+    :param ordered: order the transitions as the frame of 'compute_transitions'
+    :return: the transition codes, the positions of the rows emitting them, a boolean array marking the end transitions
+    """
+    activity_codes = pd.Categorical(event_log['transaction_type'], categories=alphabet).codes.astype(np.int64)
+    if np.any(activity_codes < 0):
+        raise ValueError('Unknown transaction types in {}'.format(
+            event_log['transaction_type'][activity_codes < 0].unique()))
+    return get_transition_codes(activity_codes, event_log['transaction_id'].values, event_log.index.values,
+                                len(alphabet), ordered)
+
+
+def compute_transitions_with_matrix(event_log: pd.DataFrame, alphabet=ACTIVITY_ALPHABET) -> (pd.DataFrame, pd.Series,
+                                                                                               np.ndarray):
+    """
+    Computes the results of 'compute_transitions' and 'compute_transition_matrix' from a single pass over the case
+    boundaries and transition codes of an event log.
+    :param event_log: a pandas dataframe with at least the columns 'total_pos', 'timestamp', 'transaction_id',
+    'transaction_type'
+    :param alphabet: the activities, starting with the start and ending with the end activity.
+    :return: the transitions and the transition occurrence frequencies as returned by 'compute_transitions', the
+    (len(alphabet), len(alphabet)) int64 transition matrix.
+    """
+    return transitions_from_codes(event_log, *compute_transition_codes(event_log, alphabet, ordered=True),
+                                  alphabet=alphabet)
+
+
+def transitions_from_codes(event_log: pd.DataFrame, transition_codes: np.ndarray, rows: np.ndarray, is_end: np.ndarray,
+                           alphabet=ACTIVITY_ALPHABET) -> (pd.DataFrame, pd.Series, np.ndarray):
+    """
+    Builds the results of 'compute_transitions_with_matrix' from the ordered transition codes of an event log.
+    :param event_log: a pandas dataframe with at least the columns 'total_pos', 'timestamp'
+    :param transition_codes: the ordered transition codes as returned by 'compute_transition_codes'
+    :param rows: the positions of the rows emitting them
+    :param is_end: a boolean array marking the end transitions
+    :param alphabet: the activities of the codes
+    :return: see 'compute_transitions_with_matrix'
+    """
+    width = len(alphabet)
+    transition_counts = np.bincount(transition_codes, minlength=width * width).astype(np.int64)
+    transition_labels = get_transition_labels(alphabet)
+    full_frame = pd.DataFrame({'total_pos': event_log['total_pos'].values[rows].astype(np.int64),
+                               'timestamp': event_log['timestamp'].values[rows].astype(np.int64),
+                               'transition': transition_labels[transition_codes]},
+                              index=pd.Index(event_log.index.values[rows] * 2 + is_end),
+                              columns=['total_pos', 'timestamp', 'transition'])
+    observed = np.flatnonzero(transition_counts)
+    transition_agg = pd.Series(transition_counts[observed], index=pd.Index(transition_labels[observed],
+                                                                           name='transition'), name='transition')
+    return full_frame, transition_agg.sort_index(), transition_counts.reshape(width, width)
+
+
+def compute_transition_tensor(event_log: pd.DataFrame, alphabet=ACTIVITY_ALPHABET) -> (pd.DatetimeIndex, np.ndarray):
+    """
+    Computes the transition matrices of an event log for every day.
+    :param event_log: a pandas dataframe with at least the columns 'day', 'transaction_id', 'transaction_type'
+    :param alphabet: the activities, starting with the start and ending with the end activity.
+    :return: the days, a (days, len(alphabet), len(alphabet)) int64 tensor holding the transition matrix of every day.
+    """
+    days = []
+    tensor = np.zeros((event_log['day'].nunique(), len(alphabet), len(alphabet)), dtype=np.int64)
+    for i, (day, group) in enumerate(event_log.groupby('day')):
+        days.append(day)
+        tensor[i] = compute_transition_matrix(group, alphabet)
+    return pd.DatetimeIndex(days, name='day'), tensor
+
+
+def compute_sparse_transition_matrix(event_log: pd.DataFrame, activity_encoder=None) -> (scipy.sparse.csr_matrix,
+                                                                                           pd.Index):
+    """
+    Computes the transition counts of an event log as a sparse matrix, for large activity alphabets like function
+    selectors. Memory and time grow with the events and observed transitions only. The counts are the same as the
+    ones of 'compute_transitions'.
+    :param event_log: a pandas dataframe with at least the columns 'transaction_id' and the ones of the encoder
+    :param activity_encoder: derives the activities of the events, None for the transaction types. See
+    'get_activity_encoder'.
+    :return: a (len(alphabet), len(alphabet)) int64 csr matrix, the alphabet of its rows and columns starting with the
+    start and ending with the end activity.
+    """
+    activity_codes, alphabet = encode_activities(event_log, activity_encoder)
+    width = len(alphabet)
+    transition_codes, _, _ = get_transition_codes(activity_codes, event_log['transaction_id'].values,
+                                                  event_log.index.values, width)
+    # Duplicated coordinates are summed up
+    transition_counts = scipy.sparse.coo_matrix((np.ones(len(transition_codes), dtype=np.int64),
+                                                 (transition_codes // width, transition_codes % width)),
+                                                shape=(width, width)).tocsr()
+    return transition_counts, alphabet
+
+
+def compute_dependency_confidence_matrix(transition_counts: np.ndarray) -> np.ndarray:
+    """
+    Computes the confidence of relationships between two activities for one or many transition matrices at once. See
+    'compute_dependency_confidence'.
+    :param transition_counts: a (..., activities, activities) array, e.g. from 'compute_transition_tensor'
+    :return: an array of the same shape with the confidences, NaN where a transition was not observed.
+    """
+    awb = np.asarray(transition_counts, dtype=np.int64)
+    return _compute_confidence(awb, np.swapaxes(awb, -1, -2))
+
+
+def compute_sparse_dependency_confidence(transition_counts: scipy.sparse.spmatrix) -> scipy.sparse.csr_matrix:
+    """
+    Computes the confidences of a sparse transition matrix, see 'compute_dependency_confidence'. Only the observed
+    transitions are evaluated.
+    :param transition_counts: a sparse (activities, activities) matrix, e.g. from 'compute_sparse_transition_matrix'
+    :return: a csr matrix storing the confidence of every observed transition, including confidences of 0.
+    """
+    transition_counts = scipy.sparse.csr_matrix(transition_counts, dtype=np.int64)
+    transition_counts.eliminate_zeros()
+    transition_counts.sort_indices()
+    observed = transition_counts.tocoo()
+    awb = observed.data
+    # The reverse transitions are looked up in the sorted row major codes of the observed transitions
+    width = transition_counts.shape[1]
+    codes = observed.row.astype(np.int64) * width + observed.col
+    reverse_codes = observed.col.astype(np.int64) * width + observed.row
+    reverse = np.searchsorted(codes, reverse_codes)
+    found = reverse < len(codes)
+    found[found] = codes[reverse[found]] == reverse_codes[found]
+    bwa = np.zeros(len(codes), dtype=np.int64)
+    bwa[found] = awb[reverse[found]]
+    return scipy.sparse.csr_matrix((_compute_confidence(awb, bwa), (observed.row, observed.col)),
+                                   shape=transition_counts.shape)
+
+
+def _compute_confidence(awb: np.ndarray, bwa: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        confidence = (awb - bwa) / (awb + bwa)
+    confidence[awb == bwa] = 1
+    confidence[awb == 0] = np.nan
+    return confidence
+
+
 def compute_dependency_confidence(aggregated_transitions: pd.Series) -> pd.Series:
     """
     Computes the confidence of relationships between to transaction types:
@@ -62,89 +293,171 @@ def compute_dependency_confidence(aggregated_transitions: pd.Series) -> pd.Serie
     :returns confidence_series: a pd.Series illustration how strong the dependency in process terms from two transaction
     types towards each other is.
     """
-    confidence_series = pd.Series()
-    for key in aggregated_transitions.keys():
-        act_a, act_b = key.split('->')
-        try:
-            awb = aggregated_transitions['{}->{}'.format(act_a, act_b)]
-        except KeyError as e:
-            awb = 0
+    if len(aggregated_transitions) == 0:
+        return pd.Series(dtype=np.float64)
+    activities = aggregated_transitions.index.str.split('->', expand=True)
+    act_a = activities.get_level_values(0)
+    act_b = activities.get_level_values(1)
+    alphabet = pd.Index(act_a.append(act_b).unique())
+    a_codes = alphabet.get_indexer(act_a).astype(np.int64)
+    b_codes = alphabet.get_indexer(act_b).astype(np.int64)
 
-        try:
-            bwa = aggregated_transitions['{}->{}'.format(act_b, act_a)]
-        except KeyError as e:
-            bwa = 0
+    # The reverse transition of every transition is looked up, hence only observed transitions are evaluated
+    awb = aggregated_transitions.values.astype(np.int64)
+    reverse = pd.Index(a_codes * len(alphabet) + b_codes).get_indexer(b_codes * len(alphabet) + a_codes)
+    bwa = np.where(reverse >= 0, awb[reverse], 0)
+    return pd.Series(_compute_confidence(awb, bwa), index=list(aggregated_transitions.index))
 
-        if awb == bwa:
-            confidence_series[key] = 1
-        else:
-            confidence_series[key] = (awb - bwa) / (awb + bwa)
-    return confidence_series
+
+def transition_matrix_to_series(transition_counts: np.ndarray, alphabet=ACTIVITY_ALPHABET) -> pd.Series:
+    """
+    Converts a transition matrix to the labelled layout of the aggregation returned by 'compute_transitions'.
+    :param transition_counts: a (len(alphabet), len(alphabet)) matrix
+    :param alphabet: the activities of the matrix rows and columns
+    :return: a pd.Series with the observed transition counts, indexed by labels like 'UtC->CtU'.
+    """
+    labels = get_transition_labels(alphabet)
+    counts = np.asarray(transition_counts, dtype=np.int64).ravel()
+    observed = np.flatnonzero(counts)
+    series = pd.Series(counts[observed], index=pd.Index(labels[observed], name='transition'), name='transition')
+    return series.sort_index()
 
 
-def get_curr_trans(prev_id, prev_type, curr_id, curr_type) -> str:
+def confidence_matrix_to_series(confidence: np.ndarray, alphabet=ACTIVITY_ALPHABET) -> pd.Series:
     """
-    Evaluate the current transition based on the information from the current and the previous transaction
-    :param prev_id: id of the previous transaction
-    :param prev_type: type of the previous transaction
-    :param curr_id: id of the current transaction
-    :param curr_type: type of the current transaction
-    :returns sta->E string, representing a transition from the start event to an event E or E->E' if not a start event
+    Converts a confidence matrix to the labelled layout returned by 'compute_dependency_confidence'.
+    :param confidence: a (len(alphabet), len(alphabet)) matrix, NaN where a transition was not observed
+    :param alphabet: the activities of the matrix rows and columns
+    :return: a pd.Series with the confidences of the observed transitions, indexed by labels like 'UtC->CtU'.
     """
-    if float(prev_id) != float(curr_id):
-        return 'sta->{}'.format(curr_type)
-    else:
-        return '{}->{}'.format(prev_type, curr_type)
+    labels = get_transition_labels(alphabet)
+    confidence = np.asarray(confidence, dtype=np.float64).ravel()
+    observed = np.flatnonzero(~np.isnan(confidence))
+    return pd.Series(confidence[observed], index=list(labels[observed])).sort_index()
 
 
-def get_next_trans(curr_id, curr_type, next_id):
+def transition_tensor_to_frame(days, transition_counts: np.ndarray, alphabet=ACTIVITY_ALPHABET) -> pd.DataFrame:
     """
-    Evaluate the next transition based on the information from the current and the next transaction
-    :param curr_id:  id of the current transaction
-    :param curr_type: type of the current transaction
-    :param next_id:  id of the next transaction
-    :return: E->end as string if the current id and the next id differ (a case found its end), np.nan otherwise
+    Converts a transition tensor to the wide per day layout with the columns 'day' and TRANSITION_COLUMN_NAMES, followed
+    by any further observed transition.
+    :param days: the days of the tensor
+    :param transition_counts: a (days, len(alphabet), len(alphabet)) tensor
+    :param alphabet: the activities of the matrix rows and columns
+    :return: a pd.DataFrame with one row per day.
     """
-    if float(curr_id) != float(next_id):
-        return '{}->end'.format(curr_type)
-    else:
-        return np.nan
+    counts = np.asarray(transition_counts, dtype=np.int64).reshape(len(days), -1)
+    return _tensor_to_frame(days, counts, counts.any(axis=0), alphabet)
 
 
-def merge_transition(trans, nxt):
+def transition_frame_to_tensor(frame: pd.DataFrame, alphabet=ACTIVITY_ALPHABET) -> (pd.DatetimeIndex, np.ndarray):
     """
-    Gets the transiton for the merge operations of two columns
-    :param trans:
-    :param nxt:
-    :return:
+    Converts transition counts in the wide per day layout back to a tensor, the inverse of
+    'transition_tensor_to_frame'.
+    :param frame: a pd.DataFrame with a 'day' column or index and a column per transition like 'UtC->CtU'. Other
+    columns, e.g. 'total_events', and transitions of activities not in the alphabet are ignored.
+    :param alphabet: the activities of the matrix rows and columns
+    :return: the days in ascending order, a (days, len(alphabet), len(alphabet)) int64 tensor
     """
-    if type(trans) == str:
-        return trans
-    else:
-        return nxt
+    if 'day' in frame.columns:
+        frame = frame.set_index('day')
+    frame = frame.sort_index()
+    codes = {activity: code for code, activity in enumerate(alphabet)}
+    transition_counts = np.zeros((len(frame), len(alphabet), len(alphabet)), dtype=np.int64)
+    for column in frame.columns:
+        activities = str(column).split('->')
+        if len(activities) != 2 or activities[0] not in codes or activities[1] not in codes:
+            continue
+        transition_counts[:, codes[activities[0]], codes[activities[1]]] = \
+            frame[column].fillna(0).values.astype(np.int64)
+    return pd.DatetimeIndex(pd.to_datetime(frame.index), name='day'), transition_counts
 
 
-def compute_dependency_graph(transitions: pd.Series, dep: pd.Series, relative_cutoff: float, significance_cutoff: float) -> nx.DiGraph:
-    total_transitions = transitions.sum()
-    transitions_relative = transitions / total_transitions
+def confidence_tensor_to_frame(days, confidence: np.ndarray, alphabet=ACTIVITY_ALPHABET) -> pd.DataFrame:
+    """
+    Converts a confidence tensor to the wide per day layout, see 'transition_tensor_to_frame'.
+    :param days: the days of the tensor
+    :param confidence: a (days, len(alphabet), len(alphabet)) tensor, NaN where a transition was not observed
+    :param alphabet: the activities of the matrix rows and columns
+    :return: a pd.DataFrame with one row per day, NaN where a transition was not observed on that day.
+    """
+    confidence = np.asarray(confidence, dtype=np.float64).reshape(len(days), -1)
+    return _tensor_to_frame(days, confidence, ~np.isnan(confidence).all(axis=0), alphabet)
+
+
+def _tensor_to_frame(days, values: np.ndarray, observed: np.ndarray, alphabet) -> pd.DataFrame:
+    labels = get_transition_labels(alphabet)
+    columns = [column for column in TRANSITION_COLUMN_NAMES if column in set(labels)]
+    columns += sorted(set(labels[observed]) - set(columns))
+    frame = pd.DataFrame(values, columns=labels)[columns]
+    frame.insert(0, 'day', list(days))
+    return frame
+
+
+def sparse_matrix_to_series(transition_counts: scipy.sparse.spmatrix, alphabet) -> pd.Series:
+    """
+    Converts a sparse transition or confidence matrix to the labelled layout of 'compute_transitions' and
+    'compute_dependency_confidence'.
+    :param transition_counts: a sparse (len(alphabet), len(alphabet)) matrix
+    :param alphabet: the activities of the matrix rows and columns
+    :return: a pd.Series with the stored values, indexed by labels like '0xa9059cbb->0x23b872dd'.
+    """
+    observed = scipy.sparse.coo_matrix(transition_counts)
+    observed.sum_duplicates()
+    labels = get_transition_labels(alphabet, observed.row.astype(np.int64) * len(alphabet) + observed.col)
+    series = pd.Series(observed.data, index=pd.Index(labels, name='transition'), name='transition')
+    return series.sort_index()
+
+
+def get_transition_labels(alphabet, transition_codes=None) -> np.ndarray:
+    """
+    :param alphabet: the activities
+    :param transition_codes: the codes from_code * len(alphabet) + to_code to label, None for all transitions
+    :return: the labels of the transitions, like 'UtC->CtU'
+    """
+    if transition_codes is None:
+        return np.array(['{}->{}'.format(act_a, act_b) for act_a in alphabet for act_b in alphabet], dtype=object)
+    return np.array(['{}->{}'.format(alphabet[code // len(alphabet)], alphabet[code % len(alphabet)])
+                     for code in transition_codes], dtype=object)
+
+
+def compute_dependency_graph(transitions: pd.Series, dep: pd.Series, relative_cutoff: float,
+                             significance_cutoff: float) -> 'nx.DiGraph':
+    """
+    Builds the dependency graph of aggregated transitions. Every activity of the transitions is a node, a transition is
+    an edge if its relative frequency exceeds relative_cutoff and its confidence exceeds significance_cutoff. To build
+    graphs for many days or cutoffs see 'DependencyGraphBuilder'.
+    :param transitions: a pd.Series, according to the outcome of 'compute_transitions'
+    :param dep: the confidences of the transitions, according to the outcome of 'compute_dependency_confidence'
+    :param relative_cutoff: the relative frequency cutoff
+    :param significance_cutoff: the significance cutoff
+    :return: a nx.DiGraph with the edge attributes 'relative', 'significance' and 'label'
+    """
+    transitions_relative = (transitions / transitions.sum()).values
+    significance = dep.reindex(transitions.index).values.astype(np.float64)
+    activities = pd.Index(transitions.index).str.split('->', expand=True)
+    act_a = activities.get_level_values(0)
+    act_b = activities.get_level_values(1)
+
+    with np.errstate(invalid='ignore'):
+        is_edge = (transitions_relative > relative_cutoff) & (significance > significance_cutoff)
+    nodes = pd.Index(act_a.append(act_b)).unique()
+    edges = list(zip(act_a[is_edge], act_b[is_edge]))
+    return build_dependency_graph(nodes, edges, transitions_relative[is_edge], significance[is_edge])
+
+
+def build_dependency_graph(nodes, edges, relative: np.ndarray, significance: np.ndarray) -> 'nx.DiGraph':
+    """
+    :param nodes: the activities
+    :param edges: the edges as (act_a, act_b) tuples
+    :param relative: the relative frequencies of the edges
+    :param significance: the confidences of the edges
+    :return: a nx.DiGraph with the edge attributes 'relative', 'significance' and 'label'
+    """
+    import networkx as nx
 
     g = nx.DiGraph()
-    node_set = set()
-    for i, v in transitions.items():
-        current_transition = i
-        act_a = current_transition[:3]
-        act_b = current_transition[-3:]
-        node_set.add(act_a)
-        node_set.add(act_b)
-    for act in node_set:
-        g.add_node(act)
-    for i, v in transitions.items():
-        current_transition = i
-        act_a = current_transition[:3]
-        act_b = current_transition[-3:]
-        if transitions_relative[current_transition] > relative_cutoff and dep[current_transition] > significance_cutoff:
-            g.add_edge(act_a, act_b)
-            g[act_a][act_b]['relative'] = round(transitions_relative[current_transition], 4)
-            g[act_a][act_b]['significance'] = round(dep[current_transition], 2)
-            g[act_a][act_b]['label'] = '{}% ({})'.format(round(transitions_relative[current_transition] * 100, 2), round(dep[current_transition], 2))
-    return g
\ No newline at end of file
+    g.add_nodes_from(nodes)
+    for (act_a, act_b), edge_relative, edge_significance in zip(edges, relative, significance):
+        g.add_edge(act_a, act_b, relative=round(edge_relative, 4), significance=round(edge_significance, 2),
+                   label='{}% ({})'.format(round(edge_relative * 100, 2), round(edge_significance, 2)))
+    return g
@@ -0,0 +1,310 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+from config.constants import ACTIVITY_ALPHABET
+from parser.block_index import get_day_ordinals, day_ordinal_to_timestamp, SECONDS_PER_DAY
+from miner import heuristic_miner as miner
+
+DayResult = collections.namedtuple('DayResult', ['day', 'transition_matrix', 'transitions_agg', 'confidence', 'cases',
+                                                 'transitions'])
+DayResult.__doc__ = """
+The mining results of a closed day, equal to the ones of 'mine_segment_by_day' for the day: the transition matrix as
+computed by 'compute_transition_matrix', the transition occurrence frequencies and confidences as computed by
+'compute_transitions' and 'compute_dependency_confidence', the amount of cases and the transitions frame of
+'compute_transitions' (None unless the miner keeps transitions).
+"""
+
+
+class StreamingMiner(object):
+    """
+    Mines events incrementally, in block order, in batches or one by one. Per case only the open case (the transaction
+    of the last event) is held, transition counts are kept as running matrices over ACTIVITY_ALPHABET. Whenever the day
+    changes the open day is closed and its results are emitted.
+
+    The results of a day equal the ones of the batch miner for the day group of the same events, including its end
+    transition rule: an end transition is only emitted for a case closing row whose label m satisfies
+    0 <= m <= n - 2, n being the amount of events of the day. Closing rows whose rule can not be decided yet are
+    pending, sorted by label: as n grows the rule turns true in label order, hence decided rows are popped from the
+    front. Rows still pending when their day closes never emit an end transition. The state held is bounded by the
+    open day and the window, not by the length of the stream.
+
+    Besides the days a sliding window over the last window_blocks blocks is maintained, see 'get_window_matrix'.
+    Transitions count towards the block of their row. End transitions pending on the day rule are added once decided,
+    if their block is still within the window.
+    """
+
+    def __init__(self, window_blocks=None, keep_transitions=False, block_padding=1000000000):
+        """
+        :param window_blocks: the amount of blocks of the sliding window, None for no window
+        :param keep_transitions: keep the events of the open day to emit the transitions frame of 'compute_transitions'
+        with every day
+        :param block_padding: the block padding of the parser, to derive the block numbers from 'total_pos'
+        """
+        self.window_blocks = window_blocks
+        self.keep_transitions = keep_transitions
+        self.block_padding = block_padding
+        self.width = len(ACTIVITY_ALPHABET)
+        self.next_label = 0
+
+        self.window = collections.OrderedDict()
+        self.newest_block = None
+        self.window_matrix = np.zeros((self.width, self.width), dtype=np.int64)
+        self.reset_day(None)
+
+    def reset_day(self, day_ordinal):
+        self.day_ordinal = day_ordinal
+        self.day_matrix = np.zeros((self.width, self.width), dtype=np.int64)
+        self.day_events = 0
+        self.day_cases = set()
+        self.day_frames = []
+        # Events consumed one by one since the last frame: label, total_pos, timestamp, transaction id and type
+        self.day_rows = []
+        # The open case: label, transaction id, activity code and block of the last event
+        self.last_event = None
+        # Closing rows of the day waiting for the end transition rule: a buffer of labels, activity codes and blocks,
+        # sorted by label. The rows pending are the columns from pending_start to pending_stop.
+        self.pending_ends = np.zeros((3, 0), dtype=np.int64)
+        self.pending_start = 0
+        self.pending_stop = 0
+
+    def consume(self, events: pd.DataFrame) -> list:
+        """
+        Consumes a batch of events in block order.
+        :param events: events as returned by the parser with at least the columns 'total_pos', 'timestamp',
+        'transaction_id', 'transaction_type'. Their index labels are used for the end transition rule.
+        :return: the DayResults of the days closed by the batch
+        """
+        if len(events) == 0:
+            return []
+        labels = events.index.values.astype(np.int64)
+        activity_codes = pd.Categorical(events['transaction_type'], categories=ACTIVITY_ALPHABET).codes.astype(np.int64)
+        if np.any(activity_codes < 0):
+            raise ValueError('Unknown transaction types in {}'.format(events['transaction_type'].unique()))
+        day_ordinals = get_day_ordinals(events['timestamp'].values)
+        if np.any(day_ordinals[1:] < day_ordinals[:-1]) or \
+                (self.day_ordinal is not None and day_ordinals[0] < self.day_ordinal):
+            raise ValueError('Events must be consumed in block order')
+        self.next_label = labels.max() + 1
+
+        results = []
+        day_starts = np.flatnonzero(np.diff(day_ordinals)) + 1
+        for start, end in zip(np.concatenate([[0], day_starts]), np.concatenate([day_starts, [len(events)]])):
+            if self.day_ordinal is not None and day_ordinals[start] != self.day_ordinal:
+                results.append(self.close_day())
+            if self.day_ordinal is None:
+                self.reset_day(day_ordinals[start])
+            self.consume_day(events.iloc[start:end], labels[start:end], activity_codes[start:end])
+        return results
+
+    def consume_event(self, transaction_id, transaction_type, timestamp, total_pos, label=None) -> list:
+        """
+        Consumes a single event.
+        :param transaction_id: the transaction id of the event
+        :param transaction_type: the transaction type of the event, e.g. 'UtC'
+        :param timestamp: the timestamp of the event
+        :param total_pos: the position of the event as computed by the parser
+        :param label: the label of the event, the one following the last consumed label if None
+        :return: the DayResults of the days closed by the event
+        """
+        label = int(self.next_label if label is None else label)
+        if transaction_type not in ACTIVITY_ALPHABET:
+            raise ValueError('Unknown transaction types in {}'.format([transaction_type]))
+        activity_code = ACTIVITY_ALPHABET.index(transaction_type)
+        day_ordinal = int(timestamp) // SECONDS_PER_DAY
+        if self.day_ordinal is not None and day_ordinal < self.day_ordinal:
+            raise ValueError('Events must be consumed in block order')
+        self.next_label = label + 1
+
+        results = []
+        if self.day_ordinal is not None and day_ordinal != self.day_ordinal:
+            results.append(self.close_day())
+        if self.day_ordinal is None:
+            self.reset_day(day_ordinal)
+        transaction_id = int(transaction_id)
+        block = int(total_pos) // self.block_padding
+        self.newest_block = block if self.newest_block is None else max(self.newest_block, block)
+
+        is_start = self.last_event is None or transaction_id != self.last_event[1]
+        from_code = 0 if is_start else self.last_event[2]
+        self.count_one(from_code * self.width + activity_code, block)
+        self.day_events += 1
+        if self.last_event is not None and is_start:
+            self.add_ends(np.array([self.last_event[0]], dtype=np.int64),
+                          np.array([self.last_event[2]], dtype=np.int64),
+                          np.array([self.last_event[3]], dtype=np.int64))
+        else:
+            self.decide_ends()
+
+        self.last_event = (label, transaction_id, activity_code, block)
+        self.day_cases.add(transaction_id)
+        if self.keep_transitions:
+            self.day_rows.append((label, total_pos, timestamp, transaction_id, transaction_type))
+        return results
+
+    def consume_day(self, events: pd.DataFrame, labels: np.ndarray, activity_codes: np.ndarray):
+        transaction_ids = events['transaction_id'].values.astype(np.int64)
+        blocks = events['total_pos'].values.astype(np.int64) // self.block_padding
+        self.newest_block = blocks.max() if self.newest_block is None else max(self.newest_block, blocks.max())
+
+        is_start = np.ones(len(events), dtype=bool)
+        is_start[1:] = transaction_ids[1:] != transaction_ids[:-1]
+        from_codes = np.roll(activity_codes, 1)
+        if self.last_event is not None:
+            is_start[0] = transaction_ids[0] != self.last_event[1]
+            from_codes[0] = self.last_event[2]
+        from_codes[is_start] = 0
+        self.count(from_codes * self.width + activity_codes, blocks)
+
+        # Rows closing a case: the open case if a new one starts, every row followed by a case start
+        closing_labels = labels[:-1][is_start[1:]]
+        closing_codes = activity_codes[:-1][is_start[1:]]
+        closing_blocks = blocks[:-1][is_start[1:]]
+        if self.last_event is not None and is_start[0]:
+            closing_labels = np.concatenate([[self.last_event[0]], closing_labels])
+            closing_codes = np.concatenate([[self.last_event[2]], closing_codes])
+            closing_blocks = np.concatenate([[self.last_event[3]], closing_blocks])
+        self.day_events += len(events)
+        self.add_ends(closing_labels, closing_codes, closing_blocks)
+
+        self.last_event = (labels[-1], transaction_ids[-1], activity_codes[-1], blocks[-1])
+        self.day_cases.update(np.unique(transaction_ids).tolist())
+        if self.keep_transitions:
+            self.flush_rows()
+            self.day_frames.append(events[['total_pos', 'timestamp', 'transaction_id', 'transaction_type']])
+
+    def flush_rows(self):
+        """
+        Moves the events consumed one by one into a frame of the open day.
+        """
+        if self.day_rows:
+            labels = [row[0] for row in self.day_rows]
+            self.day_frames.append(pd.DataFrame([row[1:] for row in self.day_rows], index=labels,
+                                                columns=['total_pos', 'timestamp', 'transaction_id', 'transaction_type']))
+            self.day_rows = []
+
+    def add_ends(self, labels: np.ndarray, activity_codes: np.ndarray, blocks: np.ndarray):
+        """
+        Adds closing rows to the pending ones and counts the end transitions decided by the events of the day so far.
+        Rows with a negative label never satisfy the end transition rule and are dropped.
+        """
+        valid = labels >= 0
+        ends = np.stack([labels[valid], activity_codes[valid], blocks[valid]]).astype(np.int64)
+        pending = self.pending_ends[:, self.pending_start:self.pending_stop]
+        if ends.shape[1] > 0 and (np.any(ends[0, 1:] < ends[0, :-1]) or
+                                  (pending.shape[1] > 0 and ends[0, 0] < pending[0, -1])):
+            # Labels out of order are merged, ascending ones are appended
+            ends = np.concatenate([pending, ends], axis=1)
+            ends = ends[:, np.argsort(ends[0], kind='mergesort')]
+            self.pending_start = self.pending_stop = 0
+            pending = ends[:, :0]
+        size = pending.shape[1] + ends.shape[1]
+        if size > self.pending_ends.shape[1]:
+            buffer = np.zeros((3, max(2 * size, 64)), dtype=np.int64)
+            buffer[:, :pending.shape[1]] = pending
+            self.pending_ends, self.pending_start, self.pending_stop = buffer, 0, pending.shape[1]
+        elif self.pending_stop + ends.shape[1] > self.pending_ends.shape[1]:
+            self.pending_ends[:, :pending.shape[1]] = pending.copy()
+            self.pending_start, self.pending_stop = 0, pending.shape[1]
+        self.pending_ends[:, self.pending_stop:self.pending_stop + ends.shape[1]] = ends
+        self.pending_stop += ends.shape[1]
+        self.decide_ends()
+
+    def decide_ends(self):
+        """
+        Counts the end transitions of the pending closing rows whose label satisfies the end transition rule for the
+        events of the day so far, i.e. of the labels up to day_events - 2, and pops them.
+        """
+        labels = self.pending_ends[0, self.pending_start:self.pending_stop]
+        decided = int(np.searchsorted(labels, self.day_events - 2, side='right'))
+        if decided == 0:
+            return
+        ends = self.pending_ends[:, self.pending_start:self.pending_start + decided]
+        self.count(ends[1] * self.width + self.width - 1, ends[2])
+        self.pending_start += decided
+
+    def count(self, transition_codes: np.ndarray, blocks: np.ndarray):
+        """
+        Adds transitions to the open day and to the blocks of the window.
+        """
+        if len(transition_codes) == 0:
+            return
+        self.day_matrix += np.bincount(transition_codes, minlength=self.width * self.width).reshape(self.width,
+                                                                                                    self.width)
+        if self.window_blocks is None:
+            return
+        for block in np.unique(blocks):
+            if block <= self.newest_block - self.window_blocks:
+                continue
+            block_matrix = np.bincount(transition_codes[blocks == block],
+                                       minlength=self.width * self.width).reshape(self.width, self.width)
+            if block not in self.window:
+                self.window[block] = np.zeros((self.width, self.width), dtype=np.int64)
+            self.window[block] += block_matrix
+            self.window_matrix += block_matrix
+        self.evict_window()
+
+    def count_one(self, transition_code, block):
+        """
+        Adds a single transition to the open day and to its block of the window.
+        """
+        from_code, to_code = divmod(transition_code, self.width)
+        self.day_matrix[from_code, to_code] += 1
+        if self.window_blocks is None:
+            return
+        if block > self.newest_block - self.window_blocks:
+            if block not in self.window:
+                self.window[block] = np.zeros((self.width, self.width), dtype=np.int64)
+            self.window[block][from_code, to_code] += 1
+            self.window_matrix[from_code, to_code] += 1
+        self.evict_window()
+
+    def evict_window(self):
+        """
+        Removes the blocks that left the window.
+        """
+        while self.window and next(iter(self.window)) <= self.newest_block - self.window_blocks:
+            block, block_matrix = self.window.popitem(last=False)
+            self.window_matrix -= block_matrix
+
+    def close_day(self) -> DayResult:
+        """
+        Closes the open day: the open case is closed and the pending end transitions are decided.
+        :return: the DayResult of the day
+        """
+        if self.last_event is not None:
+            self.add_ends(np.array([self.last_event[0]], dtype=np.int64),
+                          np.array([self.last_event[2]], dtype=np.int64),
+                          np.array([self.last_event[3]], dtype=np.int64))
+        transitions_agg = miner.transition_matrix_to_series(self.day_matrix)
+        transitions = None
+        if self.keep_transitions:
+            self.flush_rows()
+            transitions = miner.compute_transitions(pd.concat(self.day_frames))[0]
+        result = DayResult(day_ordinal_to_timestamp(self.day_ordinal), self.day_matrix, transitions_agg,
+                           miner.compute_dependency_confidence(transitions_agg), len(self.day_cases), transitions)
+        self.reset_day(None)
+        return result
+
+    def close(self) -> list:
+        """
+        Closes the open day at the end of the stream or of a segment, e.g. a raw transaction file. Events consumed
+        afterwards start a new day.
+        :return: the DayResults of the closed day, if any
+        """
+        if self.day_ordinal is None:
+            return []
+        return [self.close_day()]
+
+    def get_window_matrix(self) -> np.ndarray:
+        """
+        :return: the transition matrix of the last window_blocks blocks, see 'compute_transition_matrix'
+        """
+        return self.window_matrix.copy()
+
+    def get_window_confidence(self) -> pd.Series:
+        """
+        :return: the confidences of the transitions of the last window_blocks blocks
+        """
+        return miner.compute_dependency_confidence(miner.transition_matrix_to_series(self.window_matrix))
@@ -0,0 +1,319 @@
+import argparse
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+from parser.block_index import get_day_ordinals, day_ordinal_to_timestamp
+from miner import heuristic_miner as miner
+from miner.activity_encoders import get_activity_encoder
+
+# Odd 64 bit multiplier of the rolling hash
+HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+# Seeds tried to find a free variant id for a sequence whose hash collides with the one of another sequence
+MAX_HASH_PROBES = 64
+VARIANT_SEPARATOR = '->'
+
+
+def hash_activities(activities, seed=0) -> np.ndarray:
+    """
+    Derives a pseudo random odd 64 bit value for every activity from its label, hence the hashes of sequences do not
+    depend on the activity codes of an event log and variant ids are comparable across event logs.
+    :param activities: the activity labels
+    :param seed: the seed of the values, see 'VariantDictionary.add'
+    :return: a uint64 array with the value of every activity
+    """
+    salt = int(seed).to_bytes(hashlib.blake2b.SALT_SIZE, 'little')
+    values = np.empty(len(activities), dtype=np.uint64)
+    for i, activity in enumerate(activities):
+        digest = hashlib.blake2b(str(activity).encode('utf-8'), digest_size=8, salt=salt).digest()
+        values[i] = int.from_bytes(digest, 'little') | 1
+    return values
+
+
+def hash_sequences(activity_values: np.ndarray, activity_codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Hashes consecutive sequences of activity codes at once with the polynomial rolling hash
+    sum(activity_values[code_i] * HASH_BASE ** (i + 1)) mod 2 ** 64, mixed with the length of the sequence.
+    :param activity_values: the 64 bit value of every activity code, see 'hash_activities'
+    :param activity_codes: the activity codes of all sequences, one sequence after another
+    :param lengths: the length of every sequence, all positive and summing up to len(activity_codes)
+    :return: the int64 hash of every sequence
+    """
+    if len(lengths) == 0:
+        return np.empty(0, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    positions = np.arange(len(activity_codes)) - np.repeat(starts, lengths)
+    # Integer overflow of uint64 arrays wraps around, i.e. computes modulo 2 ** 64
+    powers = np.cumprod(np.full(lengths.max(), HASH_BASE, dtype=np.uint64))
+    hashes = np.add.reduceat(activity_values[activity_codes] * powers[positions], starts)
+    hashes += lengths.astype(np.uint64) * np.uint64(0xD6E8FEB86659FD93)
+    # splitmix64 finalizer to spread the bits
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    return hashes.view(np.int64)
+
+
+def hash_sequence(sequence, seed=0) -> int:
+    """
+    :param sequence: the activity labels of a case
+    :param seed: the seed of the activity values
+    :return: the hash of the sequence, equal to the one of 'hash_sequences'
+    """
+    activities, codes = np.unique(np.asarray(sequence, dtype=object).astype(str), return_inverse=True)
+    return int(hash_sequences(hash_activities(activities, seed), codes.astype(np.int64), np.array([len(sequence)]))[0])
+
+
+class VariantDictionary(object):
+    """
+    Maps variant ids to the activity sequences of the variants. The id of a sequence is its hash, see 'hash_sequences'.
+    Every sequence added is checked against the sequence known under its id. A sequence colliding with another one is
+    assigned the hash of the next seed whose id is free instead, hence ids stay unique, though an id may depend on the
+    order sequences were added in. Dictionaries of different event logs are combined by 'merge', which returns the ids
+    to rewrite in the counts of the merged dictionary.
+    """
+
+    def __init__(self, sequences=None):
+        """
+        :param sequences: a dict of the activity sequences, as tuples of labels, by variant id
+        """
+        self.sequences = {}
+        self.ids = {}
+        for variant_id, sequence in (sequences or {}).items():
+            self.sequences[variant_id] = tuple(sequence)
+            self.ids[tuple(sequence)] = variant_id
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __contains__(self, variant_id):
+        return variant_id in self.sequences
+
+    def get_sequence(self, variant_id) -> tuple:
+        return self.sequences[variant_id]
+
+    def add(self, variant_id: int, sequence: tuple) -> int:
+        """
+        :param variant_id: the hash of the sequence
+        :param sequence: the activity labels of the sequence
+        :return: the id of the sequence, variant_id unless the sequence was known under another id or collides
+        """
+        known_id = self.ids.get(sequence)
+        if known_id is not None:
+            return known_id
+        seed = 0
+        while variant_id in self.sequences:
+            seed += 1
+            if seed > MAX_HASH_PROBES:
+                raise ValueError('No free variant id for {} after {} seeds'.format(sequence, MAX_HASH_PROBES))
+            variant_id = hash_sequence(sequence, seed)
+        if seed > 0:
+            logging.info('Variant id collision, using the id of seed {} for {}'.format(seed, sequence))
+        self.sequences[variant_id] = sequence
+        self.ids[sequence] = variant_id
+        return variant_id
+
+    def merge(self, other) -> dict:
+        """
+        Adds the variants of another dictionary.
+        :param other: the VariantDictionary to add
+        :return: a dict with the new id of every variant of other whose id changed
+        """
+        remapping = {}
+        for variant_id, sequence in other.sequences.items():
+            new_id = self.add(variant_id, sequence)
+            if new_id != variant_id:
+                remapping[variant_id] = new_id
+        return remapping
+
+    def get_labels(self, variant_ids) -> list:
+        """
+        :param variant_ids: the variant ids
+        :return: the activity sequence of every variant joined by VARIANT_SEPARATOR, e.g. 'UtC->CtC->CtU'
+        """
+        return [VARIANT_SEPARATOR.join(self.sequences[variant_id]) for variant_id in variant_ids]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: a pd.DataFrame indexed by 'variant_id' with the columns 'length' and 'variant', see 'get_labels'
+        """
+        variant_ids = sorted(self.sequences)
+        return pd.DataFrame({'length': [len(self.sequences[variant_id]) for variant_id in variant_ids],
+                             'variant': self.get_labels(variant_ids)},
+                            index=pd.Index(variant_ids, name='variant_id', dtype=np.int64), columns=['length', 'variant'])
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame):
+        """
+        :param frame: a frame as returned by 'to_frame', e.g. read back from csv with index_col=0
+        :return: the VariantDictionary
+        """
+        return cls({int(variant_id): tuple(variant.split(VARIANT_SEPARATOR))
+                    for variant_id, variant in zip(frame.index, frame['variant'])})
+
+
+def compute_variants(event_log: pd.DataFrame, activity_encoder=None, dictionary=None) -> (pd.Series,
+                                                                                           VariantDictionary):
+    """
+    Computes the process variants of an event log per day, i.e. how many cases of a day follow which ordered sequence
+    of activities. As in 'compute_transitions' a case is a run of rows of the same transaction id within the events of
+    a day. The sequences are hashed with a vectorized rolling hash over the event arrays, see 'hash_sequences'. Cases
+    sharing a hash are compared event by event with the first case of the hash, hence only one sequence per distinct
+    variant is built as tuple, to check it against and add it to the dictionary.
+    :param event_log: a pandas dataframe with at least the columns 'timestamp', 'transaction_id' and the ones of the
+    encoder
+    :param activity_encoder: derives the activities of the events, None for the transaction types. See
+    'get_activity_encoder'.
+    :param dictionary: the VariantDictionary to check and add the variants to, None for a new one
+    :return: a sparse pd.Series of the case amounts indexed by 'day' and 'variant_id', the dictionary
+    """
+    dictionary = VariantDictionary() if dictionary is None else dictionary
+    day_ordinals = get_day_ordinals(event_log['timestamp'].values)
+    # The days are mined in groups, see 'mine_segment_by_day'
+    if np.any(day_ordinals[1:] < day_ordinals[:-1]):
+        order = np.argsort(day_ordinals, kind='mergesort')
+        event_log, day_ordinals = event_log.iloc[order], day_ordinals[order]
+    if len(event_log) == 0:
+        index = pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), np.empty(0, dtype=np.int64)],
+                                          names=['day', 'variant_id'])
+        return pd.Series(np.empty(0, dtype=np.int64), index=index, name='cases'), dictionary
+
+    activity_codes, activities = get_activity_encoder(activity_encoder)(event_log)
+    is_start, emits_end = miner.get_case_boundaries(event_log['transaction_id'].values, event_log.index.values)
+    is_start[1:] |= day_ordinals[1:] != day_ordinals[:-1]
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(starts, len(event_log)))
+    hashes = hash_sequences(hash_activities(activities), activity_codes, lengths)
+
+    # Every case is compared with the first case of its hash
+    case_variants, unique_hashes = pd.factorize(hashes)
+    first_cases = np.empty(len(unique_hashes), dtype=np.int64)
+    first_cases[case_variants[::-1]] = np.arange(len(hashes))[::-1]
+    representatives = first_cases[case_variants]
+    colliding = lengths != lengths[representatives]
+    event_cases = np.repeat(np.arange(len(starts)), lengths)
+    comparable = ~colliding[event_cases]
+    representative_positions = np.where(comparable, starts[representatives[event_cases]] + np.arange(len(event_log)) -
+                                        starts[event_cases], 0)
+    colliding[event_cases[comparable & (activity_codes[representative_positions] != activity_codes)]] = True
+
+    labels = np.asarray(activities, dtype=object)
+
+    def get_sequence(case):
+        return tuple(labels[activity_codes[starts[case]:starts[case] + lengths[case]]].tolist())
+
+    variant_ids = np.array([dictionary.add(int(unique_hashes[variant]), get_sequence(case))
+                            for variant, case in enumerate(first_cases)], dtype=np.int64)
+    case_ids = variant_ids[case_variants]
+    # Cases colliding with the first case of their hash are added one by one
+    for case in np.flatnonzero(colliding):
+        case_ids[case] = dictionary.add(int(hashes[case]), get_sequence(case))
+
+    # Cases per day and variant, counted on a single int64 key of both
+    observed_days, day_codes = np.unique(day_ordinals[starts], return_inverse=True)
+    observed_ids, id_codes = np.unique(case_ids, return_inverse=True)
+    keys, amounts = np.unique(day_codes * len(observed_ids) + id_codes, return_counts=True)
+    index = pd.MultiIndex(levels=[pd.DatetimeIndex([day_ordinal_to_timestamp(day) for day in observed_days]),
+                                  observed_ids], codes=[keys // len(observed_ids), keys % len(observed_ids)],
+                          names=['day', 'variant_id'])
+    return pd.Series(amounts.astype(np.int64), index=index, name='cases'), dictionary
+
+
+def remap_variant_ids(variants: pd.Series, remapping: dict) -> pd.Series:
+    """
+    :param variants: case amounts indexed by 'day' and 'variant_id', see 'compute_variants'
+    :param remapping: the new ids of variants, as returned by 'VariantDictionary.merge'
+    :return: the case amounts with the ids rewritten
+    """
+    if not remapping:
+        return variants
+    variant_ids = variants.index.get_level_values('variant_id')
+    variant_ids = pd.Index([remapping.get(variant_id, variant_id) for variant_id in variant_ids], dtype=np.int64)
+    remapped = pd.Series(variants.values, index=pd.MultiIndex.from_arrays(
+        [variants.index.get_level_values('day'), variant_ids], names=['day', 'variant_id']), name=variants.name)
+    return remapped.groupby(level=['day', 'variant_id']).sum()
+
+
+def merge_variants(variants: pd.Series, dictionary: VariantDictionary, other_variants: pd.Series,
+                   other_dictionary: VariantDictionary) -> (pd.Series, VariantDictionary):
+    """
+    Merges the variants of two event logs, e.g. of two files of the same days.
+    :param variants: case amounts indexed by 'day' and 'variant_id', see 'compute_variants'
+    :param dictionary: the dictionary of the variants, it is extended by the other dictionary
+    :param other_variants: further case amounts
+    :param other_dictionary: the dictionary of the further case amounts
+    :return: the summed case amounts, the dictionary
+    """
+    other_variants = remap_variant_ids(other_variants, dictionary.merge(other_dictionary))
+    merged = variants.add(other_variants, fill_value=0).astype(np.int64)
+    merged.name = 'cases'
+    return merged, dictionary
+
+
+def summarize_variants(variants: pd.Series, top_k=10, dictionary=None) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Keeps the top_k most frequent variants of every day and summarizes the long tail of the remaining ones.
+    :param variants: case amounts indexed by 'day' and 'variant_id', see 'compute_variants'
+    :param top_k: the amount of variants kept per day
+    :param dictionary: the VariantDictionary to label the kept variants with, None to not label them
+    :return: a pd.DataFrame of the top variants with the columns 'day', 'rank', 'variant_id', 'cases', 'share' (of the
+    cases of the day) and 'variant' if labelled, a pd.DataFrame indexed by 'day' with the columns 'variants' and
+    'cases' of the day, 'tail_variants', 'tail_cases' and 'tail_singletons' (tail variants of a single case).
+    """
+    frame = variants.rename('cases').reset_index()
+    # Ties are broken by the variant id, hence the ranks are deterministic
+    frame = frame.sort_values(['day', 'cases', 'variant_id'], ascending=[True, False, True], kind='mergesort')
+    frame['rank'] = frame.groupby('day').cumcount().values + 1
+    day_cases = frame.groupby('day')['cases'].transform('sum')
+
+    is_top = frame['rank'].values <= top_k
+    top = frame[is_top][['day', 'rank', 'variant_id', 'cases']].reset_index(drop=True)
+    top['share'] = frame['cases'].values[is_top] / day_cases.values[is_top]
+    if dictionary is not None:
+        top['variant'] = dictionary.get_labels(top['variant_id'].values)
+
+    tail = frame[~is_top]
+    summary = pd.DataFrame({'variants': frame.groupby('day').size(),
+                            'cases': frame.groupby('day')['cases'].sum(),
+                            'tail_variants': tail.groupby('day').size(),
+                            'tail_cases': tail.groupby('day')['cases'].sum(),
+                            'tail_singletons': (tail['cases'] == 1).groupby(tail['day']).sum()},
+                           columns=['variants', 'cases', 'tail_variants', 'tail_cases', 'tail_singletons'])
+    summary = summary.fillna(0).astype(np.int64)
+    summary.index.name = 'day'
+    return top, summary
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Mines the process variants of parsed event logs per day.')
+    argument_parser.add_argument('event_logs', nargs='+', help='event log csv files written by the orchestrator')
+    argument_parser.add_argument('--top-k', type=int, default=10, help='amount of variants kept per day')
+    argument_parser.add_argument('--activity-encoder', default=None,
+                                 help='activities of the events, the transaction types if not given, see '
+                                      'miner.activity_encoders')
+    argument_parser.add_argument('--output-prefix', default='variants', help='prefix of the written csv files')
+    args = argument_parser.parse_args()
+
+    variants = None
+    dictionary = VariantDictionary()
+    for path in args.event_logs:
+        file_variants, dictionary = compute_variants(pd.read_csv(path, index_col=0), args.activity_encoder,
+                                                     dictionary)
+        variants = file_variants if variants is None else variants.add(file_variants, fill_value=0).astype(np.int64)
+        print('Mined {} variants of {}'.format(len(file_variants), path))
+
+    top, summary = summarize_variants(variants, args.top_k, dictionary)
+    top.to_csv('{}_top.csv'.format(args.output_prefix), index=False)
+    summary.to_csv('{}_summary.csv'.format(args.output_prefix))
+    dictionary.to_frame().to_csv('{}_dictionary.csv'.format(args.output_prefix))
+    print('Wrote {} top variants of {} days and {} variants to {}_*.csv'.format(len(top), len(summary),
+                                                                                len(dictionary), args.output_prefix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+MANIFEST_FILENAME = 'orchestration_manifest.json'
+PARTIALS_DIRECTORY = 'orchestration_partials'
+MANIFEST_VERSION = 1
+
+
+def get_file_identity(path, with_hash=False) -> dict:
+    """
+    Evaluates the identity of an input file.
+    :param path: the path to the file
+    :param with_hash: also compute the sha256 hash of the file content
+    :return: a dict with the 'size', 'mtime_ns' and 'sha256' (None if not computed) of the file
+    """
+    stat = os.stat(path)
+    sha256 = None
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+
+
+def is_unchanged(entry: dict, identity: dict) -> bool:
+    """
+    Checks if a file still has the identity recorded in its manifest entry. Content hashes are only compared if both
+    are known.
+    :param entry: the manifest entry of the file, None if there is none
+    :param identity: the current identity as returned by 'get_file_identity'
+    :return: True if the file was recorded and did not change since
+    """
+    if entry is None or entry['size'] != identity['size'] or entry['mtime_ns'] != identity['mtime_ns']:
+        return False
+    if entry['sha256'] is not None and identity['sha256'] is not None:
+        return entry['sha256'] == identity['sha256']
+    return True
+
+
+def new_manifest() -> dict:
+    """
+    :return: an empty manifest
+    """
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+
+def load_manifest(path) -> dict:
+    """
+    Loads the manifest of the processed files.
+    :param path: the path to the manifest json file
+    :return: the manifest, an empty one if the file does not exist
+    """
+    if not os.path.exists(path):
+        return new_manifest()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError('Unsupported manifest version {} in {}'.format(manifest.get('version'), path))
+    return manifest
+
+
+def save_manifest(manifest: dict, path):
+    """
+    Saves the manifest atomically, hence a crash never leaves a partially written manifest behind.
+    :param manifest: the manifest
+    :param path: the path to the manifest json file
+    """
+    temporary_path = '{}.tmp'.format(path)
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def record_file(manifest: dict, path, identity: dict, matches: bool, j=None, partial_path=None):
+    """
+    Records a processed file in the manifest.
+    :param manifest: the manifest
+    :param path: the path to the file
+    :param identity: the identity of the file as returned by 'get_file_identity'
+    :param matches: if the file matches the raw transaction pattern
+    :param j: the running number of the file
+    :param partial_path: the path to the stored partial aggregates of the file
+    """
+    entry = dict(identity)
+    entry.update({'matches': matches, 'j': j, 'partial': partial_path})
+    manifest['files'][path] = entry
+
+
+def remove_file(manifest: dict, path):
+    """
+    Removes a file and its stored partial aggregates from the manifest, e.g. of a deleted file.
+    :param manifest: the manifest
+    :param path: the path to the file
+    """
+    entry = manifest['files'].pop(path)
+    in_use = set(other['partial'] for other in manifest['files'].values())
+    if entry['partial'] is not None and entry['partial'] not in in_use and os.path.isfile(entry['partial']):
+        os.remove(entry['partial'])
+
+
+def get_next_number(manifest: dict) -> int:
+    """
+    :param manifest: the manifest
+    :return: the next unused running number of a file
+    """
+    numbers = [entry['j'] for entry in manifest['files'].values() if entry['j'] is not None]
+    return max(numbers) + 1 if numbers else 0
+
+
+def get_partial_path(path) -> str:
+    """
+    :param path: the path to a raw transaction file
+    :return: the path to store its partial aggregates at
+    """
+    return os.path.join(PARTIALS_DIRECTORY, '{}.pkl'.format(os.path.basename(path)))
+
+
+def save_partial(partial: dict, path):
+    """
+    Saves the partial aggregates of a file atomically.
+    :param partial: the partial aggregates as returned by 'mine_file'
+    :param path: the path to store the partial aggregates at
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary_path = '{}.tmp'.format(path)
+    pd.to_pickle(partial, temporary_path)
+    os.replace(temporary_path, path)
+
+
+def load_partial(path) -> dict:
+    """
+    :param path: the path of the stored partial aggregates
+    :return: the partial aggregates
+    """
+    return pd.read_pickle(path)
@@ -1,169 +1,292 @@
 import os
-import ntpath
-import glob
-import time
-from sys import argv
+import shutil
+import pickle
+import argparse
+import multiprocessing
+from multiprocessing import Pool
 
 import pandas as pd
 import numpy as np
 
 # Constants
-from config.constants import RAW_TRANSACTION_COLUMN_NAMES, CONTRACT_LOOKUP_COLUMN_NAMES, \
-    BLOCK_TIMES_COLUMN_NAMES, ADDRESSES_LOOKUP_COLUMN_NAMES, TRANSACTION_LOOKUP_COLUMN_NAMES
+from config.constants import BLOCK_TIMES_COLUMN_NAMES, ADDRESSES_LOOKUP_COLUMN_NAMES, TRANSACTION_LOOKUP_COLUMN_NAMES, \
+    ACTIVITY_ALPHABET, TRANSITION_COLUMN_NAMES
 
 from parser import event_log_parser as parser
+from parser.hash_index import HashIndex
+from parser.lookup_builder import check_data_fame_conformance
+from parser.raw_reader import read_raw_transactions, matches_raw_transaction_pattern, get_raw_chunksize, \
+    get_raw_transaction_infix, find_raw_transaction_files, prefetch_raw_transactions, resolve_csv_engine, \
+    resolve_prefetch, CSV_ENGINES
+from parser.actor_attributes import build_actor_attributes
+from parser.block_index import BlockIndex, build_block_index, get_day_ordinals, day_ordinal_to_timestamp
 from miner import heuristic_miner as miner
+from orchestration import manifest as manifest_store
+from storage import columnar
+from storage.rollup_cube import RollupCube, build_rollup_cube, BUCKET_SECONDS, ROLLUP_DIRECTORY
+from storage import result_store
+from instrumentation import metrics
 
 import logging
-logging.basicConfig(filename='process_miner_orchestration.log', level=logging.DEBUG)
 
 pd.options.mode.chained_assignment = None
 
-script, arg0, arg1, arg2, arg3 = argv
+trace_length_columns = [i for i in range(0, 10000)]
 
-#Paths
-path_to_raw_transaction_bulk = arg0
-#'/Users/marcelmuller/Documents/Uni/Master/Semester_9_SS_18/Masterarbeit/parity_transactions'
-path_transaction_lookup = arg1
-#'/Users/marcelmuller/Documents/Uni/Master/Semester_9_SS_18/Masterarbeit/transaction_lookup.csv'
-path_address_lookup = arg2
-#'/Users/marcelmuller/Documents/Uni/Master/Semester_9_SS_18/Masterarbeit/address_lookup.csv'
-path_block_times = arg3
-#'/Users/marcelmuller/Documents/Uni/Master/Semester_9_SS_18/Masterarbeit/blockTimes.csv'
+# Lookups of the current process, set by 'init_lookups'
+transaction_lookup = None
+addresses_lookup = None
+block_times = None
+actor_attributes = None
+# Error of the pool initializer of the current process, raised by its tasks
+worker_error = None
 
-extension = 'csv'
 
+def load_lookups(path_transaction_lookup, path_address_lookup, path_block_times):
+    """
+    Loads and checks the lookup tables.
+    :param path_transaction_lookup: the transaction lookup csv file or its binary hash index directory
+    :param path_address_lookup: the address lookup csv file or its binary hash index directory
+    :param path_block_times: the block times csv file or its block index directory
+    :return: the transaction lookup, the addresses lookup, the block times as BlockIndex, the ActorAttributes of the
+    addresses lookup
+    """
+    # Lookups given as directories are binary hash indices written by the address and transaction shortener
+    if os.path.isdir(path_transaction_lookup):
+        transaction_lookup = HashIndex.load(path_transaction_lookup)
+    else:
+        transaction_lookup = pd.read_csv(path_transaction_lookup)
+        if not check_data_fame_conformance(transaction_lookup, TRANSACTION_LOOKUP_COLUMN_NAMES):
+            raise SyntaxError('The column names of the transaction lookup csv file do no match the required column names: {}'.format(TRANSACTION_LOOKUP_COLUMN_NAMES))
 
-def check_data_fame_conformance(df, pattern):
-    if pattern.issubset(df.columns):
-        return True
+    if os.path.isdir(path_address_lookup):
+        addresses_lookup = HashIndex.load(path_address_lookup)
     else:
-        return False
+        addresses_lookup = pd.read_csv(path_address_lookup)
+        if not check_data_fame_conformance(addresses_lookup, ADDRESSES_LOOKUP_COLUMN_NAMES):
+            raise SyntaxError('The column names of the addresses lookup csv file do no match the required column names: {}'.format(ADDRESSES_LOOKUP_COLUMN_NAMES))
 
+    if os.path.isdir(path_block_times):
+        block_times = BlockIndex.load(path_block_times)
+    else:
+        block_times = pd.read_csv(path_block_times)
+        if not check_data_fame_conformance(block_times, BLOCK_TIMES_COLUMN_NAMES):
+            raise SyntaxError('The column names of the block times lookup csv file do no match the required colum names: {}'.format(BLOCK_TIMES_COLUMN_NAMES))
+        block_times = build_block_index(block_times)
+    return transaction_lookup, addresses_lookup, block_times, build_actor_attributes(addresses_lookup)
 
-def mine_segment_by_day(parsed_events, name, suffix) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+
+def init_lookups(lookups):
     """
-    Utility function to mine a DataFrame of parsed events aggregated by day.
-    :param parsed_events: the input Data from the parser module.
-    :param name: a unique name for the origin of the mined day (e.g. "trasactions5000000-5100000")
-    :param suffix: a suffix to get added to any file name.
-    :return: three data frames. One for the global dependencies, one for the confidences. Columns: 'day', 'CtC->CtC',
-    'CtC->CtU', 'CtC->UtU', 'CtC->end', 'CtU->CtC', 'CtU->CtU','CtU->UtC', 'CtU->UtU', 'CtU->end', 'UtC->CtC',
-    'UtC->CtU', 'UtC->UtC', 'UtC->UtU', 'UtC->end', 'UtU->CtC', 'UtU->CtU', 'UtU->UtC', 'UtU->UtU', 'UtU->end',
-    'sta->CtC', 'sta->UtC', 'sta->UtU' and one for the case lengths.
-    """
-    global_dependencies_l = pd.DataFrame(columns=['day', 'CtC->CtC', 'CtC->CtU', 'CtC->UtU', 'CtC->end', 'CtU->CtC', 'CtU->CtU',
-       'CtU->UtC', 'CtU->UtU', 'CtU->end', 'UtC->CtC', 'UtC->CtU', 'UtC->UtC',
-       'UtC->UtU', 'UtC->end', 'UtU->CtC', 'UtU->CtU', 'UtU->UtC', 'UtU->UtU',
-       'UtU->end', 'sta->CtC', 'sta->UtC', 'sta->UtU'])
-    global_confidences_l = pd.DataFrame(columns=['day', 'CtC->CtC', 'CtC->CtU', 'CtC->UtU', 'CtC->end', 'CtU->CtC', 'CtU->CtU',
-       'CtU->UtC', 'CtU->UtU', 'CtU->end', 'UtC->CtC', 'UtC->CtU', 'UtC->UtC',
-       'UtC->UtU', 'UtC->end', 'UtU->CtC', 'UtU->CtU', 'UtU->UtC', 'UtU->UtU',
-       'UtU->end', 'sta->CtC', 'sta->UtC', 'sta->UtU'])
-    parsed_events['day'] = pd.to_datetime(parsed_events['timestamp'], unit='s').dt.normalize()
-    groups = parsed_events.groupby('day')
-    global_case_amount_l = pd.DataFrame(columns={'day', 'cases'})
-    for day, group in groups:
-        start = time.time()
-        s = pd.Series([day, len(group['transaction_id'].unique())], index=['day', 'cases'])
-        global_case_amount_l = global_case_amount_l.append(s, ignore_index=True)
-        transitions, transitions_agg = miner.compute_transitions(group)
-        confidence = miner.compute_dependency_confidence(transitions_agg)
+    Sets the lookups used by 'mine_file' in the current process. Used as process pool initializer.
+    :param lookups: the transaction lookup, the addresses lookup, the block times, the actor attributes
+    """
+    global transaction_lookup, addresses_lookup, block_times, actor_attributes
+    transaction_lookup, addresses_lookup, block_times, actor_attributes = lookups
+
+
+def write_day_results(day, name, suffix, transitions, transitions_agg, confidence, output_format):
+    """
+    Writes the mining results of one day of a file.
+    :param day: the mined day
+    :param name: a unique name for the origin of the mined day
+    :param suffix: a suffix to get added to any file name
+    :param transitions: the transitions as returned by 'compute_transitions'
+    :param transitions_agg: the transition occurrence frequencies as returned by 'compute_transitions'
+    :param confidence: the confidences as returned by 'compute_dependency_confidence'
+    :param output_format: 'csv' for the mr_ csv files, 'parquet' or 'npy' for the day partitioned datasets
+    'transitions', 'transitions_agg' and 'confidence'
+    """
+    if output_format == 'csv':
         transitions_agg['day'] = day
-        global_dependencies_l = global_dependencies_l.append(transitions_agg, ignore_index=True)
-        global_confidences_l = global_confidences_l.append(confidence, ignore_index=True)
         transitions.to_csv('mr_{}_in_{}_{}_transitions.csv'.format(day, name, suffix))
         transitions_agg.to_csv('mr_{}_in_{}_{}_transitions_agg.csv'.format(day, name, suffix))
         confidence.to_csv('mr_{}_in_{}_{}_confidence.csv'.format(day, name, suffix))
-        end = time.time()
-        logging.info('Mined processes for {} in {}'.format(day, end-start))
-        print('Mined processes for {} in {}'.format(day, end-start))
+        return
+    part = '{}_{}'.format(name, suffix)
+    transitions['transition'] = transitions['transition'].astype('category')
+    columnar.write_frame(transitions, 'transitions', day, part, output_format)
+    transitions_agg = pd.DataFrame({'transition': transitions_agg.index.astype(str),
+                                    'count': transitions_agg.values.astype(np.int64)}, columns=['transition', 'count'])
+    columnar.write_frame(transitions_agg, 'transitions_agg', day, part, output_format)
+    confidence = pd.DataFrame({'transition': confidence.index.astype(str),
+                               'confidence': confidence.values.astype(np.float64)}, columns=['transition', 'confidence'])
+    columnar.write_frame(confidence, 'confidence', day, part, output_format)
+
+
+def mine_segment_by_day(parsed_events, name, suffix, output_format='csv', day_transitions=None) -> (pd.DataFrame,
+                                                                                                    pd.DataFrame,
+                                                                                                    pd.DataFrame):
+    """
+    Utility function to mine a DataFrame of parsed events aggregated by day.
+    :param parsed_events: the input Data from the parser module.
+    :param name: a unique name for the origin of the mined day (e.g. "trasactions5000000-5100000")
+    :param suffix: a suffix to get added to any file name.
+    :param output_format: the resolved output format of the per day mining results, see 'write_day_results'
+    :param day_transitions: a list to collect the positions of the events, the transition codes and their rows of every
+    day in, e.g. for 'build_rollup_cube'. None to not collect them.
+    :return: three data frames. One for the global dependencies, one for the confidences. Columns: 'day' and
+    TRANSITION_COLUMN_NAMES, followed by any further observed transition, and one for the case amounts.
+    """
+    groups = parsed_events.groupby(get_day_ordinals(parsed_events['timestamp'].values))
+    days = []
+    cases = []
+    transition_tensor = np.zeros((len(groups), len(ACTIVITY_ALPHABET), len(ACTIVITY_ALPHABET)), dtype=np.int64)
+    for i, (day_ordinal, group) in enumerate(groups):
+        day = day_ordinal_to_timestamp(day_ordinal)
+        days.append(day)
+        with metrics.tagged(day=str(day)[0:10]), metrics.stage('mine_day', len(group)) as day_record:
+            cases.append(len(group['transaction_id'].unique()))
+            with metrics.stage('transitions', len(group)) as record:
+                transition_codes = miner.compute_transition_codes(group, ordered=True)
+                transitions, transitions_agg, transition_tensor[i] = miner.transitions_from_codes(group,
+                                                                                                  *transition_codes)
+                if day_transitions is not None:
+                    day_transitions.append((groups.indices[day_ordinal],) + transition_codes[:2])
+                record['rows_out'] = len(transitions)
+            with metrics.stage('confidence', len(transitions_agg)) as record:
+                confidence = miner.compute_dependency_confidence(transitions_agg)
+                record['rows_out'] = len(confidence)
+            with metrics.stage('write_day_results', len(transitions)):
+                write_day_results(day, name, suffix, transitions, transitions_agg, confidence, output_format)
+            day_record['rows_out'] = len(transitions)
+        logging.info('Mined processes for {} in {}'.format(day, day_record['wall_seconds']))
+        print('Mined processes for {} in {}'.format(day, day_record['wall_seconds']))
+
+    confidence_tensor = miner.compute_dependency_confidence_matrix(transition_tensor)
+    global_dependencies_l = miner.transition_tensor_to_frame(days, transition_tensor)
+    global_confidences_l = miner.confidence_tensor_to_frame(days, confidence_tensor)
+    global_case_amount_l = pd.DataFrame({'day': days, 'cases': cases}, columns=['day', 'cases'])
     return global_dependencies_l, global_confidences_l, global_case_amount_l
 
 
-# Data Frames
-#contracts_lookup = pd.read_csv(path_contracts_lookup)
-
-logging.info('Loading provided input files')
-print('Loading provided input files')
-transaction_lookup = pd.read_csv(path_transaction_lookup)
-addresses_lookup = pd.read_csv(path_address_lookup)
-block_times = pd.read_csv(path_block_times)
-
-if not check_data_fame_conformance(transaction_lookup, TRANSACTION_LOOKUP_COLUMN_NAMES):
-    raise SyntaxError('The column names of the transaction lookup csv file do no match the required column names: {}'.format(TRANSACTION_LOOKUP_COLUMN_NAMES))
-
-if not check_data_fame_conformance(addresses_lookup, ADDRESSES_LOOKUP_COLUMN_NAMES):
-    raise SyntaxError('The column names of the addresses lookup csv file do no match the required column names: {}'.format(ADDRESSES_LOOKUP_COLUMN_NAMES))
-
-if not check_data_fame_conformance(block_times, BLOCK_TIMES_COLUMN_NAMES):
-    raise SyntaxError('The column names of the block times lookup csv file do no match the required colum names: {}'.format(BLOCK_TIMES_COLUMN_NAMES))
-
-os.chdir(path_to_raw_transaction_bulk)
-
-global_dependencies = pd.DataFrame(columns=['day', 'CtC->CtC', 'CtC->CtU', 'CtC->UtU', 'CtC->end', 'CtU->CtC', 'CtU->CtU',
-       'CtU->UtC', 'CtU->UtU', 'CtU->end', 'UtC->CtC', 'UtC->CtU', 'UtC->UtC',
-       'UtC->UtU', 'UtC->end', 'UtU->CtC', 'UtU->CtU', 'UtU->UtC', 'UtU->UtU',
-       'UtU->end', 'sta->CtC', 'sta->UtC', 'sta->UtU'])
-global_confidences = pd.DataFrame(columns=['day', 'CtC->CtC', 'CtC->CtU', 'CtC->UtU', 'CtC->end', 'CtU->CtC', 'CtU->CtU',
-       'CtU->UtC', 'CtU->UtU', 'CtU->end', 'UtC->CtC', 'UtC->CtU', 'UtC->UtC',
-       'UtC->UtU', 'UtC->end', 'UtU->CtC', 'UtU->CtU', 'UtU->UtC', 'UtU->UtU',
-       'UtU->end', 'sta->CtC', 'sta->UtC', 'sta->UtU'])
-
-global_case_amount = pd.DataFrame(columns={'day', 'cases'})
-
-global_trace_lengths_columns = ['day'] + [i for i in range(0, 10000)]
-global_trace_lengths = pd.DataFrame(columns=global_trace_lengths_columns)
-
-raw_transaction_candidates = [i for i in glob.glob('*.{}'.format(extension))]
-j = 0
-
-for candidate_path in raw_transaction_candidates:
-    path_head, path_tail = ntpath.split(candidate_path)
-    file_infix = path_tail[:-4]
-    raw_transactions = pd.read_csv(candidate_path)
-    if not check_data_fame_conformance(raw_transactions, RAW_TRANSACTION_COLUMN_NAMES):
-        logging.info('File {} not matching the raw transaction pattern. Skipping now'.format(candidate_path))
-        print('File {} not matching the raw transaction pattern. Skipping now'.format(candidate_path))
-    else:
+def mine_file(candidate_path, j, output_format='csv', chunksize=None, rollup_granularity=None, engine='c',
+              raw_transactions=None) -> dict:
+    """
+    Parses and mines one raw transaction file and writes its event log, trace lengths and mining results.
+    :param candidate_path: the path to the raw transaction csv file
+    :param j: the running number of the file, used as suffix of the mining results
+    :param output_format: the resolved output format of the event log and the mining results, 'csv', 'parquet' or
+    'npy'. Columnar event logs are written to the day partitioned dataset 'event_log'.
+    :param chunksize: the amount of raw transaction rows to read and join at once, None to read the whole file
+    :param rollup_granularity: the granularity of the rollup cube of the file, None to not build one
+    :param engine: the resolved csv engine to read the raw transactions with, see 'resolve_csv_engine'
+    :param raw_transactions: the raw transaction chunks of the file if read already, e.g. by
+    'prefetch_raw_transactions'. None to read them.
+    :return: the partial aggregates of the file as dict: the data frames 'dependencies' and 'case_amount' indexed by
+    day, the sparse histogram 'trace_lengths' indexed by day and trace length and the RollupCube 'rollup' if built
+    """
+    file_infix = get_raw_transaction_infix(candidate_path)
+    if raw_transactions is None:
+        raw_transactions = read_raw_transactions(candidate_path, chunksize, engine)
+    with metrics.tagged(file=file_infix):
         logging.info('Provided file {} matches the raw transaction pattern. Applying now parsing operation'.format(
             candidate_path))
         print('Provided file {} matches the raw transaction pattern. Applying now parsing operation'.format(
             candidate_path))
 
-        parsing_start = time.time()
+        with metrics.stage('parse_event_log') as parsing_record:
+            events, trace_lengths = parser.parse_event_log_chunks(raw_transactions,
+                                                                  transaction_lookup, addresses_lookup, block_times,
+                                                                  actor_attributes=actor_attributes)
+            parsing_record['rows_out'] = len(events)
+        with metrics.stage('write_event_log', len(events)):
+            parser.trace_lengths_to_frame(trace_lengths).to_csv('ps_{}_trace_lengths.csv'.format(file_infix))
+            if output_format == 'csv':
+                events.to_csv('ps_{}_event_log.csv'.format(file_infix))
+            else:
+                columnar.write_frame_by_day(events, 'event_log', file_infix, output_format)
+
+        logging.info('Parsed {} in {}s'.format(file_infix, parsing_record['wall_seconds']))
+        print('Parsed {} in {}s'.format(file_infix, parsing_record['wall_seconds']))
 
-        events, trace_lengths = parser.parse_event_log(raw_transactions, transaction_lookup, addresses_lookup, block_times)
-        trace_lengths = trace_lengths.reindex_axis(sorted(trace_lengths.columns), axis=1)
-        trace_lengths.to_csv('ps_{}_trace_lengths.csv'.format(file_infix))
-        events.to_csv('ps_{}_event_log.csv'.format(file_infix))
+        logging.info('Starting now mining operation for {}'.format(file_infix))
+        print('Starting now mining operation for {}'.format(file_infix))
 
-        global_trace_lengths = global_trace_lengths.append(trace_lengths)
-        global_trace_lengths = global_trace_lengths.fillna(0)
-        global_trace_lengths['day'] = global_trace_lengths.index
-        reduced_global_trace_lengths = global_trace_lengths.groupby('day').sum()
+        day_transitions = [] if rollup_granularity is not None else None
+        dep, con, cases = mine_segment_by_day(events, file_infix, j, output_format, day_transitions)
+        partial = {'dependencies': dep.set_index('day'),
+                   'case_amount': cases.set_index('day'),
+                   'trace_lengths': trace_lengths}
+        if rollup_granularity is not None:
+            with metrics.stage('rollup', len(events)) as record:
+                partial['rollup'] = build_rollup_cube(events, rollup_granularity, day_transitions)
+                record['rows_out'] = len(partial['rollup'])
+    return partial
 
-        parsing_end = time.time()
 
-        logging.info('Parsed {} in {}s'.format(file_infix, parsing_end - parsing_start))
-        print('Parsed {} in {}s'.format(file_infix, parsing_end - parsing_start))
+def init_worker(lookups, settings):
+    """
+    Initializes a process of the pool: sets its lookups and instrumentation. A pool restarts processes whose initializer
+    fails forever, hence errors are kept and raised by the tasks of the process instead.
+    :param lookups: the lookups as returned by 'load_lookups', or pickled as returned by 'get_worker_lookups'
+    :param settings: the instrumentation settings as returned by 'metrics.get_settings'
+    """
+    global worker_error
+    try:
+        if isinstance(lookups, bytes):
+            lookups = pickle.loads(lookups)
+        init_lookups(lookups)
+        metrics.configure(**settings)
+    except Exception as e:
+        logging.exception('Initializing the worker {} failed'.format(os.getpid()))
+        worker_error = e
+
+
+def get_worker_lookups(lookups):
+    """
+    :param lookups: the lookups as returned by 'load_lookups'
+    :return: the lookups to pass to 'init_worker'. Unless the processes are forked, they are pickled here, so that a
+    lookup failing to load in a worker is caught by 'init_worker' and not by the pool
+    """
+    if multiprocessing.get_start_method() == 'fork':
+        return lookups
+    return pickle.dumps(lookups, protocol=pickle.HIGHEST_PROTOCOL)
 
-        mining_start = time.time()
 
-        logging.info('Starting now mining operation for {}'.format(file_infix))
-        print('Starting now mining operation for {}'.format(file_infix))
-        events['day'] = pd.to_datetime(events['timestamp'], unit='s').dt.normalize()
+def mine_file_star(args) -> dict:
+    if worker_error is not None:
+        raise RuntimeError('Initializing the worker {} failed: {!r}'.format(os.getpid(), worker_error))
+    return mine_file(*args)
+
 
-        dep, con, cases = mine_segment_by_day(events, file_infix, j)
-        global_dependencies = global_dependencies.append(dep)
-        global_confidences = global_confidences.append(con)
-        global_case_amount = global_case_amount.append(cases)
+def merge_partials(totals: dict, partial: dict) -> dict:
+    """
+    Adds the partial aggregates of a file to the totals. The merge is associative and commutative.
+    :param totals: the totals so far, an empty dict for none
+    :param partial: the partial aggregates as returned by 'mine_file'
+    :return: the merged totals
+    """
+    merged = {}
+    for key, frame in partial.items():
+        if isinstance(frame, RollupCube):
+            merged[key] = totals[key].merge(frame) if key in totals else frame
+        elif key in totals:
+            merged[key] = totals[key].add(frame, fill_value=0).fillna(0).astype(np.int64)
+        else:
+            merged[key] = frame.astype(np.int64)
+    return merged
+
+
+def write_reduced(totals: dict, result_store_path=None):
+    """
+    Writes the reduced global dependencies, trace lengths and case amounts of the totals, and their rollup cube if any
+    to the directory ROLLUP_DIRECTORY.
+    :param totals: the totals as returned by 'merge_partials'
+    :param result_store_path: the SQLite file to write the reduced results to for indexed queries, None to not write it
+    """
+    with metrics.stage('write_reduced', len(totals['dependencies'])):
+        reduced_global_dependencies = totals['dependencies'].sort_index()
+        columns = [column for column in TRANSITION_COLUMN_NAMES if column in reduced_global_dependencies.columns]
+        columns += sorted(set(reduced_global_dependencies.columns) - set(columns))
+        reduced_global_dependencies = reduced_global_dependencies[columns]
+        reduced_global_dependencies['total_events'] = reduced_global_dependencies.sum(axis=1)
+        reduced_global_dependencies.index.name = 'day'
 
-        global_dependencies = global_dependencies.fillna(0)
-        global_dependencies['total_events'] = global_dependencies.sum(axis=1)
+        reduced_global_trace_lengths = parser.trace_lengths_to_frame(totals['trace_lengths'], trace_length_columns)
 
-        reduced_global_dependencies = global_dependencies.groupby('day').sum()
-        reduced_global_case_amount = global_case_amount.groupby('day').sum()
+        reduced_global_case_amount = totals['case_amount'].sort_index()
+        reduced_global_case_amount.index.name = 'day'
 
         min_day = reduced_global_dependencies.index.min()
         max_day = reduced_global_dependencies.index.max()
@@ -175,5 +298,179 @@ for candidate_path in raw_transaction_candidates:
 
         rgca_filename = 'rgca_{}_to_{}.csv'.format(str(min_day)[0:10], str(max_day)[0:10])
         reduced_global_case_amount.to_csv(rgca_filename)
-        j += 1
+        logging.info('Wrote {}, {} and {}'.format(rgd_filename, rgtl_filename, rgca_filename))
+
+        # A cube of earlier outputs is removed in any case
+        if os.path.isdir(ROLLUP_DIRECTORY):
+            shutil.rmtree(ROLLUP_DIRECTORY)
+        if 'rollup' in totals:
+            totals['rollup'].save(ROLLUP_DIRECTORY)
+            logging.info('Wrote the {} rollup cube to {}'.format(totals['rollup'].granularity, ROLLUP_DIRECTORY))
+
+        if result_store_path is not None:
+            result_store.write_results(result_store_path, reduced_global_dependencies, reduced_global_case_amount,
+                                       totals['trace_lengths'])
+            logging.info('Wrote the reduced results to {}'.format(result_store_path))
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Parses and mines a directory of raw transaction files.')
+    argument_parser.add_argument('path_to_raw_transaction_bulk',
+                                 help='directory of the raw transaction csv files, the outputs are written there')
+    argument_parser.add_argument('path_transaction_lookup',
+                                 help='transaction lookup csv file or its binary index directory')
+    argument_parser.add_argument('path_address_lookup', help='address lookup csv file or its binary index directory')
+    argument_parser.add_argument('path_block_times', help='block times csv file or its block index directory')
+    argument_parser.add_argument('--workers', type=int, default=1,
+                                 help='amount of processes parsing and mining files in parallel')
+    argument_parser.add_argument('--checkpoint-every', type=int, default=0,
+                                 help='write the reduced outputs after every n mined files, 0 to write them once')
+    argument_parser.add_argument('--rebuild', action='store_true',
+                                 help='ignore the manifest of processed files and mine every file again')
+    argument_parser.add_argument('--hash-files', action='store_true',
+                                 help='identify changed files by their content hash in addition to size and mtime')
+    argument_parser.add_argument('--output-format', choices=columnar.OUTPUT_FORMATS, default='csv',
+                                 help='format of the event logs and per day mining results. columnar writes parquet '
+                                      'if pyarrow is installed and .npy column bundles otherwise, partitioned by day')
+    argument_parser.add_argument('--memory-budget', type=int, default=None,
+                                 help='memory in MB all processes together may use for reading raw transactions, '
+                                      'files are read in chunks fitting it. Whole files are read if not given')
+    argument_parser.add_argument('--prefetch', type=int, default=None,
+                                 help='amount of raw transaction files read ahead on background threads while a file '
+                                      'is mined, 0 to read files when mined. Applies to a single worker only. 1 with '
+                                      '--memory-budget, whose chunks read ahead count against it, 0 otherwise if '
+                                      'not given')
+    argument_parser.add_argument('--csv-engine', choices=CSV_ENGINES, default='auto',
+                                 help='engine reading the raw transactions. auto selects the multithreaded pyarrow '
+                                      'reader if pyarrow is installed and whole files are read (no --memory-budget), '
+                                      'the pandas c engine otherwise')
+    argument_parser.add_argument('--rollup-granularity', choices=sorted(BUCKET_SECONDS) + ['none'], default='hour',
+                                 help='granularity of the rollup cube of transitions, cases and trace lengths to '
+                                      'query coarser buckets and time ranges from, none to not build it')
+    argument_parser.add_argument('--result-store', default=None,
+                                 help='SQLite file the reduced results are written to for queries by day and '
+                                      'transition, see storage.result_store. {} in the directory of the raw '
+                                      'transactions if not given, none to not write it'.format(
+                                          result_store.RESULT_STORE_FILENAME))
+    metrics.add_arguments(argument_parser, 'process_miner_orchestration.log')
+    args = argument_parser.parse_args()
+    metrics.configure_from_arguments(args)
+    output_format = columnar.resolve_output_format(args.output_format)
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+    prefetch = resolve_prefetch(args.prefetch, memory_budget, args.workers)
+    chunksize = get_raw_chunksize(memory_budget, args.workers, prefetch)
+    engine = resolve_csv_engine(args.csv_engine, chunksize)
+    rollup_granularity = args.rollup_granularity if args.rollup_granularity != 'none' else None
+    if args.result_store is None:
+        result_store_path = result_store.RESULT_STORE_FILENAME
+    elif args.result_store != 'none':
+        result_store_path = os.path.abspath(args.result_store)
+    else:
+        result_store_path = None
+
+    logging.info('Loading provided input files')
+    print('Loading provided input files')
+    lookups = load_lookups(args.path_transaction_lookup, args.path_address_lookup, args.path_block_times)
 
+    os.chdir(args.path_to_raw_transaction_bulk)
+
+    if args.rebuild:
+        manifest = manifest_store.new_manifest()
+    else:
+        manifest = manifest_store.load_manifest(manifest_store.MANIFEST_FILENAME)
+
+    # Files recorded in the manifest that did not change since are neither checked nor mined again
+    raw_transaction_candidates = find_raw_transaction_files()
+    # Files deleted or renamed since, e.g. compressed to .csv.gz, are no longer counted
+    stale_paths = sorted(set(manifest['files']) - set(raw_transaction_candidates))
+    for stale_path in stale_paths:
+        logging.warning('File {} of the manifest no longer exists. Removing its partial aggregates'.format(stale_path))
+        print('File {} of the manifest no longer exists. Removing its partial aggregates'.format(stale_path))
+        manifest_store.remove_file(manifest, stale_path)
+    pending = []
+    for candidate_path in raw_transaction_candidates:
+        identity = manifest_store.get_file_identity(candidate_path, args.hash_files)
+        if not manifest_store.is_unchanged(manifest['files'].get(candidate_path), identity):
+            pending.append((candidate_path, identity))
+    logging.info('{} of {} files are new or changed'.format(len(pending), len(raw_transaction_candidates)))
+    print('{} of {} files are new or changed'.format(len(pending), len(raw_transaction_candidates)))
+
+    tasks = []
+    next_j = manifest_store.get_next_number(manifest)
+    for candidate_path, identity in pending:
+        if not matches_raw_transaction_pattern(candidate_path):
+            logging.info('File {} not matching the raw transaction pattern. Skipping now'.format(candidate_path))
+            print('File {} not matching the raw transaction pattern. Skipping now'.format(candidate_path))
+            manifest_store.record_file(manifest, candidate_path, identity, False)
+            continue
+        entry = manifest['files'].get(candidate_path)
+        if entry is not None and entry['j'] is not None:
+            j = entry['j']
+        else:
+            j = next_j
+            next_j += 1
+        tasks.append((candidate_path, j, identity))
+    manifest_store.save_manifest(manifest, manifest_store.MANIFEST_FILENAME)
+
+    # Totals of the files mined in earlier runs
+    totals = {}
+    pending_paths = set(candidate_path for candidate_path, identity in pending)
+    partials = []
+    for path, entry in sorted(manifest['files'].items()):
+        if entry['partial'] is not None and path not in pending_paths:
+            partial = manifest_store.load_partial(entry['partial'])
+            partials.append((path, partial))
+
+    # A rollup cube is only written if it covers all files
+    for path, partial in partials:
+        if rollup_granularity is not None and (
+                'rollup' not in partial or partial['rollup'].granularity != rollup_granularity):
+            logging.warning('File {} was mined without a rollup cube by {}, no cube is written. Mine all files again '
+                            'with --rebuild to build it'.format(path, rollup_granularity))
+            print('File {} was mined without a rollup cube by {}, no cube is written. Mine all files again with '
+                  '--rebuild to build it'.format(path, rollup_granularity))
+            rollup_granularity = None
+    for path, partial in partials:
+        if rollup_granularity is None:
+            partial.pop('rollup', None)
+        totals = merge_partials(totals, partial)
+
+    raw_files = None
+    if args.workers > 1:
+        pool = Pool(args.workers, initializer=init_worker,
+                    initargs=(get_worker_lookups(lookups), metrics.get_settings()))
+        partials = pool.imap(mine_file_star, [(path, j, output_format, chunksize, rollup_granularity, engine)
+                                              for path, j, identity in tasks])
+    else:
+        pool = None
+        init_lookups(lookups)
+        # The next files are read and decoded in the background while the current one is mined
+        raw_files = prefetch_raw_transactions([path for path, j, identity in tasks], prefetch, chunksize, engine)
+        partials = (mine_file(path, j, output_format, chunksize, rollup_granularity, engine, raw_transactions)
+                    for (path, j, identity), (raw_path, raw_transactions) in zip(tasks, raw_files))
+
+    try:
+        for k, ((path, j, identity), partial) in enumerate(zip(tasks, partials)):
+            partial_path = manifest_store.get_partial_path(path)
+            manifest_store.save_partial(partial, partial_path)
+            manifest_store.record_file(manifest, path, identity, True, j, partial_path)
+            manifest_store.save_manifest(manifest, manifest_store.MANIFEST_FILENAME)
+            totals = merge_partials(totals, partial)
+            if args.checkpoint_every > 0 and (k + 1) % args.checkpoint_every == 0:
+                write_reduced(totals, result_store_path)
+    finally:
+        # All results are consumed unless an error occurred, in which case the remaining tasks are dropped
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if raw_files is not None:
+            raw_files.close()
+
+    # The totals are written again if files were mined since the last checkpoint or removed
+    checkpointed = tasks and args.checkpoint_every > 0 and len(tasks) % args.checkpoint_every == 0
+    if totals and ((tasks and not checkpointed) or (stale_paths and not tasks)):
+        write_reduced(totals, result_store_path)
+
+
+if __name__ == '__main__':
+    main()
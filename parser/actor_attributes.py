@@ -0,0 +1,120 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from parser.hash_index import HashIndex, ADDRESS_FLAG_NAMES
+
+# Actor and transaction types in the order of their category codes
+ACTOR_TYPES = ('C', 'U')
+TRANSACTION_TYPES = ('CtC', 'CtU', 'UtC', 'UtU')
+
+
+class ActorAttributes(object):
+    """
+    The attributes of all actors (isContract, isERC20, ...) as flag bits of a uint8 array indexed by address id.
+    Attributes are saved as a directory of .npy files and memory mapped on load.
+    """
+
+    def __init__(self, flags: np.ndarray, flag_names=(), path=None):
+        self.flags = flags
+        self.flag_names = tuple(flag_names)
+        self.path = path
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __reduce__(self):
+        if self.path is not None:
+            return ActorAttributes.load, (self.path,)
+        return ActorAttributes, (self.flags, self.flag_names)
+
+    def get_flag(self, ids, flag_name) -> np.ndarray:
+        """
+        :param ids: address ids, -1 for unknown addresses
+        :param flag_name: the name of the flag, e.g. 'isContract'
+        :return: a boolean array with the flag of every id, False for unknown ids or flags.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if flag_name not in self.flag_names or len(self.flags) == 0:
+            return np.zeros(len(ids), dtype=bool)
+        known = (ids >= 0) & (ids < len(self.flags))
+        bit = self.flag_names.index(flag_name)
+        return known & ((self.flags[np.where(known, ids, 0)] >> bit) & 1).astype(bool)
+
+    def save(self, path):
+        """
+        Saves the attributes as a directory of .npy files.
+        :param path: the directory to save to
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'flags.npy'), self.flags)
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump({'flag_names': list(self.flag_names)}, meta_file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads attributes saved with 'save'.
+        :param path: the directory of the attributes
+        :param mmap_mode: the numpy memory mapping mode, None to read the array into memory
+        :return: the ActorAttributes
+        """
+        path = os.path.abspath(path)
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        return cls(np.load(os.path.join(path, 'flags.npy'), mmap_mode=mmap_mode), meta['flag_names'],
+                   path if mmap_mode is not None else None)
+
+
+def build_actor_attributes(addresses_lookup) -> ActorAttributes:
+    """
+    Builds the attributes of all actors of an addresses lookup.
+    :param addresses_lookup: a lookup table with the columns 'id' and any of ADDRESS_FLAG_NAMES, or a HashIndex of it
+    :return: the ActorAttributes. Missing flags are False.
+    """
+    if isinstance(addresses_lookup, HashIndex):
+        ids = np.asarray(addresses_lookup.ids, dtype=np.int64)
+        flags = np.asarray(addresses_lookup.flags, dtype=np.uint8)
+        flag_names = addresses_lookup.flag_names
+    else:
+        addresses_lookup = addresses_lookup[addresses_lookup['id'].notnull()]
+        ids = addresses_lookup['id'].values.astype(np.int64)
+        flag_names = [flag_name for flag_name in ADDRESS_FLAG_NAMES if flag_name in addresses_lookup.columns]
+        flags = np.zeros(len(addresses_lookup), dtype=np.uint8)
+        for bit, flag_name in enumerate(flag_names):
+            flags |= addresses_lookup[flag_name].fillna(False).values.astype(bool).astype(np.uint8) << np.uint8(bit)
+
+    valid = ids >= 0
+    attributes = np.zeros(ids[valid].max() + 1 if valid.any() else 0, dtype=np.uint8)
+    # Of duplicated ids the first one is kept, as with a left merge on the lookup
+    attributes[ids[valid][::-1]] = flags[valid][::-1]
+    return ActorAttributes(attributes, flag_names)
+
+
+def get_actor_type_codes(is_contract: np.ndarray) -> np.ndarray:
+    """
+    :param is_contract: a boolean array whether the actors are contracts
+    :return: an int8 array with the codes of the actor types in ACTOR_TYPES
+    """
+    return (~np.asarray(is_contract, dtype=bool)).astype(np.int8)
+
+
+def get_transaction_type_codes(sender_codes: np.ndarray, receiver_codes: np.ndarray) -> np.ndarray:
+    """
+    :param sender_codes: the actor type codes of the senders
+    :param receiver_codes: the actor type codes of the receivers
+    :return: an int8 array with the codes of the transaction types in TRANSACTION_TYPES
+    """
+    return (sender_codes * len(ACTOR_TYPES) + receiver_codes).astype(np.int8)
+
+
+def to_categorical(codes: np.ndarray, categories) -> pd.Categorical:
+    """
+    :param codes: the type codes
+    :param categories: the types of the codes, e.g. TRANSACTION_TYPES
+    :return: a categorical of the observed types
+    """
+    return pd.Categorical.from_codes(codes, categories).remove_unused_categories()
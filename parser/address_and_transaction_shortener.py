@@ -1,104 +1,126 @@
-from sys import argv
-import glob
+import argparse
+import os
 import datetime
 import pandas as pd
-import time
 
-from config.constants import RAW_TRANSACTION_COLUMN_NAMES, \
-    CONTRACT_LOOKUP_COLUMN_NAMES, \
-    BLOCK_TIMES_COLUMN_NAMES
+from config.constants import CONTRACT_LOOKUP_COLUMN_NAMES
+from parser.lookup_builder import check_data_fame_conformance, collect_all_unique_keys, build_lookups, \
+    load_existing_lookups, extend_lookups, get_lookup_manifest_path
+from orchestration import manifest as manifest_store
+from parser.hash_index import build_address_index, build_transaction_index, get_index_path
+from parser.raw_reader import find_raw_transaction_files
+from instrumentation import metrics
 
 import logging
-logging.basicConfig(filename='address_shortner.log',
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M',
-                    level=logging.DEBUG)
-
-
-def check_data_fame_conformance(df, pattern):
-    if pattern.issubset(df.columns):
-        return True
-    else:
-        return False
-
-
-script, arg0, arg1, arg2, arg3 = argv
-
-pd.options.mode.chained_assignment = None
-
-path_to_raw_transaction_bulk = arg0
-#input("Please paste the path to raw transaction bulk directory (e.g. /Users/mister-x/[...]/parity_data)")
-    #'/Users/marcelmuller/Documents/Uni/Master/Semester_9_SS_18/Masterarbeit/parity_data'
-path_contracts_lookup = arg1
-#input("Please paste the path to the contracts lookup csv file (e.g. /Users/mister-x/[...]/parity_data/contractsWithERCFlags.csv)")
-    #'/Users/marcelmuller/Documents/Uni/Master/Semester_9_SS_18/Masterarbeit/contractsWithERCFlags.csv'
-
-address_lookup_filename = arg2
-#input("Please paste Path and name to the addresses lookup output csv file (e.g. /Users/mister-x/[...]/parity_data/address_lookup.csv)")
-
-transaction_lookup_filename = arg3
-#input("Please paste Path and name to the transactions lookup output csv file (e.g. /Users/mister-x/[...]/parity_data/transaction_lookup.csv)")
-
-print("{}- Applying now shortening. Please wait...".format(datetime.datetime.now()))
-logging.info("{}- Applying now shortening. Please wait...".format(datetime.datetime.now()))
-contracts_lookup = pd.read_csv(path_contracts_lookup)
-
-logging.info('Checking data')
-if not check_data_fame_conformance(contracts_lookup, CONTRACT_LOOKUP_COLUMN_NAMES):
-    raise SyntaxError(
-        'The column names of the contracts lookup csv file do no match the required column names: {}'.format(CONTRACT_LOOKUP_COLUMN_NAMES))
-
-address_set = set()
-transaction_hashes_set = set()
-
-for filename in glob.iglob('{}/**/*.csv'.format(path_to_raw_transaction_bulk), recursive=True):
-    raw_transactions = pd.read_csv(filename, index_col=0)
-    if not check_data_fame_conformance(raw_transactions, RAW_TRANSACTION_COLUMN_NAMES):
-        logging.info('{} - File {} not matching the raw transaction pattern. Skipping now'.format(datetime.datetime.now(), filename))
-        print('{} - File {} not matching the raw transaction pattern. Skipping now'.format(datetime.datetime.now(), filename))
-    else:
-        logging.info('{} - File {}  matching the raw transaction pattern. Applying shortening'.format(datetime.datetime.now(), filename))
-        print('{} - File {}  matching the raw transaction pattern. Applying shortening'.format(datetime.datetime.now(), filename))
-        from_addresses = raw_transactions['action.from'].unique()
-        from_addresses = set(address for address in from_addresses)
-        to_addresses = raw_transactions['action.to'].unique()
-        to_addresses = set(address for address in to_addresses)
-
-        logging.info('{} - Adding addresses from {} to set'.format(datetime.datetime.now(), filename))
-        print('{} - Adding addresses from {} to set'.format(datetime.datetime.now(), filename))
-        address_set = address_set.union(from_addresses).union(to_addresses)
-
-        logging.info('{} - Adding transactions from {} to set'.format(datetime.datetime.now(), filename))
-        print('{} - Adding transactions from {} to set'.format(datetime.datetime.now(), filename))
-        transactions = raw_transactions['transactionHash'].unique()
-        transactions = set(transaction for transaction in transactions)
-        transaction_hashes_set = transaction_hashes_set.union(transactions)
-
-addresses_df = pd.DataFrame(list(address_set))
-addresses_df.columns = ['address_hex']
-addresses_df = addresses_df.dropna()
-
-# Get the contract lookup and set is Contract flag
-contracts_lookup['isContract'] = True
-contracts_lookup['address_hex'] = contracts_lookup['result.address']
-contracts_lookup = contracts_lookup[['address_hex', 'isContract']]
-addresses_lookup = pd.merge(addresses_df, contracts_lookup, left_on='address_hex',
-                            right_on='address_hex', how='outer')
-addresses_lookup['id'] = addresses_lookup.index
-addresses_lookup.set_index('address_hex')
-
-transaction_hashes = pd.DataFrame(list(transaction_hashes_set))
-transaction_hashes['id'] = transaction_hashes.index
-transaction_hashes.columns = ['transaction_hash', 'id']
-transaction_hashes.set_index('transaction_hash')
-
-logging.info('{} - Saving now global lookup tables to {} and {}'.format(datetime.datetime.now(), address_lookup_filename, transaction_lookup_filename))
-print('{} - Saving now global lookup tables to {} and {}'.format(datetime.datetime.now(), address_lookup_filename, transaction_lookup_filename))
-addresses_lookup.to_csv(address_lookup_filename, index=False)
-transaction_hashes.to_csv(transaction_lookup_filename, index=False)
-logging.info('{} - Saved global lookup tables'.format(datetime.datetime.now()))
-print('{} - Saved global lookup tables'.format(datetime.datetime.now()))
-
-
 
 
+def main():
+    argument_parser = argparse.ArgumentParser(description='Builds the address and transaction lookup tables.')
+    argument_parser.add_argument('path_to_raw_transaction_bulk',
+                                 help='path to raw transaction bulk directory (e.g. /Users/mister-x/[...]/parity_data)')
+    argument_parser.add_argument('path_contracts_lookup',
+                                 help='path to the contracts lookup csv file '
+                                      '(e.g. /Users/mister-x/[...]/parity_data/contractsWithERCFlags.csv)')
+    argument_parser.add_argument('address_lookup_filename',
+                                 help='path and name to the addresses lookup output csv file '
+                                      '(e.g. /Users/mister-x/[...]/parity_data/address_lookup.csv)')
+    argument_parser.add_argument('transaction_lookup_filename',
+                                 help='path and name to the transactions lookup output csv file '
+                                      '(e.g. /Users/mister-x/[...]/parity_data/transaction_lookup.csv)')
+    argument_parser.add_argument('--workers', type=int, default=1,
+                                 help='amount of processes reading the raw transaction files in parallel')
+    argument_parser.add_argument('--memory-budget', type=int, default=None,
+                                 help='memory in MB all processes together may use for reading the raw transactions')
+    argument_parser.add_argument('--prefetch', type=int, default=1,
+                                 help='amount of raw transaction files read ahead on background threads while a file '
+                                      'is collected, 0 to read files when collected. Applies to a single worker only')
+    argument_parser.add_argument('--lookup-format', choices=['csv', 'binary', 'both'], default='csv',
+                                 help='write the lookups as csv files, as memory mappable binary indices next to the '
+                                      'csv file names (e.g. address_lookup.idx) or both')
+    argument_parser.add_argument('--incremental', action='store_true',
+                                 help='extend the existing lookups: only raw transaction files not scanned before are '
+                                      'read, unseen addresses and transactions are appended and keep their ids ever '
+                                      'after. Contracts of the contracts lookup are flagged')
+    argument_parser.add_argument('--hash-files', action='store_true',
+                                 help='identify changed files by their content hash in addition to size and mtime')
+    metrics.add_arguments(argument_parser, 'address_shortner.log')
+    args = argument_parser.parse_args()
+    metrics.configure_from_arguments(args)
+
+    pd.options.mode.chained_assignment = None
+
+    print("{}- Applying now shortening. Please wait...".format(datetime.datetime.now()))
+    logging.info("{}- Applying now shortening. Please wait...".format(datetime.datetime.now()))
+    contracts_lookup = pd.read_csv(args.path_contracts_lookup)
+
+    logging.info('Checking data')
+    if not check_data_fame_conformance(contracts_lookup, CONTRACT_LOOKUP_COLUMN_NAMES):
+        raise SyntaxError(
+            'The column names of the contracts lookup csv file do no match the required column names: {}'.format(CONTRACT_LOOKUP_COLUMN_NAMES))
+
+    filenames = find_raw_transaction_files(args.path_to_raw_transaction_bulk, recursive=True)
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+
+    # The manifest records the raw transaction files the lookups cover
+    manifest_path = get_lookup_manifest_path(args.address_lookup_filename)
+    manifest = manifest_store.load_manifest(manifest_path) if args.incremental else manifest_store.new_manifest()
+    identities = {}
+    for filename in filenames:
+        identity = manifest_store.get_file_identity(filename, args.hash_files)
+        if not manifest_store.is_unchanged(manifest['files'].get(os.path.abspath(filename)), identity):
+            identities[os.path.abspath(filename)] = identity
+    filenames = [filename for filename in filenames if os.path.abspath(filename) in identities]
+
+    logging.info('{} - Collecting addresses and transactions from {} files with {} workers'.format(
+        datetime.datetime.now(), len(filenames), args.workers))
+    print('{} - Collecting addresses and transactions from {} files with {} workers'.format(
+        datetime.datetime.now(), len(filenames), args.workers))
+    with metrics.stage('collect_unique_keys', len(filenames)) as record:
+        address_set, transaction_hashes_set = collect_all_unique_keys(filenames, args.workers, memory_budget,
+                                                                      args.prefetch)
+        record['rows_out'] = len(address_set) + len(transaction_hashes_set)
+
+    with metrics.stage('build_lookups', len(address_set) + len(transaction_hashes_set)) as record:
+        if args.incremental:
+            addresses_lookup, transaction_hashes = load_existing_lookups(args.address_lookup_filename,
+                                                                         args.transaction_lookup_filename)
+            existing_addresses, existing_transactions = len(addresses_lookup), len(transaction_hashes)
+            addresses_lookup, transaction_hashes, updated_contracts = extend_lookups(
+                addresses_lookup, transaction_hashes, address_set, transaction_hashes_set, contracts_lookup)
+            logging.info('{} - Appended {} addresses and {} transactions, flagged {} existing addresses as '
+                         'contracts'.format(datetime.datetime.now(), len(addresses_lookup) - existing_addresses,
+                                            len(transaction_hashes) - existing_transactions, updated_contracts))
+            print('{} - Appended {} addresses and {} transactions, flagged {} existing addresses as contracts'.format(
+                datetime.datetime.now(), len(addresses_lookup) - existing_addresses,
+                len(transaction_hashes) - existing_transactions, updated_contracts))
+        else:
+            addresses_lookup, transaction_hashes = build_lookups(address_set, transaction_hashes_set, contracts_lookup)
+        record['rows_out'] = len(addresses_lookup) + len(transaction_hashes)
+
+    logging.info('{} - Saving now global lookup tables to {} and {}'.format(datetime.datetime.now(), args.address_lookup_filename, args.transaction_lookup_filename))
+    print('{} - Saving now global lookup tables to {} and {}'.format(datetime.datetime.now(), args.address_lookup_filename, args.transaction_lookup_filename))
+    with metrics.stage('write_lookups', len(addresses_lookup) + len(transaction_hashes)):
+        if args.lookup_format in ('csv', 'both'):
+            # Appended rows only are written to existing csv files, unless existing addresses became contracts
+            if args.incremental and os.path.exists(args.address_lookup_filename) and updated_contracts == 0:
+                addresses_lookup.iloc[existing_addresses:].to_csv(args.address_lookup_filename, mode='a',
+                                                                  header=False, index=False)
+            else:
+                addresses_lookup.to_csv(args.address_lookup_filename, index=False)
+            if args.incremental and os.path.exists(args.transaction_lookup_filename):
+                transaction_hashes.iloc[existing_transactions:].to_csv(args.transaction_lookup_filename, mode='a',
+                                                                       header=False, index=False)
+            else:
+                transaction_hashes.to_csv(args.transaction_lookup_filename, index=False)
+        if args.lookup_format in ('binary', 'both'):
+            build_address_index(addresses_lookup).save(get_index_path(args.address_lookup_filename))
+            build_transaction_index(transaction_hashes).save(get_index_path(args.transaction_lookup_filename))
+    for filename, identity in identities.items():
+        manifest_store.record_file(manifest, filename, identity, True)
+    manifest_store.save_manifest(manifest, manifest_path)
+    logging.info('{} - Saved global lookup tables'.format(datetime.datetime.now()))
+    print('{} - Saved global lookup tables'.format(datetime.datetime.now()))
+
+
+if __name__ == '__main__':
+    main()
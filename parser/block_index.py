@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from config.constants import BLOCK_TIMES_COLUMN_NAMES
+
+MISSING_TIMESTAMP = -1
+SECONDS_PER_DAY = 86400
+
+
+class BlockIndex(object):
+    """
+    A persistent table of the block timestamps. Block numbers are dense, hence the timestamps are held as flat array
+    indexed by block number - first block. Blocks without a known time are marked with MISSING_TIMESTAMP. An index is
+    stored as a directory of .npy files and memory mapped on load. Days are derived from the timestamps with
+    'get_day_ordinals'.
+    """
+
+    def __init__(self, first_block, timestamps: np.ndarray, path=None):
+        self.first_block = int(first_block)
+        self.timestamps = timestamps
+        self.path = path
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __reduce__(self):
+        # Indices loaded from disk are sent to other processes by path and memory mapped there again
+        if self.path is not None:
+            return BlockIndex.load, (self.path,)
+        return BlockIndex, (self.first_block, self.timestamps)
+
+    def find(self, block_numbers) -> np.ndarray:
+        """
+        Searches the positions of block numbers in the index.
+        :param block_numbers: the block numbers to search. Missing values are never found.
+        :return: an int64 array with the position of every block, -1 if its time is not known.
+        """
+        block_numbers = np.asarray(block_numbers)
+        valid = (block_numbers >= self.first_block) & (block_numbers < self.first_block + len(self.timestamps))
+        positions = np.full(len(block_numbers), -1, dtype=np.int64)
+        positions[valid] = block_numbers[valid].astype(np.int64) - self.first_block
+        positions[valid] = np.where(self.timestamps[positions[valid]] != MISSING_TIMESTAMP, positions[valid], -1)
+        return positions
+
+    def get_timestamps(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: positions as returned by 'find'
+        :return: an int64 array with the timestamp at every position, MISSING_TIMESTAMP for positions not found.
+        """
+        return np.where(positions >= 0, self.timestamps[np.maximum(positions, 0)], MISSING_TIMESTAMP).astype(np.int64)
+
+    def save(self, path):
+        """
+        Saves the index as a directory of .npy files.
+        :param path: the directory to save to
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'timestamps.npy'), self.timestamps)
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump({'first_block': self.first_block}, meta_file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads an index saved with 'save'.
+        :param path: the directory of the index
+        :param mmap_mode: the numpy memory mapping mode, None to read the arrays into memory
+        :return: the BlockIndex
+        """
+        # Absolute, as the index is pickled by its path and workers may run in another directory
+        path = os.path.abspath(path)
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        return cls(meta['first_block'],
+                   np.load(os.path.join(path, 'timestamps.npy'), mmap_mode=mmap_mode),
+                   path if mmap_mode is not None else None)
+
+
+def build_block_index(block_times: pd.DataFrame) -> BlockIndex:
+    """
+    Builds the index of a block times lookup table. Of duplicated block numbers the first one is kept.
+    :param block_times: a lookup table with the columns 'number', 'timestamp'
+    :return: the BlockIndex
+    """
+    block_times = block_times[['number', 'timestamp']].dropna().drop_duplicates('number')
+    numbers = block_times['number'].values.astype(np.int64)
+    if len(numbers) == 0:
+        return BlockIndex(0, np.zeros(0, dtype=np.int64))
+    first_block = numbers.min()
+    timestamps = np.full(numbers.max() - first_block + 1, MISSING_TIMESTAMP, dtype=np.int64)
+    timestamps[numbers - first_block] = block_times['timestamp'].values.astype(np.int64)
+    return BlockIndex(first_block, timestamps)
+
+
+def get_day_ordinals(timestamps) -> np.ndarray:
+    """
+    :param timestamps: unix timestamps in seconds
+    :return: an int64 array with the days since the epoch
+    """
+    return np.asarray(timestamps).astype(np.int64) // SECONDS_PER_DAY
+
+
+def day_ordinal_to_timestamp(day_ordinal) -> pd.Timestamp:
+    """
+    :param day_ordinal: days since the epoch
+    :return: the midnight of the day, equal to normalizing any of its timestamps
+    """
+    return pd.Timestamp(int(day_ordinal) * SECONDS_PER_DAY, unit='s')
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Builds the memory mappable block index of a block times '
+                                                          'csv file.')
+    argument_parser.add_argument('path_block_times', help='block times csv file')
+    argument_parser.add_argument('path_block_index', help='directory to write the block index to')
+    args = argument_parser.parse_args()
+
+    block_times = pd.read_csv(args.path_block_times)
+    if not BLOCK_TIMES_COLUMN_NAMES.issubset(block_times.columns):
+        raise SyntaxError('The column names of the block times lookup csv file do no match the required colum names: {}'.format(BLOCK_TIMES_COLUMN_NAMES))
+    build_block_index(block_times).save(args.path_block_index)
+
+
+if __name__ == '__main__':
+    main()
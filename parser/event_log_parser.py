@@ -1,94 +1,230 @@
 import pandas as pd
 import numpy as np
 
+from instrumentation import metrics
+from parser.hash_index import HashIndex
+from parser.actor_attributes import ACTOR_TYPES, TRANSACTION_TYPES, build_actor_attributes, get_actor_type_codes, \
+    get_transaction_type_codes, to_categorical
+from parser.block_index import BlockIndex, get_day_ordinals, day_ordinal_to_timestamp
+
 
 def parse_event_log(raw_transactions: pd.DataFrame, transaction_lookup: pd.DataFrame, addresses_lookup: pd.DataFrame, block_times: pd.DataFrame,
-                    block_padding=1000000000)->(pd.DataFrame, pd.DataFrame):
+                    block_padding=1000000000, actor_attributes=None)->(pd.DataFrame, pd.Series):
     """
     Parses an event log from a raw transactions dataFrame.
     :param raw_transactions: the raw transactions to parse from. Should include at least the following columns:
     'id', 'action.from', 'action.input', 'action.to', 'blockNumber', 'transactionHash', 'type'
     :param transaction_lookup: a lookup table with all transaction hashes mapped to integers. Columns:
-    'transaction_hash', 'id'.
+    'transaction_hash', 'id'. Or a HashIndex of it.
     :param addresses_lookup: a lookup table with all addresses and information if the address is a
-    contract. Columns: 'address_hex', 'isContract', 'isERC20', 'id'
-    :param block_times: a lookup table to map the block numbers to their times for time series analysis.
+    contract. Columns: 'address_hex', 'isContract', 'isERC20', 'id'. Or a HashIndex of it.
+    :param block_times: a lookup table to map the block numbers to their times for time series analysis. Columns:
+    'number', 'timestamp'. Or a BlockIndex of it.
     :param block_padding: a kwarg to show the padding of the block. The single transaction segments in the outcome
     transaction log will have an unique id, ascending in time. The outcome is call 'total_pos' and is computed as
     current_block_number * block_padding + line number. Hence the block_padding kwarg should be selected as
     min(10^x: 10^x >len(raw_transactions)). Per default 100M.
-    :return: events, trace complexities (by days)
+    :param actor_attributes: the ActorAttributes of the addresses lookup, built from it if None.
+    :return: events, trace complexities (by days) as returned by 'compute_trace_lengths'
+    """
+    events = join_event_log(raw_transactions, transaction_lookup, addresses_lookup, block_times, block_padding)
+    return build_event_log(events, addresses_lookup, actor_attributes)
+
+
+def parse_event_log_chunks(raw_transaction_chunks, transaction_lookup, addresses_lookup, block_times,
+                           block_padding=1000000000, actor_attributes=None) -> (pd.DataFrame, pd.Series):
+    """
+    Parses an event log from chunks of a raw transactions file, as read by 'raw_reader.read_raw_transactions'. The
+    joins are row local, hence the chunks are joined one by one and only the compact joined rows are held in memory.
+    The result equals 'parse_event_log' of the whole file.
+    :param raw_transaction_chunks: the chunks of the raw transactions. Their index must be the line number in the file.
+    :param transaction_lookup: see 'parse_event_log'
+    :param addresses_lookup: see 'parse_event_log'
+    :param block_times: see 'parse_event_log'
+    :param block_padding: see 'parse_event_log'
+    :param actor_attributes: see 'parse_event_log'
+    :return: events, trace complexities (by days) as returned by 'compute_trace_lengths'
     """
-    addresses_lookup.set_index('address_hex')
-    transaction_lookup.set_index('transaction_hash')
+    events = pd.concat([join_event_log(raw_transactions, transaction_lookup, addresses_lookup, block_times,
+                                       block_padding) for raw_transactions in raw_transaction_chunks],
+                       ignore_index=True)
+    return build_event_log(events, addresses_lookup, actor_attributes)
+
 
+def join_event_log(raw_transactions: pd.DataFrame, transaction_lookup, addresses_lookup, block_times,
+                   block_padding=1000000000) -> pd.DataFrame:
+    """
+    Joins the address ids, the block times and the transaction ids to raw transactions.
+    :param raw_transactions: see 'parse_event_log'
+    :param transaction_lookup: see 'parse_event_log'
+    :param addresses_lookup: see 'parse_event_log'
+    :param block_times: see 'parse_event_log'
+    :param block_padding: see 'parse_event_log'
+    :return: the joined events with the columns 'total_pos', 'action.input', 'sender_id', 'receiver_id', 'timestamp',
+    'transaction_id', 'type' and a new range index.
+    """
     # Events
     raw_transactions['id'] = raw_transactions['blockNumber'] * block_padding + raw_transactions.index
     raw_transactions = raw_transactions[['id', 'action.from', 'action.input', 'action.to', 'blockNumber', 'transactionHash', 'type']]
-    raw_transactions.set_index('id')
-
-    events = raw_transactions.merge(addresses_lookup, left_on='action.from', right_on='address_hex', how='left') \
-        .merge(addresses_lookup, left_on='action.to', right_on='address_hex', how='left') \
-        .merge(block_times, left_on='blockNumber', right_on='number', how='inner') \
-        .merge(transaction_lookup, left_on='transactionHash', right_on='transaction_hash', how='inner')
-
-    events.columns = ['total_pos', 'action.from', 'action.input', 'action.to', 'blockNumber', 'transactionHash',
-                      'type', 'sender_address', 'senderIsContract', 'senderIsERC20', 'sender_id',
-                      'receiver_address', 'receiverIsContract', 'receiverIsERC20', 'receiver_id', 'number',
-                      'timestamp', 'transaction_hash_z', 'transaction_id']
-    events = events.drop('action.from', axis=1)
-    events = events.drop('action.to', axis=1)
-    events = events.drop('sender_address', axis=1)
-    events = events.drop('receiver_address', axis=1)
-    events = events.drop('number', axis=1)
-    events = events.drop('transaction_hash_z', axis=1)
-    events = events.drop('transactionHash', axis=1)
-    events = events.drop('blockNumber', axis=1)
-
-    events['senderIsContract'] = events['senderIsContract'].fillna(False)
-    events['senderIsERC20'] = events['senderIsERC20'].fillna(False)
-    events['receiverIsContract'] = events['receiverIsContract'].fillna(False)
-    events['receiverIsERC20'] = events['receiverIsERC20'].fillna(False)
-
-    events['sender_id'] = events['sender_id'].fillna(-1)
-    events['sender_id'] = events['sender_id'].astype(np.int64)
-    events['receiver_id'] = events['receiver_id'].fillna(-1)
-    events['receiver_id'] = events['receiver_id'].astype(np.int64)
-
-    # get rid of contract creation transactions
-    events = events[events['type'] == 'call']
-    events = events.drop('type', axis=1)
-    events['sender_type'] = events['senderIsContract'].apply(lambda x: check_user_type(x))
-    events['receiver_type'] = events['receiverIsContract'].apply(lambda x: check_user_type(x))
-    events['transaction_type'] = events['sender_type'].map(str) + 't' + events['receiver_type'].map(str)
-
-    events['transaction_type'] = events['transaction_type'].astype('category')
-    events['receiver_type'] = events['receiver_type'].astype('category')
-    events['sender_type'] = events['receiver_type'].astype('category')
-
-    # traces by day
-    traces_by_day = pd.DataFrame()
-    events['day'] = pd.to_datetime(events['timestamp'], unit='s').dt.normalize()
-    groups = events.groupby('day')
-    for day, group in groups:
-        trace_lengths = group.groupby('transaction_id').count().groupby('total_pos').count()['action.input']
-        trace_lengths['day'] = day
-        traces_by_day = traces_by_day.append(trace_lengths, ignore_index=True)
-    traces_by_day = traces_by_day.set_index('day')
-    traces_by_day = traces_by_day.fillna(0)
-    traces_by_day = traces_by_day.astype(np.int64)
-    events = events.drop('day', axis=1)
-
-    return events, traces_by_day
-
-
-def check_user_type(is_contract: bool) -> str:
-    """
-    Checks the type of a actor in the network
-    :param is_contract: boolean
-    :return: string C or U for contract or user.
-    """
-    if is_contract == True:
-        return 'C'
-    else:
-        return 'U'
+
+    with metrics.stage('join_addresses', len(raw_transactions)) as record:
+        events = join_addresses(raw_transactions, addresses_lookup, 'action.from', 'sender')
+        events = join_addresses(events, addresses_lookup, 'action.to', 'receiver')
+        record['rows_out'] = len(events)
+    with metrics.stage('join_block_times', len(events)) as record:
+        events = join_block_times(events, block_times)
+        record['rows_out'] = len(events)
+    with metrics.stage('join_transactions', len(events)) as record:
+        events = join_transactions(events, transaction_lookup)
+        record['rows_out'] = len(events)
+
+    events = events.rename(columns={'id': 'total_pos'})
+    return events[['total_pos', 'action.input', 'sender_id', 'receiver_id', 'timestamp', 'transaction_id', 'type']]
+
+
+def build_event_log(events: pd.DataFrame, addresses_lookup, actor_attributes=None) -> (pd.DataFrame, pd.Series):
+    """
+    Types the actors and transactions of joined events and computes their trace lengths.
+    :param events: the events as returned by 'join_event_log'
+    :param addresses_lookup: see 'parse_event_log'
+    :param actor_attributes: see 'parse_event_log'
+    :return: events, trace complexities (by days) as returned by 'compute_trace_lengths'
+    """
+    with metrics.stage('typing', len(events)) as record:
+        events['sender_id'] = events['sender_id'].fillna(-1)
+        events['sender_id'] = events['sender_id'].astype(np.int64)
+        events['receiver_id'] = events['receiver_id'].fillna(-1)
+        events['receiver_id'] = events['receiver_id'].astype(np.int64)
+
+        # get rid of contract creation transactions
+        events = events[events['type'] == 'call']
+        events = events.drop('type', axis=1)
+
+        if actor_attributes is None:
+            actor_attributes = build_actor_attributes(addresses_lookup)
+        sender_ids = events['sender_id'].values
+        receiver_ids = events['receiver_id'].values
+        events['senderIsContract'] = actor_attributes.get_flag(sender_ids, 'isContract')
+        events['senderIsERC20'] = actor_attributes.get_flag(sender_ids, 'isERC20')
+        events['receiverIsContract'] = actor_attributes.get_flag(receiver_ids, 'isContract')
+        events['receiverIsERC20'] = actor_attributes.get_flag(receiver_ids, 'isERC20')
+
+        sender_codes = get_actor_type_codes(events['senderIsContract'].values)
+        receiver_codes = get_actor_type_codes(events['receiverIsContract'].values)
+        events['sender_type'] = to_categorical(sender_codes, ACTOR_TYPES)
+        events['receiver_type'] = to_categorical(receiver_codes, ACTOR_TYPES)
+        events['transaction_type'] = to_categorical(get_transaction_type_codes(sender_codes, receiver_codes),
+                                                    TRANSACTION_TYPES)
+        events = events[['total_pos', 'action.input', 'senderIsContract', 'senderIsERC20', 'sender_id',
+                         'receiverIsContract', 'receiverIsERC20', 'receiver_id', 'timestamp', 'transaction_id',
+                         'sender_type', 'receiver_type', 'transaction_type']]
+        record['rows_out'] = len(events)
+
+    with metrics.stage('trace_lengths', len(events)) as record:
+        trace_lengths = compute_trace_lengths(events)
+        record['rows_out'] = len(trace_lengths)
+
+    return events, trace_lengths
+
+
+def compute_trace_lengths(events: pd.DataFrame) -> pd.Series:
+    """
+    Computes the histogram of the trace lengths by day, i.e. how many transactions of a day consist of how many events.
+    :param events: the events with the columns 'timestamp' and 'transaction_id'
+    :return: a sparse pd.Series of the transaction amounts, indexed by 'day' and 'trace_length'. Only observed trace
+    lengths are included.
+    """
+    days = get_day_ordinals(events['timestamp'].values)
+    transaction_ids = events['transaction_id'].values.astype(np.int64)
+    # events per transaction and day, followed by transactions per trace length and day
+    traces, lengths = np.unique(np.stack([days, transaction_ids], axis=1), axis=0, return_counts=True)
+    histogram, amounts = np.unique(np.stack([traces[:, 0], lengths], axis=1), axis=0, return_counts=True)
+
+    index = pd.MultiIndex.from_arrays([[day_ordinal_to_timestamp(day) for day in histogram[:, 0]], histogram[:, 1]],
+                                      names=['day', 'trace_length'])
+    return pd.Series(amounts.astype(np.int64), index=index, name='transactions')
+
+
+def trace_lengths_to_frame(trace_lengths: pd.Series, columns=None) -> pd.DataFrame:
+    """
+    Converts a trace length histogram to the wide layout with one row per day and one column per trace length.
+    :param trace_lengths: the histogram as returned by 'compute_trace_lengths'
+    :param columns: the trace length columns to include, None for the observed ones. Observed trace lengths missing in
+    columns are appended in ascending order.
+    :return: a pd.DataFrame of the transaction amounts indexed by 'day', 0 for unobserved trace lengths.
+    """
+    frame = trace_lengths.unstack('trace_length', fill_value=0)
+    observed = sorted(frame.columns)
+    if columns is not None:
+        observed = list(columns) + sorted(set(observed) - set(columns))
+    frame = frame.reindex(columns=observed, fill_value=0).astype(np.int64)
+    frame.columns = pd.Index(frame.columns)
+    frame.columns.name = None
+    frame.index.name = 'day'
+    return frame
+
+
+def trace_lengths_to_series(frame: pd.DataFrame) -> pd.Series:
+    """
+    Converts trace lengths in the wide layout back to the sparse histogram returned by 'compute_trace_lengths'.
+    :param frame: the wide trace lengths indexed by day
+    :return: the sparse pd.Series indexed by 'day' and 'trace_length'
+    """
+    frame = frame.copy()
+    frame.index.name = 'day'
+    frame.columns = pd.Index([int(column) for column in frame.columns], name='trace_length')
+    trace_lengths = frame.stack().astype(np.int64)
+    trace_lengths.name = 'transactions'
+    return trace_lengths[trace_lengths != 0]
+
+
+def join_addresses(events: pd.DataFrame, addresses_lookup, address_column, prefix) -> pd.DataFrame:
+    """
+    Left joins the address ids to the events.
+    :param events: the events
+    :param addresses_lookup: the addresses lookup table or a HashIndex of it
+    :param address_column: the column of the events holding the addresses, e.g. 'action.from'
+    :param prefix: the prefix of the joined column, e.g. 'sender' for 'sender_id'
+    :return: the events with the joined id column. Ids of unknown addresses are NaN or -1.
+    """
+    if isinstance(addresses_lookup, HashIndex):
+        events = events.copy()
+        events['{}_id'.format(prefix)] = addresses_lookup.get_ids(addresses_lookup.find(events[address_column]))
+        return events
+
+    addresses_lookup = addresses_lookup[['address_hex', 'id']].rename(columns={'address_hex': '{}_address'.format(prefix),
+                                                                              'id': '{}_id'.format(prefix)})
+    return events.merge(addresses_lookup, left_on=address_column, right_on='{}_address'.format(prefix), how='left')
+
+
+def join_block_times(events: pd.DataFrame, block_times) -> pd.DataFrame:
+    """
+    Inner joins the block timestamps to the events.
+    :param events: the events with the column 'blockNumber'
+    :param block_times: the block times lookup table or a BlockIndex of it
+    :return: the events of blocks with known times with the column 'timestamp' and a new range index.
+    """
+    if isinstance(block_times, BlockIndex):
+        positions = block_times.find(events['blockNumber'].values)
+        events = events[positions >= 0].reset_index(drop=True)
+        events['timestamp'] = block_times.get_timestamps(positions[positions >= 0])
+        return events
+
+    return events.merge(block_times[['number', 'timestamp']], left_on='blockNumber', right_on='number', how='inner')
+
+
+def join_transactions(events: pd.DataFrame, transaction_lookup) -> pd.DataFrame:
+    """
+    Inner joins the transaction ids to the events.
+    :param events: the events
+    :param transaction_lookup: the transaction lookup table or a HashIndex of it
+    :return: the events of known transactions with the column 'transaction_id' and a new range index.
+    """
+    if isinstance(transaction_lookup, HashIndex):
+        positions = transaction_lookup.find(events['transactionHash'])
+        events = events[positions >= 0].reset_index(drop=True)
+        events['transaction_id'] = transaction_lookup.get_ids(positions[positions >= 0])
+        return events
+
+    transaction_lookup = transaction_lookup[['transaction_hash', 'id']].rename(columns={'id': 'transaction_id'})
+    return events.merge(transaction_lookup, left_on='transactionHash', right_on='transaction_hash', how='inner')
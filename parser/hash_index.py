@@ -0,0 +1,203 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+ADDRESS_KEY_WIDTH = 20
+TRANSACTION_KEY_WIDTH = 32
+ADDRESS_FLAG_NAMES = ('isContract', 'isERC20')
+INDEX_EXTENSION = 'idx'
+
+
+class HashIndex(object):
+    """
+    A persistent dictionary from hex encoded hashes (addresses, transaction hashes) to integer ids. The hashes are held
+    as sorted fixed width binary keys with aligned id and flag arrays. Every flag is one bit of the flag array. An index
+    is stored as a directory of .npy files and memory mapped on load, hence it is shared across processes by the page
+    cache. Lookups are vectorized binary searches.
+    """
+
+    def __init__(self, keys: np.ndarray, ids: np.ndarray, flags: np.ndarray, flag_names=(), path=None):
+        self.keys = keys
+        self.ids = ids
+        self.flags = flags
+        self.flag_names = tuple(flag_names)
+        self.width = keys.dtype.itemsize
+        self.path = path
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __reduce__(self):
+        # Indices loaded from disk are sent to other processes by path and memory mapped there again
+        if self.path is not None:
+            return HashIndex.load, (self.path,)
+        return HashIndex, (self.keys, self.ids, self.flags, self.flag_names)
+
+    def find(self, hex_strings) -> np.ndarray:
+        """
+        Searches the positions of hex encoded hashes in the index.
+        :param hex_strings: the '0x' prefixed hashes to search. Missing or malformed values are never found.
+        :return: an int64 array with the position of every hash, -1 if it is not in the index.
+        """
+        binary, valid = hex_to_binary(hex_strings, self.width)
+        if len(self.keys) == 0:
+            return np.full(len(binary), -1, dtype=np.int64)
+        positions = np.searchsorted(self.keys, binary).astype(np.int64)
+        positions[positions == len(self.keys)] = 0
+        found = valid & (self.keys[positions] == binary)
+        positions[~found] = -1
+        return positions
+
+    def get_ids(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: positions as returned by 'find'
+        :return: an int64 array with the id at every position, -1 for positions not found.
+        """
+        return np.where(positions >= 0, self.ids[np.maximum(positions, 0)], -1).astype(np.int64)
+
+    def get_flag(self, positions: np.ndarray, flag_name) -> np.ndarray:
+        """
+        :param positions: positions as returned by 'find'
+        :param flag_name: the name of the flag, e.g. 'isContract'
+        :return: a boolean array with the flag at every position, False for positions not found or unknown flags.
+        """
+        if flag_name not in self.flag_names:
+            return np.zeros(len(positions), dtype=bool)
+        bit = self.flag_names.index(flag_name)
+        flags = (self.flags[np.maximum(positions, 0)] >> bit) & 1
+        return (positions >= 0) & flags.astype(bool)
+
+    def save(self, path):
+        """
+        Saves the index as a directory of .npy files.
+        :param path: the directory to save to
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'keys.npy'), self.keys)
+        np.save(os.path.join(path, 'ids.npy'), self.ids)
+        np.save(os.path.join(path, 'flags.npy'), self.flags)
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump({'width': self.width, 'flag_names': list(self.flag_names)}, meta_file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads an index saved with 'save'.
+        :param path: the directory of the index
+        :param mmap_mode: the numpy memory mapping mode, None to read the arrays into memory
+        :return: the HashIndex
+        """
+        # Indices are pickled by their path, which must not depend on the working directory of the process
+        path = os.path.abspath(path)
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        return cls(np.load(os.path.join(path, 'keys.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, 'flags.npy'), mmap_mode=mmap_mode),
+                   meta['flag_names'], path if mmap_mode is not None else None)
+
+
+def hex_to_binary(hex_strings, width) -> (np.ndarray, np.ndarray):
+    """
+    Converts '0x' prefixed hex strings to fixed width binary keys.
+    :param hex_strings: the hex strings. Missing values and values not encoding width bytes, e.g. of a wrong length or
+    with non hex characters, are marked invalid.
+    :param width: the amount of bytes of a key, e.g. 20 for addresses or 32 for transaction hashes
+    :return: a numpy array of dtype 'S<width>' (empty keys where invalid), a boolean array marking the valid values.
+    """
+    hex_strings = pd.Series(np.asarray(hex_strings, dtype=object))
+    valid = hex_strings.str.match(r'0x[0-9a-fA-F]{{{}}}\Z'.format(2 * width))
+    valid = valid.fillna(False).values.astype(bool)
+    binary = np.zeros(len(hex_strings), dtype='S{}'.format(width))
+    if valid.any():
+        binary[valid] = np.frombuffer(bytes.fromhex(''.join(hex_strings[valid].str.slice(2))),
+                                      dtype='S{}'.format(width))
+    return binary, valid
+
+
+def binary_to_hex(binary: np.ndarray) -> np.ndarray:
+    """
+    Converts fixed width binary keys back to hex strings, the inverse of 'hex_to_binary'.
+    :param binary: a numpy array of dtype 'S<width>'
+    :return: an object array of '0x' prefixed hex strings
+    """
+    width = binary.dtype.itemsize
+    if len(binary) == 0:
+        return np.array([], dtype=object)
+    hex_strings = np.frombuffer(np.ascontiguousarray(binary).tobytes().hex().encode('ascii'),
+                                dtype='S{}'.format(2 * width))
+    return np.char.add(b'0x', hex_strings).astype(str).astype(object)
+
+
+def build_hash_index(hex_strings, ids, width, flags=None, flag_names=()) -> HashIndex:
+    """
+    Builds an index from hex encoded hashes. Malformed hashes are left out, of duplicated hashes the first one is kept.
+    :param hex_strings: the '0x' prefixed hashes
+    :param ids: the id of every hash
+    :param width: the amount of bytes of a key
+    :param flags: a uint8 array with the flag bits of every hash, None for no flags
+    :param flag_names: the names of the flag bits, lowest bit first
+    :return: the HashIndex
+    """
+    binary, valid = hex_to_binary(hex_strings, width)
+    ids = np.asarray(ids, dtype=np.int64)[valid]
+    flags = np.zeros(len(ids), dtype=np.uint8) if flags is None else np.asarray(flags, dtype=np.uint8)[valid]
+    binary = binary[valid]
+
+    order = np.argsort(binary, kind='mergesort')
+    binary = binary[order]
+    unique = np.ones(len(binary), dtype=bool)
+    unique[1:] = binary[1:] != binary[:-1]
+    order = order[unique]
+    return HashIndex(binary[unique], ids[order], flags[order], flag_names)
+
+
+def build_address_index(addresses_lookup: pd.DataFrame) -> HashIndex:
+    """
+    Builds the index of an addresses lookup table.
+    :param addresses_lookup: a lookup table with the columns 'address_hex', 'id' and any of ADDRESS_FLAG_NAMES
+    :return: the HashIndex
+    """
+    flag_names = [flag_name for flag_name in ADDRESS_FLAG_NAMES if flag_name in addresses_lookup.columns]
+    flags = np.zeros(len(addresses_lookup), dtype=np.uint8)
+    for bit, flag_name in enumerate(flag_names):
+        flags |= addresses_lookup[flag_name].fillna(False).values.astype(bool).astype(np.uint8) << np.uint8(bit)
+    return build_hash_index(addresses_lookup['address_hex'], addresses_lookup['id'], ADDRESS_KEY_WIDTH, flags,
+                            flag_names)
+
+
+def build_transaction_index(transaction_lookup: pd.DataFrame) -> HashIndex:
+    """
+    Builds the index of a transaction lookup table.
+    :param transaction_lookup: a lookup table with the columns 'transaction_hash', 'id'
+    :return: the HashIndex
+    """
+    return build_hash_index(transaction_lookup['transaction_hash'], transaction_lookup['id'], TRANSACTION_KEY_WIDTH)
+
+
+def hash_index_to_lookup(index: HashIndex, key_column) -> pd.DataFrame:
+    """
+    Converts an index back to a lookup table, e.g. to extend a lookup only kept as index.
+    :param index: the HashIndex
+    :param key_column: the name of the key column, 'address_hex' or 'transaction_hash'
+    :return: a lookup table ordered by id with the key column, a column per flag (True or missing, as written by
+    'build_lookups') and 'id'
+    """
+    order = np.argsort(np.asarray(index.ids), kind='mergesort')
+    lookup = pd.DataFrame({key_column: binary_to_hex(np.asarray(index.keys)[order])}, columns=[key_column])
+    flags = np.asarray(index.flags)[order]
+    for bit, flag_name in enumerate(index.flag_names):
+        lookup[flag_name] = np.where((flags >> bit) & 1, True, None)
+    lookup['id'] = np.asarray(index.ids, dtype=np.int64)[order]
+    return lookup
+
+
+def get_index_path(lookup_path) -> str:
+    """
+    :param lookup_path: the path of a lookup csv file, e.g. '/[...]/address_lookup.csv'
+    :return: the path of the index next to it, e.g. '/[...]/address_lookup.idx'
+    """
+    return '{}.{}'.format(os.path.splitext(lookup_path)[0], INDEX_EXTENSION)
@@ -0,0 +1,219 @@
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config.constants import RAW_TRANSACTION_COLUMN_NAMES
+from parser.hash_index import HashIndex, get_index_path, hash_index_to_lookup
+from parser.raw_reader import get_held_chunks, prefetch_files
+
+KEY_COLUMN_NAMES = ['action.from', 'action.to', 'transactionHash']
+# Rough in memory size of one parsed row of the key columns (two 42 and one 66 character strings plus overhead)
+BYTES_PER_KEY_ROW = 600
+DEFAULT_CHUNKSIZE = 1000000
+LOOKUP_MANIFEST_SUFFIX = '_manifest.json'
+
+
+def check_data_fame_conformance(df, pattern):
+    if pattern.issubset(df.columns):
+        return True
+    else:
+        return False
+
+
+def get_chunksize(memory_budget=None, workers=1, prefetch=0) -> int:
+    """
+    Evaluates how many rows of the key columns a single worker may read at once.
+    :param memory_budget: the memory in bytes all workers together may use for reading, None for the default chunksize
+    :param workers: the amount of parallel workers
+    :param prefetch: the amount of files every worker reads ahead, see 'get_held_chunks'
+    :return: the amount of rows per chunk
+    """
+    if memory_budget is None:
+        return DEFAULT_CHUNKSIZE
+    return max(1, int(memory_budget // (max(1, workers) * get_held_chunks(prefetch) * BYTES_PER_KEY_ROW)))
+
+
+def matches_key_pattern(filename) -> bool:
+    """
+    :param filename: the path to a csv file
+    :return: True if the header of the file holds the raw transaction columns
+    """
+    header = pd.read_csv(filename, index_col=0, nrows=0)
+    return check_data_fame_conformance(header, RAW_TRANSACTION_COLUMN_NAMES)
+
+
+def read_key_chunks(filename, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    :param filename: the path to the raw transaction csv file, compressed files are decompressed while reading
+    :param chunksize: the amount of rows to read at once
+    :return: an iterator of the chunks of the key columns, empty if the file does not match the raw transaction pattern
+    """
+    if not matches_key_pattern(filename):
+        return
+    yield from pd.read_csv(filename, usecols=KEY_COLUMN_NAMES, chunksize=chunksize)
+
+
+def collect_unique_keys(filename, chunksize=DEFAULT_CHUNKSIZE, chunks=None) -> (set, set):
+    """
+    Collects the addresses and transaction hashes of a raw transaction file. Only the key columns are read, in chunks of
+    at most chunksize rows.
+    :param filename: the path to the raw transaction csv file
+    :param chunksize: the amount of rows to read at once
+    :param chunks: the chunks of the key columns if read already, see 'read_key_chunks'. None to read them.
+    :return: the set of addresses, the set of transaction hashes. None if the file does not match the raw transaction
+    pattern.
+    """
+    if not matches_key_pattern(filename):
+        logging.info('File {} not matching the raw transaction pattern. Skipping now'.format(filename))
+        return None
+
+    address_set = set()
+    transaction_hashes_set = set()
+    for chunk in (chunks if chunks is not None else read_key_chunks(filename, chunksize)):
+        address_set.update(chunk['action.from'].dropna().unique())
+        address_set.update(chunk['action.to'].dropna().unique())
+        transaction_hashes_set.update(chunk['transactionHash'].dropna().unique())
+    logging.info('Collected {} addresses and {} transactions from {}'.format(len(address_set),
+                                                                            len(transaction_hashes_set), filename))
+    return address_set, transaction_hashes_set
+
+
+def collect_all_unique_keys(filenames, workers=1, memory_budget=None, prefetch=0) -> (set, set):
+    """
+    Collects the addresses and transaction hashes of many raw transaction files. The files are spread over a process
+    pool, every worker returns the partial sets of one file, which are merged in place.
+    :param filenames: the paths to the raw transaction csv files
+    :param workers: the amount of worker processes. 1 collects in the current process.
+    :param memory_budget: the memory in bytes all workers together may use for reading, None for the default chunksize
+    :param prefetch: the amount of files read ahead on background threads when collecting in the current process
+    :return: the set of all addresses, the set of all transaction hashes
+    """
+    prefetch = prefetch if workers <= 1 else 0
+    chunksize = get_chunksize(memory_budget, workers, prefetch)
+    address_set = set()
+    transaction_hashes_set = set()
+
+    key_files = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        partials = executor.map(collect_unique_keys, filenames, [chunksize] * len(filenames))
+    else:
+        executor = None
+        key_files = prefetch_files(filenames, functools.partial(read_key_chunks, chunksize=chunksize), prefetch)
+        partials = (collect_unique_keys(filename, chunksize, chunks) for filename, chunks in key_files)
+
+    try:
+        for partial in partials:
+            if partial is not None:
+                address_set.update(partial[0])
+                transaction_hashes_set.update(partial[1])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if key_files is not None:
+            key_files.close()
+    return address_set, transaction_hashes_set
+
+
+def build_lookups(address_set: set, transaction_hashes_set: set, contracts_lookup: pd.DataFrame) -> (pd.DataFrame,
+                                                                                                     pd.DataFrame):
+    """
+    Builds the address and the transaction lookup tables. Ids are assigned in sorted key order.
+    :param address_set: all addresses found in the raw transactions
+    :param transaction_hashes_set: all transaction hashes found in the raw transactions
+    :param contracts_lookup: the contracts lookup with at least the column 'result.address'
+    :return: the address lookup with the columns 'address_hex', 'isContract', 'id' and the transaction lookup with the
+    columns 'transaction_hash', 'id'.
+    """
+    addresses_df = pd.DataFrame({'address_hex': sorted(address_set)}, columns=['address_hex'])
+
+    # Get the contract lookup and set is Contract flag
+    contracts_lookup = contracts_lookup[['result.address']].copy()
+    contracts_lookup['isContract'] = True
+    contracts_lookup.columns = ['address_hex', 'isContract']
+    addresses_lookup = pd.merge(addresses_df, contracts_lookup, left_on='address_hex',
+                                right_on='address_hex', how='outer')
+    addresses_lookup['id'] = addresses_lookup.index
+
+    transaction_hashes = pd.DataFrame({'transaction_hash': sorted(transaction_hashes_set)},
+                                      columns=['transaction_hash'])
+    transaction_hashes['id'] = transaction_hashes.index
+    return addresses_lookup, transaction_hashes
+
+
+def load_existing_lookups(address_lookup_filename, transaction_lookup_filename) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Loads the lookups of an earlier run to extend them. The csv files are preferred, the binary indices next to them
+    are converted back otherwise.
+    :param address_lookup_filename: the path to the addresses lookup csv file
+    :param transaction_lookup_filename: the path to the transactions lookup csv file
+    :return: the address lookup and the transaction lookup, empty ones if there are none
+    """
+    lookups = []
+    for filename, key_column in [(address_lookup_filename, 'address_hex'),
+                                 (transaction_lookup_filename, 'transaction_hash')]:
+        if os.path.exists(filename):
+            lookups.append(pd.read_csv(filename))
+        elif os.path.isdir(get_index_path(filename)):
+            lookups.append(hash_index_to_lookup(HashIndex.load(get_index_path(filename), mmap_mode=None), key_column))
+        else:
+            columns = [key_column, 'isContract', 'id'] if key_column == 'address_hex' else [key_column, 'id']
+            lookups.append(pd.DataFrame({column: [] for column in columns}, columns=columns).astype({'id': np.int64}))
+    return lookups[0], lookups[1]
+
+
+def append_keys(lookup: pd.DataFrame, key_column, keys) -> pd.DataFrame:
+    """
+    Appends keys not in a lookup yet. Ids of existing keys never change, new keys get the ids following the highest id,
+    in sorted key order.
+    :param lookup: the lookup table with the key column and 'id'
+    :param key_column: the name of the key column
+    :param keys: the keys to add, e.g. the addresses of new raw transaction files
+    :return: the lookup with the appended rows at its end
+    """
+    keys = pd.Series(sorted(set(keys)), dtype=object)
+    unseen = keys[~keys.isin(lookup[key_column])].values
+    next_id = int(lookup['id'].max()) + 1 if len(lookup) else 0
+    appended = pd.DataFrame({key_column: unseen, 'id': np.arange(next_id, next_id + len(unseen), dtype=np.int64)},
+                            columns=[key_column, 'id'])
+    return pd.concat([lookup, appended], ignore_index=True, sort=False)[list(lookup.columns)]
+
+
+def extend_lookups(addresses_lookup: pd.DataFrame, transaction_lookup: pd.DataFrame, address_set: set,
+                   transaction_hashes_set: set, contracts_lookup: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame, int):
+    """
+    Extends the lookups of an earlier run, see 'append_keys', instead of building them from all raw transactions.
+    Extending empty lookups yields the lookups of 'build_lookups'.
+    :param addresses_lookup: the address lookup with the columns 'address_hex', 'isContract', 'id'
+    :param transaction_lookup: the transaction lookup with the columns 'transaction_hash', 'id'
+    :param address_set: the addresses found in the new raw transactions
+    :param transaction_hashes_set: the transaction hashes found in the new raw transactions
+    :param contracts_lookup: the contracts lookup with at least the column 'result.address'. Its addresses are added
+    and flagged as contracts.
+    :return: the extended address lookup, the extended transaction lookup, the amount of existing addresses turned
+    into contracts. Appended rows are at the end of the lookups.
+    """
+    contract_addresses = set(contracts_lookup['result.address'].dropna())
+    existing_addresses = len(addresses_lookup)
+    addresses_lookup = append_keys(addresses_lookup, 'address_hex', address_set | contract_addresses)
+
+    is_contract = addresses_lookup['address_hex'].isin(contract_addresses).values
+    was_contract = addresses_lookup['isContract'].iloc[:existing_addresses].eq(True).values
+    updated_contracts = int(np.sum(is_contract[:existing_addresses] & ~was_contract))
+    addresses_lookup['isContract'] = addresses_lookup['isContract'].astype(object)
+    addresses_lookup.loc[is_contract, 'isContract'] = True
+
+    transaction_lookup = append_keys(transaction_lookup, 'transaction_hash', transaction_hashes_set)
+    return addresses_lookup, transaction_lookup, updated_contracts
+
+
+def get_lookup_manifest_path(address_lookup_filename) -> str:
+    """
+    :param address_lookup_filename: the path to the addresses lookup csv file
+    :return: the path of the manifest of the raw transaction files the lookups were built from
+    """
+    return '{}{}'.format(os.path.splitext(address_lookup_filename)[0], LOOKUP_MANIFEST_SUFFIX)
@@ -0,0 +1,261 @@
+import functools
+import glob
+import ntpath
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from config.constants import RAW_TRANSACTION_COLUMN_NAMES, RAW_TRANSACTION_DTYPES
+from instrumentation import metrics
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
+# Rough in memory size of one typed row: the call input dominates, the hashes are categorical
+BYTES_PER_RAW_ROW = 1000
+# Raw transaction files are plain csv files or compressed ones, which are decompressed while reading
+RAW_TRANSACTION_EXTENSIONS = ('.csv', '.csv.gz', '.csv.zst')
+CSV_ENGINES = ('auto', 'c', 'pyarrow')
+# Seconds a prefetching thread waits for space in its queue before checking whether reading was cancelled
+PREFETCH_POLL_SECONDS = 0.1
+
+
+def get_raw_chunksize(memory_budget=None, workers=1, prefetch=0):
+    """
+    Evaluates how many raw transaction rows a single worker may read at once.
+    :param memory_budget: the memory in bytes all workers together may use for reading, None to read whole files
+    :param workers: the amount of parallel workers
+    :param prefetch: the amount of files every worker reads ahead, see 'get_held_chunks'
+    :return: the amount of rows per chunk, None to read whole files
+    """
+    if memory_budget is None:
+        return None
+    return max(1, int(memory_budget // (max(1, workers) * get_held_chunks(prefetch) * BYTES_PER_RAW_ROW)))
+
+
+def get_held_chunks(prefetch=0) -> int:
+    """
+    Without prefetching a reader holds one chunk. With prefetching it holds up to 3 chunks of the current file
+    (consumed, queued and being read) and 2 of every file read ahead (queued and being read), see 'prefetch_files'.
+    :param prefetch: the amount of files read ahead
+    :return: the amount of chunks held in memory at most
+    """
+    return 1 if prefetch <= 0 else 3 + 2 * prefetch
+
+
+def get_raw_transaction_infix(path) -> str:
+    """
+    :param path: the path to a raw transaction file, e.g. 'data/transactions5000000-5100000.csv.gz'
+    :return: the file name without its extension, e.g. 'transactions5000000-5100000'
+    """
+    filename = ntpath.basename(path)
+    for extension in sorted(RAW_TRANSACTION_EXTENSIONS, key=len, reverse=True):
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return os.path.splitext(filename)[0]
+
+
+def find_raw_transaction_files(directory=None, recursive=False) -> list:
+    """
+    Finds the files with any of RAW_TRANSACTION_EXTENSIONS, plain and compressed ones.
+    :param directory: the directory to search, None for the current directory. Paths are relative to it then.
+    :param recursive: search the subdirectories as well
+    :return: the paths in the order of glob, plain csv files first. The order numbers the mining results of new files.
+    """
+    pattern = '**/*' if recursive else '*'
+    if directory is not None:
+        pattern = os.path.join(directory, pattern)
+    paths = []
+    for extension in RAW_TRANSACTION_EXTENSIONS:
+        paths.extend(glob.glob(pattern + extension, recursive=recursive))
+    return paths
+
+
+def resolve_prefetch(prefetch=None, memory_budget=None, workers=1) -> int:
+    """
+    :param prefetch: the amount of files to read ahead, None for one file if reading in chunks within a memory budget
+    (the chunks read ahead count against it, see 'get_held_chunks') and none if reading whole files, which would hold
+    a second decoded file in memory
+    :param memory_budget: the memory in bytes all workers together may use for reading, None to read whole files
+    :param workers: the amount of parallel workers. Only a single process prefetches, workers of a pool read their
+    files themselves.
+    :return: the amount of files to read ahead
+    """
+    if workers > 1:
+        return 0
+    if prefetch is None:
+        return 1 if memory_budget is not None else 0
+    return prefetch
+
+
+def resolve_csv_engine(engine='auto', chunksize=None) -> str:
+    """
+    :param engine: one of CSV_ENGINES. 'auto' selects the multithreaded pyarrow reader if pyarrow is installed and whole
+    files are read, the pandas c engine otherwise.
+    :param chunksize: the amount of rows to read at once, None to read whole files
+    :return: the engine, 'c' or 'pyarrow'
+    """
+    if engine == 'auto':
+        return 'pyarrow' if pyarrow is not None and chunksize is None else 'c'
+    if engine == 'pyarrow':
+        if pyarrow is None:
+            raise ImportError('The pyarrow csv engine requires pyarrow')
+        if chunksize is not None:
+            raise ValueError('The pyarrow csv engine reads whole files only, reading in chunks requires the c engine')
+    return engine
+
+
+def matches_raw_transaction_pattern(path) -> bool:
+    """
+    :param path: the path to a csv file
+    :return: True if the header of the file holds the raw transaction columns
+    """
+    return RAW_TRANSACTION_COLUMN_NAMES.issubset(pd.read_csv(path, nrows=0).columns)
+
+
+def read_raw_transactions(path, chunksize=None, engine='c'):
+    """
+    Reads the columns of a raw transaction file required for parsing with the compact dtypes of
+    RAW_TRANSACTION_DTYPES. Rows keep their line number as index, also when read in chunks. Compressed files, see
+    RAW_TRANSACTION_EXTENSIONS, are decompressed while reading.
+    :param path: the path to the raw transaction csv file
+    :param chunksize: the amount of rows to read at once, None to read the whole file
+    :param engine: the resolved csv engine, see 'resolve_csv_engine'
+    :return: an iterator of the raw transaction chunks
+    """
+    # Tagged explicitly, files may be read on prefetching threads
+    file_infix = get_raw_transaction_infix(path)
+    if chunksize is None:
+        with metrics.stage('read_csv', file=file_infix, engine=engine) as record:
+            if engine == 'pyarrow':
+                raw_transactions = read_raw_transactions_pyarrow(path)
+            else:
+                raw_transactions = pd.read_csv(path, usecols=list(RAW_TRANSACTION_DTYPES),
+                                               dtype=RAW_TRANSACTION_DTYPES)
+            record['rows_out'] = len(raw_transactions)
+        yield raw_transactions
+        return
+
+    reader = pd.read_csv(path, usecols=list(RAW_TRANSACTION_DTYPES), dtype=RAW_TRANSACTION_DTYPES,
+                         chunksize=chunksize)
+    while True:
+        with metrics.stage('read_csv', file=file_infix, engine=engine) as record:
+            raw_transactions = next(reader, None)
+            record['rows_out'] = len(raw_transactions) if raw_transactions is not None else 0
+        if raw_transactions is None:
+            return
+        yield raw_transactions
+
+
+def read_raw_transactions_pyarrow(path) -> pd.DataFrame:
+    """
+    Reads a whole raw transaction file with the multithreaded csv reader of pyarrow, the result equals the one of the
+    c engine. Empty fields are missing values, as for pandas.
+    :param path: the path to the raw transaction csv file, compressed files are detected by their extension
+    :return: the raw transactions
+    """
+    convert_options = pyarrow.csv.ConvertOptions(include_columns=list(RAW_TRANSACTION_DTYPES), strings_can_be_null=True,
+                                                 column_types={'blockNumber': pyarrow.int64()})
+    with pyarrow.input_stream(path, compression='detect') as stream:
+        table = pyarrow.csv.read_csv(stream, read_options=pyarrow.csv.ReadOptions(use_threads=True),
+                                     convert_options=convert_options)
+    return table.to_pandas().astype(RAW_TRANSACTION_DTYPES)
+
+
+def prefetch_files(paths, read_function, prefetch=1):
+    """
+    Reads files on a background thread pool while the consumer processes earlier ones. Up to prefetch files are read
+    ahead of the file being consumed. Every file is read on its own thread into a queue holding at most one chunk,
+    hence the memory is bounded by the chunks queued and being read, see 'get_held_chunks'. The chunks of a file
+    have to be consumed before the next file is requested.
+    :param paths: the paths of the files in the order to consume them
+    :param read_function: a function taking a path and returning an iterator of its chunks, e.g.
+    'read_raw_transactions'
+    :param prefetch: the amount of files to read ahead, 0 to read every file when it is consumed
+    :return: an iterator of (path, iterator of its chunks) in the order of paths. Errors of reading a file are raised
+    while consuming its chunks.
+    """
+    paths = list(paths)
+    if prefetch <= 0:
+        for path in paths:
+            yield path, read_function(path)
+        return
+
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=prefetch + 1)
+    chunk_queues = []
+    try:
+        for i, path in enumerate(paths):
+            while len(chunk_queues) < min(len(paths), i + prefetch + 1):
+                chunk_queue = queue.Queue(maxsize=1)
+                executor.submit(fill_queue, functools.partial(read_function, paths[len(chunk_queues)]), chunk_queue,
+                                cancelled)
+                chunk_queues.append(chunk_queue)
+            yield path, drain_queue(chunk_queues[i])
+            chunk_queues[i] = None
+    finally:
+        # Threads of files not consumed stop at their next chunk
+        cancelled.set()
+        executor.shutdown(wait=True)
+
+
+def prefetch_raw_transactions(paths, prefetch=1, chunksize=None, engine='c'):
+    """
+    :param paths: the paths to the raw transaction csv files in the order to consume them
+    :param prefetch: the amount of files to read ahead, 0 to read every file when it is consumed
+    :param chunksize: the amount of rows to read at once, None to read whole files
+    :param engine: the resolved csv engine, see 'resolve_csv_engine'
+    :return: an iterator of (path, iterator of its raw transaction chunks), see 'prefetch_files'
+    """
+    return prefetch_files(paths, functools.partial(read_raw_transactions, chunksize=chunksize, engine=engine),
+                          prefetch)
+
+
+def fill_queue(read_chunks, chunk_queue: queue.Queue, cancelled: threading.Event):
+    """
+    Reads the chunks of a file into a queue, followed by None. An error is put in place of the remaining chunks.
+    :param read_chunks: a function returning an iterator of the chunks
+    :param chunk_queue: the queue
+    :param cancelled: set once the chunks are not consumed anymore
+    """
+    try:
+        for chunk in read_chunks():
+            if not put_chunk(chunk_queue, chunk, cancelled):
+                return
+    except Exception as error:
+        put_chunk(chunk_queue, error, cancelled)
+        return
+    put_chunk(chunk_queue, None, cancelled)
+
+
+def put_chunk(chunk_queue: queue.Queue, chunk, cancelled: threading.Event) -> bool:
+    """
+    :return: True once the chunk is queued, False if cancelled before
+    """
+    while not cancelled.is_set():
+        try:
+            chunk_queue.put(chunk, timeout=PREFETCH_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def drain_queue(chunk_queue: queue.Queue):
+    """
+    :param chunk_queue: a queue filled by 'fill_queue'
+    :return: an iterator of the chunks of the queue
+    """
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
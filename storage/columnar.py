@@ -0,0 +1,266 @@
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from parser.block_index import get_day_ordinals, day_ordinal_to_timestamp
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+OUTPUT_FORMATS = ('csv', 'columnar', 'parquet', 'npy')
+INDEX_COLUMN = '__index__'
+BUNDLE_META_FILENAME = '_columns.json'
+
+
+def resolve_output_format(output_format) -> str:
+    """
+    Resolves the output format to write with.
+    :param output_format: one of OUTPUT_FORMATS. 'columnar' selects parquet if pyarrow is installed, npy otherwise.
+    :return: 'csv', 'parquet' or 'npy'
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Unknown output format {}, expected one of {}'.format(output_format, OUTPUT_FORMATS))
+    if output_format == 'columnar':
+        return 'parquet' if pyarrow is not None else 'npy'
+    if output_format == 'parquet' and pyarrow is None:
+        raise ImportError('The parquet output format requires pyarrow')
+    return output_format
+
+
+def get_day_partition(day) -> str:
+    """
+    :param day: a day as timestamp or string
+    :return: the name of the partition directory of the day, e.g. 'day=2018-04-16'
+    """
+    return 'day={}'.format(pd.Timestamp(day).strftime('%Y-%m-%d'))
+
+
+def write_frame(frame: pd.DataFrame, dataset, day, part, output_format):
+    """
+    Writes a frame as one part of the day partition of a dataset, e.g. 'event_log/day=2018-04-16/<part>.parquet'.
+    :param frame: the frame to write, its index is kept
+    :param dataset: the directory of the dataset
+    :param day: the day of the frame
+    :param part: the name of the part, unique within a day (e.g. the name of the raw transaction file)
+    :param output_format: 'parquet' or 'npy'
+    """
+    directory = os.path.join(dataset, get_day_partition(day))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if output_format == 'parquet':
+        frame.to_parquet(os.path.join(directory, '{}.parquet'.format(part)), engine='pyarrow', index=True)
+    elif output_format == 'npy':
+        write_bundle(frame, os.path.join(directory, part))
+    else:
+        raise ValueError('Unknown columnar output format {}'.format(output_format))
+
+
+def write_frame_by_day(frame: pd.DataFrame, dataset, part, output_format, timestamp_column='timestamp'):
+    """
+    Writes a frame partitioned by the day of its timestamps.
+    :param frame: the frame to write
+    :param dataset: the directory of the dataset
+    :param part: the name of the part, unique within a day
+    :param output_format: 'parquet' or 'npy'
+    :param timestamp_column: the column holding the unix timestamps
+    """
+    for day_ordinal, group in frame.groupby(get_day_ordinals(frame[timestamp_column].values)):
+        write_frame(group, dataset, day_ordinal_to_timestamp(day_ordinal), part, output_format)
+
+
+def encode_strings(strings: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Encodes strings as utf-8 data with offsets. The strings are joined and encoded at once, the offsets are derived from
+    the string lengths and the positions of the bytes starting a character.
+    :param strings: the strings
+    :return: the utf-8 data as uint8 array, the int64 offsets of the strings into the data (one more than strings)
+    """
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, strings), dtype=np.int64, count=len(strings)), out=offsets[1:])
+    data = np.frombuffer(''.join(strings).encode('utf-8'), dtype=np.uint8)
+    if len(data) != offsets[-1]:
+        # Not ascii: the offsets count characters, utf-8 continuation bytes do not start one
+        starts = np.append(np.flatnonzero((data & 0xC0) != 0x80), len(data))
+        offsets = starts[offsets]
+    return data, offsets
+
+
+def decode_strings(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Decodes strings written by 'encode_strings'. The data is decoded at once and split at NUL characters inserted
+    between the strings, unless the strings contain NUL characters themselves.
+    :param data: the utf-8 data as uint8 array
+    :param offsets: the int64 offsets of the strings into the data
+    :return: an object array of the strings
+    """
+    strings = np.empty(len(offsets) - 1, dtype=object)
+    if len(strings) == 0:
+        return strings
+    data = np.asarray(data)
+    if (data == 0).any():
+        data = data.tobytes()
+        strings[:] = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(strings))]
+    else:
+        strings[:] = np.insert(data, offsets[1:-1], 0).tobytes().decode('utf-8').split('\x00')
+    return strings
+
+
+def write_bundle(frame: pd.DataFrame, directory):
+    """
+    Writes a frame as bundle of .npy files, one per column (and one for the index). Categorical columns are stored as
+    codes with their categories in the bundle meta data, other string columns as utf-8 data with int64 offsets and, if
+    any value is missing, a boolean mask of the present values.
+    :param frame: the frame to write
+    :param directory: the directory of the bundle
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    columns = []
+    for name, values in [(INDEX_COLUMN, frame.index.to_series())] + list(frame.items()):
+        name = str(name)
+        column = {'name': name}
+        if pd.api.types.is_categorical_dtype(values):
+            column['kind'] = 'categorical'
+            column['categories'] = [str(category) for category in values.cat.categories]
+            np.save(os.path.join(directory, '{}.npy'.format(name)), values.cat.codes.values)
+        elif values.dtype == object:
+            column['kind'] = 'string'
+            present = values.notna().values
+            data, offsets = encode_strings(values.where(present, '').astype(str).values)
+            np.save(os.path.join(directory, '{}.npy'.format(name)), data)
+            np.save(os.path.join(directory, '{}.offsets.npy'.format(name)), offsets)
+            if not present.all():
+                column['missing'] = True
+                np.save(os.path.join(directory, '{}.present.npy'.format(name)), present)
+        else:
+            column['kind'] = 'array'
+            np.save(os.path.join(directory, '{}.npy'.format(name)), values.values)
+        columns.append(column)
+    with open(os.path.join(directory, BUNDLE_META_FILENAME), 'w') as meta_file:
+        json.dump({'columns': columns}, meta_file)
+
+
+def read_bundle_column(directory, name, mmap_mode='r'):
+    """
+    Reads one column of a .npy bundle. Numeric columns and categorical codes are memory mapped.
+    :param directory: the directory of the bundle
+    :param name: the column name
+    :param mmap_mode: the numpy memory mapping mode, None to read into memory
+    :return: a numpy array, a pd.Categorical for categorical columns or an object array for string columns with NaN
+    for missing values
+    """
+    with open(os.path.join(directory, BUNDLE_META_FILENAME)) as meta_file:
+        column = [column for column in json.load(meta_file)['columns'] if column['name'] == name][0]
+    values = np.load(os.path.join(directory, '{}.npy'.format(name)), mmap_mode=mmap_mode)
+    if column['kind'] == 'categorical':
+        return pd.Categorical.from_codes(values, column['categories'])
+    if column['kind'] == 'string':
+        strings = decode_strings(values, np.load(os.path.join(directory, '{}.offsets.npy'.format(name))))
+        if column.get('missing', False):
+            strings[~np.load(os.path.join(directory, '{}.present.npy'.format(name)))] = np.nan
+        return strings
+    return values
+
+
+def read_bundle(directory, columns=None, mmap_mode='r') -> pd.DataFrame:
+    """
+    Reads a .npy bundle as frame.
+    :param directory: the directory of the bundle
+    :param columns: the columns to read, None for all
+    :param mmap_mode: the numpy memory mapping mode, None to read into memory
+    :return: the frame with its index
+    """
+    with open(os.path.join(directory, BUNDLE_META_FILENAME)) as meta_file:
+        names = [column['name'] for column in json.load(meta_file)['columns'] if column['name'] != INDEX_COLUMN]
+    columns = names if columns is None else columns
+    index = read_bundle_column(directory, INDEX_COLUMN, mmap_mode)
+    return pd.DataFrame({name: read_bundle_column(directory, name, mmap_mode) for name in columns},
+                        index=index, columns=columns)
+
+
+def get_partitions(dataset, start_day=None, end_day=None) -> list:
+    """
+    Lists the day partitions of a dataset within a range of days.
+    :param dataset: the directory of the dataset
+    :param start_day: the first day to include, None for no lower bound
+    :param end_day: the last day to include, None for no upper bound
+    :return: the sorted list of (day, partition directory)
+    """
+    partitions = []
+    for directory in glob.glob(os.path.join(dataset, 'day=*')):
+        day = pd.Timestamp(os.path.basename(directory)[len('day='):])
+        if (start_day is None or day >= pd.Timestamp(start_day)) and (end_day is None or day <= pd.Timestamp(end_day)):
+            partitions.append((day, directory))
+    return sorted(partitions)
+
+
+def get_parts(partition) -> list:
+    """
+    :param partition: the directory of a day partition
+    :return: the sorted list of parquet files and .npy bundles of the partition
+    """
+    parts = glob.glob(os.path.join(partition, '*.parquet'))
+    parts += [os.path.dirname(meta) for meta in glob.glob(os.path.join(partition, '*', BUNDLE_META_FILENAME))]
+    return sorted(parts)
+
+
+def read_part(part, columns=None) -> pd.DataFrame:
+    """
+    Reads a parquet file or a .npy bundle, memory mapped where possible.
+    :param part: the path of the parquet file or bundle directory
+    :param columns: the columns to read, None for all
+    :return: the frame
+    """
+    if part.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError('Reading parquet files requires pyarrow')
+        table = pyarrow.parquet.read_table(part, columns=columns, memory_map=True, use_pandas_metadata=True)
+        return table.to_pandas()
+    return read_bundle(part, columns)
+
+
+def read_dataset(dataset, columns=None, start_day=None, end_day=None) -> pd.DataFrame:
+    """
+    Reads the parts of a dataset within a range of days.
+    :param dataset: the directory of the dataset, e.g. '/[...]/parity_transactions/event_log'
+    :param columns: the columns to read, None for all
+    :param start_day: the first day to include, None for no lower bound
+    :param end_day: the last day to include, None for no upper bound
+    :return: the concatenated frame with an additional 'day' column
+    """
+    frames = []
+    for day, partition in get_partitions(dataset, start_day, end_day):
+        for part in get_parts(partition):
+            frame = read_part(part, columns)
+            frame['day'] = day
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=(columns or []) + ['day'])
+    return pd.concat(frames)
+
+
+def read_column(dataset, column, start_day=None, end_day=None) -> np.ndarray:
+    """
+    Reads a single column of a dataset within a range of days.
+    :param dataset: the directory of the dataset
+    :param column: the column name
+    :param start_day: the first day to include, None for no lower bound
+    :param end_day: the last day to include, None for no upper bound
+    :return: the concatenated values of the column
+    """
+    values = []
+    for day, partition in get_partitions(dataset, start_day, end_day):
+        for part in get_parts(partition):
+            if part.endswith('.parquet'):
+                values.append(np.asarray(read_part(part, [column])[column]))
+            else:
+                values.append(np.asarray(read_bundle_column(part, column)))
+    if not values:
+        return np.array([])
+    return np.concatenate(values)
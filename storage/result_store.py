@@ -0,0 +1,242 @@
+import argparse
+import glob
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from config.constants import ACTIVITY_ALPHABET
+from miner import heuristic_miner as miner
+from parser import event_log_parser as parser
+
+RESULT_STORE_FILENAME = 'mining_results.sqlite'
+DAY_FORMAT = '%Y-%m-%d'
+
+# Days are stored as 'YYYY-MM-DD' strings, hence day ranges are range scans of the primary keys
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS dependencies (day TEXT NOT NULL, transition TEXT NOT NULL, count INTEGER NOT NULL, '
+    'PRIMARY KEY (day, transition)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS dependencies_by_transition ON dependencies (transition, day)',
+    'CREATE TABLE IF NOT EXISTS confidences (day TEXT NOT NULL, transition TEXT NOT NULL, confidence REAL NOT NULL, '
+    'PRIMARY KEY (day, transition)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS confidences_by_transition ON confidences (transition, day)',
+    'CREATE TABLE IF NOT EXISTS case_amounts (day TEXT NOT NULL PRIMARY KEY, cases INTEGER NOT NULL) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS trace_lengths (day TEXT NOT NULL, trace_length INTEGER NOT NULL, '
+    'transactions INTEGER NOT NULL, PRIMARY KEY (day, trace_length)) WITHOUT ROWID',
+]
+TABLES = ('dependencies', 'confidences', 'case_amounts', 'trace_lengths')
+
+
+def connect(store) -> sqlite3.Connection:
+    """
+    Opens a result store and creates its tables if missing.
+    :param store: the path of the SQLite file or an open connection
+    :return: the connection
+    """
+    if isinstance(store, sqlite3.Connection):
+        return store
+    connection = sqlite3.connect(store)
+    with connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+    return connection
+
+
+def format_day(day) -> str:
+    """
+    :param day: a day, anything pd.Timestamp accepts
+    :return: the day as stored, e.g. '2018-04-16'
+    """
+    return pd.Timestamp(day).strftime(DAY_FORMAT)
+
+
+def write_results(store, dependencies: pd.DataFrame, case_amount: pd.DataFrame, trace_lengths: pd.Series):
+    """
+    Replaces the results of a store with the reduced results of the orchestrator in a single transaction. Only observed
+    transitions and trace lengths are stored, confidences are derived per day from the transition counts.
+    :param store: the path of the SQLite file or an open connection
+    :param dependencies: the transition counts in the wide per day layout with a 'day' column or index
+    :param case_amount: the case amounts with a 'day' column or index and the column 'cases'
+    :param trace_lengths: the sparse trace length histogram indexed by 'day' and 'trace_length'
+    """
+    days, transition_counts = miner.transition_frame_to_tensor(dependencies)
+    confidence = miner.compute_dependency_confidence_matrix(transition_counts)
+    labels = miner.get_transition_labels(ACTIVITY_ALPHABET)
+    day_labels = np.array([format_day(day) for day in days], dtype=object)
+    observed_days, observed_transitions = np.nonzero(transition_counts.reshape(len(days), -1))
+    dependency_rows = zip(day_labels[observed_days].tolist(), labels[observed_transitions].tolist(),
+                          transition_counts.reshape(len(days), -1)[observed_days, observed_transitions].tolist())
+    confidence_rows = zip(day_labels[observed_days].tolist(), labels[observed_transitions].tolist(),
+                          confidence.reshape(len(days), -1)[observed_days, observed_transitions].tolist())
+
+    if 'day' in case_amount.columns:
+        case_amount = case_amount.set_index('day')
+    case_rows = zip([format_day(day) for day in case_amount.index], case_amount['cases'].astype(np.int64).tolist())
+    trace_length_rows = zip([format_day(day) for day in trace_lengths.index.get_level_values('day')],
+                            trace_lengths.index.get_level_values('trace_length').astype(np.int64).tolist(),
+                            trace_lengths.values.astype(np.int64).tolist())
+
+    connection = connect(store)
+    with connection:
+        for table in TABLES:
+            connection.execute('DELETE FROM {}'.format(table))
+        connection.executemany('INSERT INTO dependencies VALUES (?, ?, ?)', dependency_rows)
+        connection.executemany('INSERT INTO confidences VALUES (?, ?, ?)', confidence_rows)
+        connection.executemany('INSERT INTO case_amounts VALUES (?, ?)', case_rows)
+        connection.executemany('INSERT INTO trace_lengths VALUES (?, ?, ?)', trace_length_rows)
+    if connection is not store:
+        connection.close()
+
+
+def get_conditions(start_day=None, end_day=None, transitions=None) -> (str, list):
+    """
+    :param start_day: the first day, None for no lower bound
+    :param end_day: the last day (inclusive), None for no upper bound
+    :param transitions: the transitions to select, e.g. ['CtC->UtU'], None for all
+    :return: the WHERE clause, its parameters
+    """
+    conditions = []
+    parameters = []
+    if start_day is not None:
+        conditions.append('day >= ?')
+        parameters.append(format_day(start_day))
+    if end_day is not None:
+        conditions.append('day <= ?')
+        parameters.append(format_day(end_day))
+    if transitions is not None:
+        transitions = list(transitions)
+        conditions.append('transition IN ({})'.format(', '.join('?' * len(transitions))))
+        parameters.extend(transitions)
+    return ('WHERE {}'.format(' AND '.join(conditions)) if conditions else ''), parameters
+
+
+def query(store, sql, parameters=()) -> pd.DataFrame:
+    """
+    :param store: the path of the SQLite file or an open connection
+    :param sql: the query
+    :param parameters: the parameters of the query
+    :return: the result with the column 'day' parsed, if selected
+    """
+    connection = connect(store)
+    try:
+        result = pd.read_sql_query(sql, connection, params=list(parameters))
+    finally:
+        if connection is not store:
+            connection.close()
+    if 'day' in result.columns:
+        result['day'] = pd.to_datetime(result['day'])
+    return result
+
+
+def query_dependencies(store, start_day=None, end_day=None, transitions=None, wide=False) -> pd.DataFrame:
+    """
+    :param store: the path of the SQLite file or an open connection
+    :param start_day: the first day, None for the first stored day
+    :param end_day: the last day (inclusive), None for the last stored day
+    :param transitions: the transitions to select, e.g. ['CtC->UtU'], None for all
+    :param wide: pivot to one row per day and a column per transition, as in the reduced global dependencies
+    :return: the transition counts with the columns 'day', 'transition', 'count'
+    """
+    where, parameters = get_conditions(start_day, end_day, transitions)
+    result = query(store, 'SELECT day, transition, count FROM dependencies {} ORDER BY day, transition'.format(where),
+                   parameters)
+    if wide:
+        return result.pivot(index='day', columns='transition', values='count').fillna(0).astype(np.int64)
+    return result
+
+
+def query_confidences(store, start_day=None, end_day=None, transitions=None, wide=False) -> pd.DataFrame:
+    """
+    :param store: the path of the SQLite file or an open connection
+    :param start_day: the first day, None for the first stored day
+    :param end_day: the last day (inclusive), None for the last stored day
+    :param transitions: the transitions to select, e.g. ['CtC->UtU'], None for all
+    :param wide: pivot to one row per day and a column per transition
+    :return: the confidences of every day with the columns 'day', 'transition', 'confidence'
+    """
+    where, parameters = get_conditions(start_day, end_day, transitions)
+    result = query(store, 'SELECT day, transition, confidence FROM confidences {} ORDER BY day, transition'.format(
+        where), parameters)
+    if wide:
+        return result.pivot(index='day', columns='transition', values='confidence')
+    return result
+
+
+def query_case_amounts(store, start_day=None, end_day=None) -> pd.DataFrame:
+    """
+    :param store: the path of the SQLite file or an open connection
+    :param start_day: the first day, None for the first stored day
+    :param end_day: the last day (inclusive), None for the last stored day
+    :return: the case amounts with the columns 'day', 'cases'
+    """
+    where, parameters = get_conditions(start_day, end_day)
+    return query(store, 'SELECT day, cases FROM case_amounts {} ORDER BY day'.format(where), parameters)
+
+
+def query_trace_lengths(store, start_day=None, end_day=None) -> pd.DataFrame:
+    """
+    :param store: the path of the SQLite file or an open connection
+    :param start_day: the first day, None for the first stored day
+    :param end_day: the last day (inclusive), None for the last stored day
+    :return: the trace length histogram with the columns 'day', 'trace_length', 'transactions'
+    """
+    where, parameters = get_conditions(start_day, end_day)
+    return query(store, 'SELECT day, trace_length, transactions FROM trace_lengths {} ORDER BY day, trace_length'.format(
+        where), parameters)
+
+
+def query_transition_summary(store, start_day=None, end_day=None, transitions=None) -> pd.DataFrame:
+    """
+    Summarizes the transitions of a day range, e.g. the count and confidence of 'CtC->UtU' in May.
+    :param store: the path of the SQLite file or an open connection
+    :param start_day: the first day, None for the first stored day
+    :param end_day: the last day (inclusive), None for the last stored day
+    :param transitions: the transitions to select, None for all
+    :return: a pd.DataFrame indexed by 'transition' with the summed 'count' and the 'confidence' of the summed counts
+    """
+    where, parameters = get_conditions(start_day, end_day)
+    counts = query(store, 'SELECT transition, SUM(count) AS count FROM dependencies {} GROUP BY transition '
+                          'ORDER BY transition'.format(where), parameters)
+    counts = pd.Series(counts['count'].values.astype(np.int64), index=pd.Index(counts['transition'], name='transition'))
+    # The confidence of a transition depends on its reverse transition, hence all transitions are summed
+    summary = pd.DataFrame({'count': counts, 'confidence': miner.compute_dependency_confidence(counts).values},
+                           index=counts.index, columns=['count', 'confidence'])
+    if transitions is not None:
+        summary = summary.reindex(list(transitions))
+    return summary
+
+
+def import_reduced_files(store, directory):
+    """
+    Imports the latest reduced csv files of an output directory, e.g. of runs before the store was written.
+    :param store: the path of the SQLite file or an open connection
+    :param directory: the directory of the rgd_, rgca_ and rgtl_ csv files
+    """
+    latest = {}
+    for prefix in ['rgd', 'rgca', 'rgtl']:
+        paths = sorted(glob.glob(os.path.join(directory, '{}_*.csv'.format(prefix))), key=os.path.getmtime)
+        if not paths:
+            raise IOError('No {}_ file in {}'.format(prefix, directory))
+        latest[prefix] = paths[-1]
+    dependencies = pd.read_csv(latest['rgd'], index_col=0, parse_dates=True)
+    case_amount = pd.read_csv(latest['rgca'], index_col=0, parse_dates=True)
+    trace_lengths = parser.trace_lengths_to_series(pd.read_csv(latest['rgtl'], index_col=0, parse_dates=True))
+    write_results(store, dependencies, case_amount, trace_lengths)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Imports the reduced csv files of the orchestrator into a '
+                                                          'result store.')
+    argument_parser.add_argument('directory', help='output directory of the orchestrator')
+    argument_parser.add_argument('--result-store', default=None,
+                                 help='SQLite file to write, {} in the directory if not given'.format(
+                                     RESULT_STORE_FILENAME))
+    args = argument_parser.parse_args()
+    store = args.result_store or os.path.join(args.directory, RESULT_STORE_FILENAME)
+    import_reduced_files(store, args.directory)
+    print('Imported the reduced results of {} into {}'.format(args.directory, store))
+
+
+if __name__ == '__main__':
+    main()
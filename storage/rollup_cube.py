@@ -0,0 +1,326 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from config.constants import ACTIVITY_ALPHABET
+from parser.block_index import get_day_ordinals
+from miner import heuristic_miner as miner
+
+# Granularities from fine to coarse. Cubes are built at one of the fixed size ones and rolled up to coarser ones.
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+BUCKET_SECONDS = {'hour': 3600, 'day': 86400}
+ROLLUP_DIRECTORY = 'rollup_cube'
+CUBE_ARRAYS = ('buckets', 'transition_counts', 'cases', 'trace_length_buckets', 'trace_lengths',
+               'trace_length_amounts')
+
+
+class RollupCube(object):
+    """
+    Additive mining aggregates per time bucket: the transition counts, the case amounts and the trace length histogram
+    of every bucket. Buckets are identified by their start as unix timestamp in seconds.
+
+    Cubes are built from parsed events at a fixed granularity, e.g. hours, with the day semantics of the orchestrator:
+    transitions are derived per day, including its end transition rule, and count towards the bucket of the row
+    emitting them. A case and its trace length count towards the bucket of its first event of the day. Hence rolling a
+    cube up to days yields exactly the results of 'mine_segment_by_day', and coarser buckets or time ranges the sums of
+    their days, as in the reduced outputs. Confidences are derived from the summed counts.
+
+    Cubes are saved as a directory of .npy files and memory mapped on load.
+    """
+
+    def __init__(self, granularity, buckets: np.ndarray, transition_counts: np.ndarray, cases: np.ndarray,
+                 trace_length_buckets: np.ndarray, trace_lengths: np.ndarray, trace_length_amounts: np.ndarray,
+                 alphabet=ACTIVITY_ALPHABET, path=None):
+        """
+        :param granularity: the granularity of the buckets, one of GRANULARITIES
+        :param buckets: the sorted bucket starts
+        :param transition_counts: a (buckets, len(alphabet), len(alphabet)) tensor
+        :param cases: the case amount of every bucket
+        :param trace_length_buckets: the sorted bucket starts of the trace length histogram entries
+        :param trace_lengths: the trace lengths of the entries
+        :param trace_length_amounts: the amounts of transactions of the entries
+        :param alphabet: the activities of the matrix rows and columns
+        :param path: the directory the cube was loaded from
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError('Unknown granularity {}, expected one of {}'.format(granularity, GRANULARITIES))
+        self.granularity = granularity
+        self.buckets = buckets
+        self.transition_counts = transition_counts
+        self.cases = cases
+        self.trace_length_buckets = trace_length_buckets
+        self.trace_lengths = trace_lengths
+        self.trace_length_amounts = trace_length_amounts
+        self.alphabet = tuple(alphabet)
+        self.path = path
+        self.cumulative = None
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def __reduce__(self):
+        if self.path is not None:
+            return RollupCube.load, (self.path,)
+        return RollupCube, (self.granularity,) + tuple(getattr(self, name) for name in CUBE_ARRAYS) + (self.alphabet,)
+
+    def merge(self, other):
+        """
+        Adds the aggregates of another cube, e.g. of another raw transaction file. The merge is associative and
+        commutative.
+        :param other: a RollupCube of the same granularity and alphabet
+        :return: the merged RollupCube
+        """
+        if other.granularity != self.granularity or other.alphabet != self.alphabet:
+            raise ValueError('Can not merge a {} cube into a {} cube'.format(other.granularity, self.granularity))
+        return self.aggregate(self.granularity,
+                              np.concatenate([self.buckets, other.buckets]),
+                              np.concatenate([self.transition_counts, other.transition_counts]),
+                              np.concatenate([self.cases, other.cases]),
+                              np.concatenate([self.trace_length_buckets, other.trace_length_buckets]),
+                              np.concatenate([self.trace_lengths, other.trace_lengths]),
+                              np.concatenate([self.trace_length_amounts, other.trace_length_amounts]))
+
+    def rollup(self, granularity):
+        """
+        :param granularity: the target granularity, one of GRANULARITIES not finer than the one of the cube
+        :return: the RollupCube of the coarser buckets
+        """
+        if GRANULARITIES.index(granularity) < GRANULARITIES.index(self.granularity):
+            raise ValueError('Can not roll a {} cube up to {}'.format(self.granularity, granularity))
+        if granularity == self.granularity:
+            return self
+        return self.aggregate(granularity, get_bucket_starts(self.buckets, granularity), self.transition_counts,
+                              self.cases, get_bucket_starts(self.trace_length_buckets, granularity),
+                              self.trace_lengths, self.trace_length_amounts)
+
+    def aggregate(self, granularity, buckets, transition_counts, cases, trace_length_buckets, trace_lengths,
+                  trace_length_amounts):
+        """
+        :return: the RollupCube of the given aggregates, summed over equal buckets and trace lengths
+        """
+        (buckets,), (transition_counts, cases) = _sum_by_keys((buckets,), (transition_counts, cases))
+        (trace_length_buckets, trace_lengths), (trace_length_amounts,) = _sum_by_keys(
+            (trace_length_buckets, trace_lengths), (trace_length_amounts,))
+        return RollupCube(granularity, buckets, transition_counts, cases, trace_length_buckets, trace_lengths,
+                          trace_length_amounts, self.alphabet)
+
+    def get_range(self, start=None, end=None) -> (int, int):
+        """
+        :param start: the start of the time range, anything pd.Timestamp accepts, None for the first bucket
+        :param end: the end of the time range (exclusive), None for the last bucket
+        :return: the positions [first, last) of the buckets starting within the time range
+        """
+        first = 0 if start is None else int(np.searchsorted(self.buckets, _to_seconds(start), side='left'))
+        last = len(self.buckets) if end is None else int(np.searchsorted(self.buckets, _to_seconds(end), side='left'))
+        return first, max(first, last)
+
+    def get_trace_length_entries(self, first, last) -> slice:
+        """
+        :param first: the position of the first bucket
+        :param last: the position behind the last bucket
+        :return: the trace length histogram entries of the buckets
+        """
+        if first >= last:
+            return slice(0, 0)
+        return slice(int(np.searchsorted(self.trace_length_buckets, self.buckets[first], side='left')),
+                     int(np.searchsorted(self.trace_length_buckets, self.buckets[last - 1], side='right')))
+
+    def select(self, start=None, end=None):
+        """
+        :param start: the start of the time range, anything pd.Timestamp accepts, None for the first bucket
+        :param end: the end of the time range (exclusive), None for the last bucket
+        :return: the RollupCube of the buckets starting within the time range
+        """
+        first, last = self.get_range(start, end)
+        entries = self.get_trace_length_entries(first, last)
+        return RollupCube(self.granularity, self.buckets[first:last], self.transition_counts[first:last],
+                          self.cases[first:last], self.trace_length_buckets[entries], self.trace_lengths[entries],
+                          self.trace_length_amounts[entries], self.alphabet)
+
+    def query(self, start=None, end=None) -> (np.ndarray, int, pd.Series):
+        """
+        Sums the aggregates of the buckets starting within a time range.
+        :param start: the start of the time range, anything pd.Timestamp accepts, None for the first bucket
+        :param end: the end of the time range (exclusive), None for the last bucket
+        :return: the (len(alphabet), len(alphabet)) transition matrix, the amount of cases and the trace length
+        histogram as pd.Series of transaction amounts indexed by 'trace_length'
+        """
+        first, last = self.get_range(start, end)
+        if self.cumulative is None:
+            width = len(self.alphabet)
+            self.cumulative = (np.concatenate([np.zeros((1, width, width), dtype=np.int64),
+                                               np.cumsum(self.transition_counts, axis=0)]),
+                               np.concatenate([[0], np.cumsum(self.cases)]))
+        cumulative_counts, cumulative_cases = self.cumulative
+        transition_counts = cumulative_counts[last] - cumulative_counts[first]
+        cases = int(cumulative_cases[last] - cumulative_cases[first])
+
+        entries = self.get_trace_length_entries(first, last)
+        (trace_lengths,), (amounts,) = _sum_by_keys((self.trace_lengths[entries],),
+                                                    (self.trace_length_amounts[entries],))
+        trace_lengths = pd.Series(amounts, index=pd.Index(trace_lengths, name='trace_length'), name='transactions')
+        return transition_counts, cases, trace_lengths
+
+    def query_confidence(self, start=None, end=None) -> np.ndarray:
+        """
+        :param start: the start of the time range, anything pd.Timestamp accepts, None for the first bucket
+        :param end: the end of the time range (exclusive), None for the last bucket
+        :return: the confidence matrix of the summed transitions of the time range, see
+        'compute_dependency_confidence_matrix'
+        """
+        return miner.compute_dependency_confidence_matrix(self.query(start, end)[0])
+
+    def to_frames(self) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.Series):
+        """
+        :return: the layouts of the orchestrator with one row per bucket and the column of the granularity instead of
+        'day': the dependencies and confidences with a column per transition, the case amounts, and the sparse trace
+        length histogram indexed by the granularity and 'trace_length'
+        """
+        # Memory mapped arrays are read only, pandas converts copies
+        times = pd.to_datetime(np.array(self.buckets, dtype=np.int64), unit='s')
+        dependencies = miner.transition_tensor_to_frame(times, self.transition_counts, self.alphabet)
+        confidences = miner.confidence_tensor_to_frame(
+            times, miner.compute_dependency_confidence_matrix(self.transition_counts), self.alphabet)
+        case_amount = pd.DataFrame({'day': times, 'cases': np.asarray(self.cases, dtype=np.int64)},
+                                   columns=['day', 'cases'])
+        index = pd.MultiIndex.from_arrays([pd.to_datetime(np.array(self.trace_length_buckets, dtype=np.int64),
+                                                          unit='s'), np.array(self.trace_lengths, dtype=np.int64)],
+                                          names=[self.granularity, 'trace_length'])
+        trace_lengths = pd.Series(np.asarray(self.trace_length_amounts, dtype=np.int64), index=index,
+                                  name='transactions')
+        return tuple(frame.rename(columns={'day': self.granularity}) for frame in
+                     (dependencies, confidences, case_amount)) + (trace_lengths,)
+
+    def save(self, path):
+        """
+        Saves the cube as a directory of .npy files.
+        :param path: the directory to save to
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in CUBE_ARRAYS:
+            np.save(os.path.join(path, '{}.npy'.format(name)), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump({'granularity': self.granularity, 'alphabet': list(self.alphabet)}, meta_file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads a cube saved with 'save'.
+        :param path: the directory of the cube
+        :param mmap_mode: the numpy memory mapping mode, None to read the arrays into memory
+        :return: the RollupCube
+        """
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        arrays = [np.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode=mmap_mode) for name in CUBE_ARRAYS]
+        return cls(meta['granularity'], *arrays, alphabet=meta['alphabet'],
+                   path=path if mmap_mode is not None else None)
+
+
+def get_bucket_starts(timestamps, granularity) -> np.ndarray:
+    """
+    :param timestamps: unix timestamps in seconds
+    :param granularity: one of GRANULARITIES. Weeks start on Mondays.
+    :return: an int64 array with the start of the bucket of every timestamp
+    """
+    timestamps = np.asarray(timestamps).astype(np.int64)
+    if granularity in BUCKET_SECONDS:
+        return timestamps // BUCKET_SECONDS[granularity] * BUCKET_SECONDS[granularity]
+    if granularity == 'week':
+        # The epoch is a Thursday
+        day_ordinals = get_day_ordinals(timestamps)
+        return (day_ordinals - (day_ordinals + 3) % 7) * BUCKET_SECONDS['day']
+    if granularity == 'month':
+        return timestamps.astype('datetime64[s]').astype('datetime64[M]').astype('datetime64[s]').astype(np.int64)
+    raise ValueError('Unknown granularity {}, expected one of {}'.format(granularity, GRANULARITIES))
+
+
+def build_rollup_cube(events: pd.DataFrame, granularity='hour', day_transitions=None) -> RollupCube:
+    """
+    Builds the cube of parsed events.
+    :param events: the events as returned by the parser, with at least the columns 'timestamp', 'transaction_id' and
+    'transaction_type'
+    :param granularity: the granularity of the buckets, 'hour' or 'day'
+    :param day_transitions: the positions of the events, the transition codes and their rows of every day as collected
+    by 'mine_segment_by_day', None to derive them
+    :return: the RollupCube
+    """
+    if granularity not in BUCKET_SECONDS:
+        raise ValueError('Cubes are built at one of the granularities {}'.format(sorted(BUCKET_SECONDS)))
+    width = len(ACTIVITY_ALPHABET)
+    timestamps = events['timestamp'].values.astype(np.int64)
+    day_ordinals = get_day_ordinals(timestamps)
+    buckets, row_buckets = np.unique(get_bucket_starts(timestamps, granularity), return_inverse=True)
+
+    # Transitions are derived per day and count towards the bucket of the row emitting them
+    transition_counts = np.zeros(len(buckets) * width * width, dtype=np.int64)
+    if day_transitions is None:
+        day_transitions = [(positions,) + miner.compute_transition_codes(events.iloc[positions])[:2]
+                           for positions in events.groupby(day_ordinals).indices.values()]
+    for positions, transition_codes, rows in day_transitions:
+        transition_counts += np.bincount(row_buckets[positions[rows]] * width * width + transition_codes,
+                                         minlength=len(transition_counts))
+
+    # Cases of the days count towards the bucket of their first event of the day
+    transaction_ids = events['transaction_id'].values.astype(np.int64)
+    # A single int64 key per day and transaction id, ordered as the pairs
+    transaction_ids = transaction_ids - transaction_ids.min(initial=0)
+    trace_keys = day_ordinals * (transaction_ids.max(initial=0) + 1) + transaction_ids
+    _, first_rows, lengths = np.unique(trace_keys, return_index=True, return_counts=True)
+    trace_buckets = row_buckets[first_rows]
+    cases = np.bincount(trace_buckets, minlength=len(buckets)).astype(np.int64)
+    (trace_buckets, lengths), (amounts,) = _sum_by_keys((trace_buckets, lengths),
+                                                        (np.ones(len(lengths), dtype=np.int64),))
+    return RollupCube(granularity, buckets, transition_counts.reshape(len(buckets), width, width), cases,
+                      buckets[trace_buckets], lengths.astype(np.int64), amounts)
+
+
+def _sum_by_keys(keys, values) -> (tuple, tuple):
+    """
+    :param keys: arrays of equal length, together identifying the entries
+    :param values: arrays to sum along their first axis over the entries of equal keys
+    :return: the sorted unique keys, the sums
+    """
+    keys = tuple(np.asarray(key, dtype=np.int64) for key in keys)
+    values = tuple(np.asarray(value) for value in values)
+    if len(keys[0]) == 0:
+        return keys, values
+    order = np.lexsort(keys[::-1])
+    keys = tuple(key[order] for key in keys)
+    changes = np.zeros(len(order), dtype=bool)
+    changes[0] = True
+    for key in keys:
+        changes[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(changes)
+    return tuple(key[starts] for key in keys), tuple(np.add.reduceat(value[order], starts, axis=0) for value in values)
+
+
+def _to_seconds(time) -> int:
+    return pd.Timestamp(time).value // 10 ** 9
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Rolls a cube written by the orchestrator up to coarser '
+                                                          'buckets and writes dependencies, confidences, case amounts '
+                                                          'and trace lengths.')
+    argument_parser.add_argument('path_cube', help='directory of the cube')
+    argument_parser.add_argument('--granularity', choices=GRANULARITIES, default='day')
+    argument_parser.add_argument('--start', default=None, help='start of the time range, e.g. 2018-04-16')
+    argument_parser.add_argument('--end', default=None, help='end of the time range (exclusive)')
+    argument_parser.add_argument('--prefix', default='cube', help='prefix of the written csv files')
+    args = argument_parser.parse_args()
+
+    cube = RollupCube.load(args.path_cube).select(args.start, args.end)
+    dependencies, confidences, case_amount, trace_lengths = cube.rollup(args.granularity).to_frames()
+    for name, frame in [('dependencies', dependencies), ('confidences', confidences), ('case_amount', case_amount),
+                        ('trace_lengths', trace_lengths)]:
+        frame.to_csv('{}_{}_{}.csv'.format(args.prefix, args.granularity, name))
+    print('Wrote {} {} buckets'.format(len(dependencies), args.granularity))
+
+
+if __name__ == '__main__':
+    main()
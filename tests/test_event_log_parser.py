@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from parser import event_log_parser as parser
+from parser.actor_attributes import build_actor_attributes
+from parser.hash_index import build_address_index
+
+
+def get_addresses_lookup() -> pd.DataFrame:
+    return pd.DataFrame({'address_hex': ['0x' + '11' * 20, '0x' + '22' * 20],
+                         'isContract': [True, False],
+                         'isERC20': [True, False],
+                         'id': [0, 1]})
+
+
+def get_events() -> pd.DataFrame:
+    # A contract calling a user, a user calling a contract and a user calling a user of the same transaction
+    return pd.DataFrame({'total_pos': [1, 2, 3],
+                         'action.input': ['0x', '0x', '0x'],
+                         'sender_id': [0, 1, 1],
+                         'receiver_id': [1, 0, 1],
+                         'timestamp': [1523318400, 1523318401, 1523318402],
+                         'transaction_id': [7, 7, 7],
+                         'type': ['call', 'call', 'call']})
+
+
+def check_actor_types(events: pd.DataFrame):
+    assert events['sender_type'].tolist() == ['C', 'U', 'U']
+    assert events['receiver_type'].tolist() == ['U', 'C', 'U']
+    assert events['transaction_type'].tolist() == ['CtU', 'UtC', 'UtU']
+    assert events['senderIsContract'].tolist() == [True, False, False]
+    assert events['senderIsERC20'].tolist() == [True, False, False]
+
+
+def test_build_event_log_types_contract_and_user_senders():
+    events, trace_lengths = parser.build_event_log(get_events(), get_addresses_lookup())
+    check_actor_types(events)
+    assert trace_lengths.tolist() == [1]
+    assert trace_lengths.index.get_level_values('trace_length').tolist() == [3]
+
+
+def test_build_event_log_types_senders_of_an_address_index():
+    addresses_lookup = build_address_index(get_addresses_lookup())
+    events, trace_lengths = parser.build_event_log(get_events(), addresses_lookup,
+                                                   build_actor_attributes(addresses_lookup))
+    check_actor_types(events)
+
+
+def test_build_event_log_types_unknown_senders_as_users():
+    events = get_events()
+    events['sender_id'] = [np.nan, 5, 1]
+    events, trace_lengths = parser.build_event_log(events, get_addresses_lookup())
+    assert events['sender_type'].tolist() == ['U', 'U', 'U']
+    assert events['sender_id'].tolist() == [-1, 5, 1]
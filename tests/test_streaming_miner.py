@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from miner import heuristic_miner as miner
+from miner.streaming_miner import StreamingMiner
+from parser.block_index import get_day_ordinals, day_ordinal_to_timestamp
+
+BLOCK_PADDING = 1000000000
+
+
+def get_events() -> pd.DataFrame:
+    # Three days of events in block order, the last transaction of a day continues on the next one
+    rng = np.random.RandomState(0)
+    timestamps = np.sort(rng.randint(1523318400, 1523318400 + 3 * 86400, size=60))
+    transaction_ids = np.cumsum(rng.rand(60) < 0.4)
+    midnight = np.searchsorted(timestamps, 1523318400 + 86400)
+    transaction_ids[midnight] = transaction_ids[midnight - 1]
+    return pd.DataFrame({'total_pos': (timestamps - 1523318400) // 600 * BLOCK_PADDING + np.arange(60),
+                         'timestamp': timestamps,
+                         'transaction_id': transaction_ids,
+                         'transaction_type': rng.choice(['CtC', 'CtU', 'UtC', 'UtU'], size=60)})
+
+
+def mine_by_day(events: pd.DataFrame) -> list:
+    # The per day results of 'mine_segment_by_day'
+    results = []
+    for day_ordinal, group in events.groupby(get_day_ordinals(events['timestamp'].values)):
+        transitions, transitions_agg, transition_matrix = miner.compute_transitions_with_matrix(group)
+        results.append((day_ordinal_to_timestamp(day_ordinal), transition_matrix, transitions_agg,
+                        miner.compute_dependency_confidence(transitions_agg), group['transaction_id'].nunique(),
+                        transitions))
+    return results
+
+
+def check_day_results(day_results, events: pd.DataFrame):
+    expected = mine_by_day(events)
+    assert len(day_results) == len(expected) == 3
+    for result, (day, transition_matrix, transitions_agg, confidence, cases, transitions) in zip(day_results,
+                                                                                                  expected):
+        assert result.day == day
+        assert np.array_equal(result.transition_matrix, transition_matrix)
+        pd.testing.assert_series_equal(result.transitions_agg, transitions_agg)
+        pd.testing.assert_series_equal(result.confidence, confidence)
+        assert result.cases == cases
+        pd.testing.assert_frame_equal(result.transitions, transitions)
+
+
+@pytest.mark.parametrize('batch_size', [60, 7])
+def test_streaming_miner_batches_equal_the_day_mining(batch_size):
+    events = get_events()
+    streaming_miner = StreamingMiner(keep_transitions=True, block_padding=BLOCK_PADDING)
+    day_results = []
+    for start in range(0, len(events), batch_size):
+        day_results += streaming_miner.consume(events.iloc[start:start + batch_size])
+    check_day_results(day_results + streaming_miner.close(), events)
+
+
+def test_streaming_miner_single_events_equal_the_day_mining():
+    events = get_events()
+    streaming_miner = StreamingMiner(keep_transitions=True, block_padding=BLOCK_PADDING)
+    day_results = []
+    for label, event in events.iterrows():
+        day_results += streaming_miner.consume_event(event['transaction_id'], event['transaction_type'],
+                                                     event['timestamp'], event['total_pos'], label)
+    check_day_results(day_results + streaming_miner.close(), events)
+
+
+def test_streaming_miner_keeps_the_next_label_of_rejected_batches():
+    events = get_events()
+    streaming_miner = StreamingMiner(block_padding=BLOCK_PADDING)
+    streaming_miner.consume(events.iloc[:10])
+    unknown = events.iloc[10:20].copy()
+    unknown['transaction_type'] = 'XtY'
+    with pytest.raises(ValueError):
+        streaming_miner.consume(unknown)
+    with pytest.raises(ValueError):
+        streaming_miner.consume_event(events['transaction_id'].iloc[0], 'CtC', events['timestamp'].iloc[0] - 86400,
+                                      events['total_pos'].iloc[0])
+    assert streaming_miner.next_label == 10
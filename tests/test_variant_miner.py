@@ -0,0 +1,62 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+from miner import variant_miner
+from parser.block_index import get_day_ordinals, day_ordinal_to_timestamp
+
+# Ids of 10 bits, hence distinct variants collide
+HASH_MASK = 0x3FF
+
+
+def get_events() -> pd.DataFrame:
+    # Two days of cases with 1 to 8 events of random transaction types
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(1, 9, size=600)
+    timestamps = np.sort(rng.randint(1523318400, 1523318400 + 2 * 86400, size=lengths.sum()))
+    return pd.DataFrame({'timestamp': timestamps,
+                         'transaction_id': np.repeat(np.arange(len(lengths)), lengths),
+                         'transaction_type': rng.choice(['CtC', 'CtU', 'UtC', 'UtU'], size=lengths.sum())})
+
+
+def count_variants(events: pd.DataFrame) -> collections.Counter:
+    # Cases are runs of rows of the same transaction id within a day
+    counts = collections.Counter()
+    day_ordinals = get_day_ordinals(events['timestamp'].values)
+    keys = list(zip(day_ordinals, events['transaction_id']))
+    sequence = []
+    for i, (key, transaction_type) in enumerate(zip(keys, events['transaction_type'])):
+        sequence.append(transaction_type)
+        if i == len(keys) - 1 or keys[i + 1] != key:
+            counts[(day_ordinal_to_timestamp(key[0]), tuple(sequence))] += 1
+            sequence = []
+    return counts
+
+
+def test_compute_variants_counts_colliding_variants_apart(monkeypatch):
+    hash_sequences = variant_miner.hash_sequences
+    hash_sequence = variant_miner.hash_sequence
+    monkeypatch.setattr(variant_miner, 'hash_sequences', lambda *args: hash_sequences(*args) & HASH_MASK)
+    monkeypatch.setattr(variant_miner, 'hash_sequence', lambda *args: hash_sequence(*args) & HASH_MASK)
+    events = get_events()
+    expected = count_variants(events)
+    sequences = {sequence for day, sequence in expected}
+    assert len({variant_miner.hash_sequence(sequence) for sequence in sequences}) < len(sequences)
+
+    variants, dictionary = variant_miner.compute_variants(events)
+    counts = collections.Counter({(day, dictionary.get_sequence(variant_id)): cases
+                                  for (day, variant_id), cases in variants.items()})
+    assert counts == expected
+    assert len(dictionary) == len(sequences)
+
+
+def test_variant_dictionary_add_assigns_colliding_sequences_other_ids():
+    dictionary = variant_miner.VariantDictionary()
+    assert dictionary.add(5, ('CtC',)) == 5
+    assert dictionary.add(5, ('CtC',)) == 5
+    other_id = dictionary.add(5, ('UtC', 'CtU'))
+    assert other_id != 5
+    assert dictionary.add(5, ('UtC', 'CtU')) == other_id
+    assert dictionary.get_sequence(5) == ('CtC',)
+    assert dictionary.get_sequence(other_id) == ('UtC', 'CtU')